@@ -1,22 +1,30 @@
 # base
-from typing import Annotated
+from typing import Annotated, List
 # installed
-from fastapi import APIRouter, status, Depends, HTTPException
+from fastapi import APIRouter, Body, status, Depends, HTTPException
 from fastapi.security import OAuth2PasswordRequestForm
+from jose.exceptions import ExpiredSignatureError, JWTError
+from pydantic import ValidationError
 from sqlalchemy.exc import NoResultFound
 from sqlalchemy.ext.asyncio import AsyncSession
 # local
-from app.services.dependencies import get_db_session
+from app.models.librarian import Librarian
+from app.services.dependencies import get_db_session, get_current_user
 from app.services.reader_service import ReaderService
 from app.services.librarian_service import LibrarianService
 from app.services.auth_service import AuthService
-from app.schemas.user import CreateReader, CreateLibrarian
+from app.services.hashing import PasswordHasherBusy
+from app.schemas.auth import RefreshToken, TokenPair
+from app.schemas.user import CreateReader, CreateLibrarian, ReaderResponse, LibrarianResponse, ReaderBatchSummary
 
 
 router = APIRouter(prefix="/auth", tags=["Auth"])
 
+# максимальное количество читателей в одном пакетном запросе
+READERS_BATCH_MAX_ITEMS = 10000
 
-@router.post("/registration/reader", status_code=status.HTTP_201_CREATED)
+
+@router.post("/registration/reader", status_code=status.HTTP_201_CREATED, response_model=ReaderResponse)
 async def reader_registration(
         db: Annotated[AsyncSession, Depends(get_db_session)],
         reader_data: CreateReader
@@ -27,18 +35,37 @@ async def reader_registration(
     return reader
 
 
-@router.post("/registration/librarian", status_code=status.HTTP_201_CREATED)
+@router.post("/registration/readers:batch", status_code=status.HTTP_200_OK, response_model=ReaderBatchSummary)
+async def readers_batch_registration(
+        db: Annotated[AsyncSession, Depends(get_db_session)],
+        librarian: Annotated[Librarian, Depends(get_current_user)],
+        readers: Annotated[List[CreateReader], Body(min_length=1, max_length=READERS_BATCH_MAX_ITEMS)]
+):
+    """ Регистрация пакета читателей библиотекарем. Уже зарегистрированные адреса возвращаются в duplicates,
+    некорректные - в rejected, остальные читатели создаются """
+    reader_service = ReaderService(db)
+    return await reader_service.create_readers_batch(readers)
+
+
+@router.post("/registration/librarian", status_code=status.HTTP_201_CREATED, response_model=LibrarianResponse)
 async def librarian_registration(
         db: Annotated[AsyncSession, Depends(get_db_session)],
         librarian_data: CreateLibrarian
 ):
     """ Регистрация библиотекаря """
     librarian_service = LibrarianService(db)
-    librarian = await librarian_service.create_particular_librarian(librarian_data)
+    try:
+        librarian = await librarian_service.create_particular_librarian(librarian_data)
+    except PasswordHasherBusy as error:
+        raise HTTPException(
+            detail=error.args[0],
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={"Retry-After": "1"}
+        )
     return librarian
 
 
-@router.post("/login", status_code=status.HTTP_200_OK)
+@router.post("/login", status_code=status.HTTP_200_OK, response_model=TokenPair)
 async def login(
         db: Annotated[AsyncSession, Depends(get_db_session)],
         form_data: OAuth2PasswordRequestForm = Depends()
@@ -55,7 +82,15 @@ async def login(
         )
 
     hashed_pass = librarian.password
-    if not auth_service.verify_password(form_data.password, hashed_pass):
+    try:
+        password_valid = await auth_service.verify_password(form_data.password, hashed_pass)
+    except PasswordHasherBusy as error:
+        raise HTTPException(
+            detail=error.args[0],
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={"Retry-After": "1"}
+        )
+    if not password_valid:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Неправильная почта или пароль"
@@ -64,4 +99,33 @@ async def login(
     return {
         "access_token": auth_service.create_access_token(librarian.email),
         "refresh_token": auth_service.create_refresh_token(librarian.email),
-    }
\ No newline at end of file
+    }
+
+
+@router.post("/refresh", status_code=status.HTTP_200_OK, response_model=TokenPair)
+async def refresh(
+        db: Annotated[AsyncSession, Depends(get_db_session)],
+        token_data: RefreshToken
+):
+    """ Получение новой пары токенов по refresh токену """
+    auth_service = AuthService(db)
+    try:
+        return await auth_service.refresh_tokens(token_data.refresh_token)
+    except ExpiredSignatureError:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Токен истек",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    except (JWTError, ValidationError):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Не удалось проверить учетные данные",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    except ValueError as error:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail=error.args[0],
+            headers={"WWW-Authenticate": "Bearer"},
+        )
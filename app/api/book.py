@@ -1,48 +1,175 @@
 # base
-from typing import Annotated
+from typing import Annotated, List, Literal, Optional
 # installed
-from fastapi import APIRouter, status, Depends, HTTPException
+from fastapi import APIRouter, status, Depends, HTTPException, Query, Body, Header, UploadFile, Request, Response
+from fastapi.responses import StreamingResponse
+import orjson
 from sqlalchemy.exc import NoResultFound
 from sqlalchemy.ext.asyncio import AsyncSession
 # local
 from app.models.librarian import Librarian
-from app.services.dependencies import get_db_session, get_current_user
+from app.services.dependencies import get_db_session, get_read_session, get_current_user, read_session_maker
+from app.services.availability import AVAILABILITY_MAX_BOOK_IDS, AVAILABILITY_STREAM_ENABLED, availability_hub
 from app.services.book_service import BookService
-from app.schemas.book import CreateBook, UpdateBook
+from app.services.import_service import BookImportService
+from app.services.overdue_service import OverdueService
+from app.services.other import (
+    PreconditionFailed,
+    cache_headers,
+    collection_validators,
+    is_conditional,
+    is_not_modified,
+    row_etag,
+)
+from app.schemas.book import (
+    CreateBook,
+    UpdateBook,
+    BatchUpdateBook,
+    BorrowItem,
+    BookResponse,
+    BookPage,
+    BookSearchResult,
+    BorrowedBookResponse,
+    OverdueLoanPage,
+    BorrowResult,
+    BookUpdateResult,
+    ImportSummary,
+)
 
 
 router = APIRouter(prefix="/books", tags=["Book"])
 
+# максимальное количество пар книга-читатель в одном пакетном запросе
+BATCH_MAX_ITEMS = 500
 
-@router.get("/", status_code=status.HTTP_200_OK)
+
+@router.get("/", status_code=status.HTTP_200_OK, response_model=BookPage)
 async def get_books(
-        db: Annotated[AsyncSession, Depends(get_db_session)]
+        request: Request,
+        response: Response,
+        db: Annotated[AsyncSession, Depends(get_read_session)],
+        limit: Annotated[int, Query(ge=1, le=500)] = 50,
+        cursor: Optional[str] = None,
+        order_by: Literal["id", "author"] = "id"
+):
+    """ Получение страницы книг. Для следующей страницы нужно передать next_cursor из ответа.
+    Поддерживает условные запросы: If-None-Match и If-Modified-Since """
+    book_service = BookService(db)
+    try:
+        if is_conditional(request.headers):
+            # сверяются только версии книг страницы, без загрузки и сериализации всех колонок
+            versions, next_cursor = await book_service.get_all_books_versions(limit, cursor, order_by)
+            etag, last_modified = collection_validators(versions, next_cursor)
+            if is_not_modified(request.headers, etag, last_modified):
+                return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=cache_headers(etag, last_modified))
+        books, next_cursor = await book_service.get_all_books(limit, cursor, order_by)
+    except ValueError as error:
+        raise HTTPException(
+            detail=error.args[0],
+            status_code=status.HTTP_400_BAD_REQUEST
+        )
+    response.headers.update(cache_headers(*collection_validators(books, next_cursor)))
+    return {"items": books, "next_cursor": next_cursor}
+
+
+@router.get("/stream", status_code=status.HTTP_200_OK)
+async def stream_books(
+        request: Request,
+        batch_size: Annotated[int, Query(ge=1, le=10000)] = 1000
+):
+    """ Потоковая выгрузка всего каталога в формате NDJSON """
+    session_maker = read_session_maker(request)
+
+    async def generate():
+        # сессия открывается внутри генератора, так как зависимость get_read_session
+        # закрывается раньше, чем будет отправлено тело ответа
+        async with session_maker() as db:
+            book_service = BookService(db)
+            async for batch in book_service.stream_all_books(batch_size):
+                yield b"".join(orjson.dumps(book) + b"\n" for book in batch)
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+@router.get("/availability/stream", status_code=status.HTTP_200_OK)
+async def stream_availability(
+        book_ids: Annotated[Optional[List[int]], Query(max_length=AVAILABILITY_MAX_BOOK_IDS)] = None
+):
+    """ Изменения количества экземпляров в формате text/event-stream вместо опроса каталога.
+    Без book_ids передаются изменения всех книг. События: availability - список {id, copies_quantity}
+    (null - книга удалена), resync - изменения пропущены, каталог нужно перечитать """
+    if not AVAILABILITY_STREAM_ENABLED:
+        raise HTTPException(
+            detail="Поток доступности книг отключен",
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+    return StreamingResponse(
+        availability_hub.stream(book_ids),
+        media_type="text/event-stream",
+        # события не должны задерживаться в буферах прокси
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.get("/search", status_code=status.HTTP_200_OK, response_model=List[BookSearchResult])
+async def search_books(
+        db: Annotated[AsyncSession, Depends(get_read_session)],
+        q: Annotated[str, Query(min_length=1, max_length=200)],
+        limit: Annotated[int, Query(ge=1, le=100)] = 20
 ):
-    """ Получение всех книг """
+    """ Поиск книг по названию, автору и описанию с учетом опечаток """
     book_service = BookService(db)
-    return await book_service.get_all_books()
+    return await book_service.search_books(q, limit)
+
+
+@router.get("/overdue", status_code=status.HTTP_200_OK, response_model=OverdueLoanPage)
+async def get_overdue_loans(
+        db: Annotated[AsyncSession, Depends(get_read_session)],
+        librarian: Annotated[Librarian, Depends(get_current_user)],
+        limit: Annotated[int, Query(ge=1, le=500)] = 50,
+        cursor: Optional[str] = None
+):
+    """ Просроченные выдачи, начиная с самых давних. Для следующей страницы нужно передать next_cursor из ответа """
+    overdue_service = OverdueService(db)
+    try:
+        loans, next_cursor = await overdue_service.get_overdue_loans(limit, cursor)
+    except ValueError as error:
+        raise HTTPException(
+            detail=error.args[0],
+            status_code=status.HTTP_400_BAD_REQUEST
+        )
+    return {"items": loans, "next_cursor": next_cursor}
 
 
-@router.get("/{book_id}", status_code=status.HTTP_200_OK)
+@router.get("/{book_id}", status_code=status.HTTP_200_OK, response_model=BookResponse)
 async def get_book(
-        db: Annotated[AsyncSession, Depends(get_db_session)],
+        request: Request,
+        response: Response,
+        db: Annotated[AsyncSession, Depends(get_read_session)],
         librarian: Annotated[Librarian, Depends(get_current_user)],
         book_id: int):
-    """ Получение конкретной книги """
+    """ Получение конкретной книги. Поддерживает условные запросы: If-None-Match и If-Modified-Since """
     book_service = BookService(db)
     try:
-        book = await book_service.get_particular_book(book_id)
-        return book
+        if is_conditional(request.headers):
+            # книга загружается, только если ее версия изменилась
+            version, updated_at = await book_service.get_book_version(book_id)
+            etag = row_etag(book_id, version)
+            if is_not_modified(request.headers, etag, updated_at):
+                return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=cache_headers(etag, updated_at))
+        book = await book_service.get_book_data(book_id)
     except NoResultFound:
         raise HTTPException(
             detail="Книги с таким id не существует",
             status_code=status.HTTP_400_BAD_REQUEST
         )
+    response.headers.update(cache_headers(row_etag(book_id, book["version"]), book["updated_at"]))
+    return book
 
 
-@router.get("/reader/{reader_id}", status_code=status.HTTP_200_OK)
+@router.get("/reader/{reader_id}", status_code=status.HTTP_200_OK, response_model=List[BorrowedBookResponse])
 async def get_reader_books(
-        db: Annotated[AsyncSession, Depends(get_db_session)],
+        db: Annotated[AsyncSession, Depends(get_read_session)],
         librarian: Annotated[Librarian, Depends(get_current_user)],
         reader_id: int
 ):
@@ -58,7 +185,7 @@ async def get_reader_books(
         )
 
 
-@router.post("/", status_code=status.HTTP_201_CREATED)
+@router.post("/", status_code=status.HTTP_201_CREATED, response_model=BookResponse)
 async def create_book(
         db: Annotated[AsyncSession, Depends(get_db_session)],
         librarian: Annotated[Librarian, Depends(get_current_user)],
@@ -70,21 +197,66 @@ async def create_book(
     return book
 
 
+@router.post("/import", status_code=status.HTTP_200_OK, response_model=ImportSummary)
+async def import_books(
+        db: Annotated[AsyncSession, Depends(get_db_session)],
+        librarian: Annotated[Librarian, Depends(get_current_user)],
+        file: UploadFile,
+        file_format: Literal["csv", "ndjson"] = "csv"
+):
+    """ Массовый импорт каталога из CSV или NDJSON файла с обновлением книг по isbn """
+    import_service = BookImportService(db)
+    try:
+        return await import_service.import_books(file.file, file_format)
+    except ValueError as error:
+        raise HTTPException(
+            detail=error.args[0],
+            status_code=status.HTTP_400_BAD_REQUEST
+        )
+
+
+@router.patch("/update:batch", status_code=status.HTTP_200_OK, response_model=List[BookUpdateResult])
+async def update_books_batch(
+        db: Annotated[AsyncSession, Depends(get_db_session)],
+        librarian: Annotated[Librarian, Depends(get_current_user)],
+        items: Annotated[List[BatchUpdateBook], Body(min_length=1, max_length=BATCH_MAX_ITEMS)]
+):
+    """ Пакетное обновление книг, меняются только переданные поля. Если указана version,
+    книга обновляется только при совпадении версии. Результат возвращается по каждой книге """
+    book_service = BookService(db)
+    try:
+        return await book_service.update_books_batch(items)
+    except ValueError as error:
+        raise HTTPException(
+            detail=error.args[0],
+            status_code=status.HTTP_400_BAD_REQUEST
+        )
+
+
 @router.patch("/{book_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def update_book(
+        response: Response,
         db: Annotated[AsyncSession, Depends(get_db_session)],
         librarian: Annotated[Librarian, Depends(get_current_user)],
         book_id: int,
-        book_data: UpdateBook):
-    """ Обновление книги """
+        book_data: UpdateBook,
+        if_match: Annotated[Optional[str], Header()] = None):
+    """ Обновление книги, меняются только переданные поля. С заголовком If-Match книга обновляется,
+    только если ее ETag не изменился """
     book_service = BookService(db)
     try:
-        await book_service.update_particular_book(book_id, book_data)
+        version, updated_at = await book_service.update_particular_book(book_id, book_data, if_match)
     except NoResultFound:
         raise HTTPException(
             detail="Книги с таким id не существует",
             status_code=status.HTTP_400_BAD_REQUEST
         )
+    except PreconditionFailed:
+        raise HTTPException(
+            detail="Книга изменена другим запросом, получите ее заново",
+            status_code=status.HTTP_412_PRECONDITION_FAILED
+        )
+    response.headers.update(cache_headers(row_etag(book_id, version), updated_at))
 
 
 @router.delete("/{book_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -104,7 +276,11 @@ async def delete_book(
         )
 
 
-@router.post("/borrow/{book_id}/reader/{reader_id}", status_code=status.HTTP_201_CREATED)
+@router.post(
+    "/borrow/{book_id}/reader/{reader_id}",
+    status_code=status.HTTP_201_CREATED,
+    response_model=BorrowedBookResponse
+)
 async def borrow_book_reader(
         db: Annotated[AsyncSession, Depends(get_db_session)],
         librarian: Annotated[Librarian, Depends(get_current_user)],
@@ -127,7 +303,11 @@ async def borrow_book_reader(
         )
 
 
-@router.post("/return/{book_id}/reader/{reader_id}", status_code=status.HTTP_200_OK)
+@router.post(
+    "/return/{book_id}/reader/{reader_id}",
+    status_code=status.HTTP_200_OK,
+    response_model=BorrowedBookResponse
+)
 async def return_book_library(
         db: Annotated[AsyncSession, Depends(get_db_session)],
         librarian: Annotated[Librarian, Depends(get_current_user)],
@@ -148,3 +328,25 @@ async def return_book_library(
             detail="Книги или пользователя с такими id не существует",
             status_code=status.HTTP_400_BAD_REQUEST
         )
+
+
+@router.post("/borrow:batch", status_code=status.HTTP_200_OK, response_model=List[BorrowResult])
+async def borrow_books_batch(
+        db: Annotated[AsyncSession, Depends(get_db_session)],
+        librarian: Annotated[Librarian, Depends(get_current_user)],
+        items: Annotated[List[BorrowItem], Body(min_length=1, max_length=BATCH_MAX_ITEMS)]
+):
+    """ Пакетная выдача книг читателям, результат возвращается по каждой паре """
+    book_service = BookService(db)
+    return await book_service.borrow_books_batch(items)
+
+
+@router.post("/return:batch", status_code=status.HTTP_200_OK, response_model=List[BorrowResult])
+async def return_books_batch(
+        db: Annotated[AsyncSession, Depends(get_db_session)],
+        librarian: Annotated[Librarian, Depends(get_current_user)],
+        items: Annotated[List[BorrowItem], Body(min_length=1, max_length=BATCH_MAX_ITEMS)]
+):
+    """ Пакетный возврат книг в библиотеку, результат возвращается по каждой паре """
+    book_service = BookService(db)
+    return await book_service.return_books_batch(items)
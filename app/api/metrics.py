@@ -0,0 +1,14 @@
+# installed
+from fastapi import APIRouter, status
+from fastapi.responses import PlainTextResponse
+# local
+from app.backend.metrics import render_metrics
+
+
+router = APIRouter(tags=["Metrics"])
+
+
+@router.get("/metrics", status_code=status.HTTP_200_OK, response_class=PlainTextResponse)
+async def get_metrics():
+    """ Метрики приложения в текстовом формате Prometheus """
+    return render_metrics()
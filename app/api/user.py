@@ -1,22 +1,23 @@
 # base
-from typing import Annotated
+from typing import Annotated, List, Optional
 # installed
-from fastapi import APIRouter, status, Depends, HTTPException
+from fastapi import APIRouter, status, Depends, HTTPException, Header, Query, Request, Response
 from sqlalchemy.exc import NoResultFound
 from sqlalchemy.ext.asyncio import AsyncSession
 # local
 from app.models.librarian import Librarian
-from app.services.dependencies import get_db_session, get_current_user
-from app.schemas.user import UpdateReader
+from app.services.dependencies import get_db_session, get_read_session, get_current_user
+from app.schemas.user import UpdateReader, ReaderResponse, ReaderDashboard, ReaderHistoryPage, ReaderStats
 from app.services.reader_service import ReaderService
+from app.services.other import PreconditionFailed, row_etag, cache_headers, is_conditional, is_not_modified
 
 
 router = APIRouter(prefix="/users", tags=["User"])
 
 
-@router.get("/readers")
+@router.get("/readers", response_model=List[ReaderResponse])
 async def get_readers(
-        db: Annotated[AsyncSession, Depends(get_db_session)],
+        db: Annotated[AsyncSession, Depends(get_read_session)],
         librarian: Annotated[Librarian, Depends(get_current_user)],
 ):
     """ Получение всех читателей """
@@ -24,16 +25,86 @@ async def get_readers(
     return await reader_service.get_all_readers()
 
 
-@router.get("/readers/{reader_id}")
+@router.get("/readers/{reader_id}", response_model=ReaderResponse)
 async def get_reader(
-        db: Annotated[AsyncSession, Depends(get_db_session)],
+        request: Request,
+        response: Response,
+        db: Annotated[AsyncSession, Depends(get_read_session)],
+        librarian: Annotated[Librarian, Depends(get_current_user)],
+        reader_id: int
+):
+    """ Получение одного читателя. Поддерживает условные запросы: If-None-Match и If-Modified-Since """
+    reader_service = ReaderService(db)
+    try:
+        if is_conditional(request.headers):
+            # читатель загружается, только если его версия изменилась
+            version, updated_at = await reader_service.get_reader_version(reader_id)
+            etag = row_etag(reader_id, version)
+            if is_not_modified(request.headers, etag, updated_at):
+                return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=cache_headers(etag, updated_at))
+        reader = await reader_service.get_particular_reader(reader_id)
+    except NoResultFound:
+        raise HTTPException(
+            detail="Читателя с таким id не существует",
+            status_code=status.HTTP_400_BAD_REQUEST
+        )
+    response.headers.update(cache_headers(row_etag(reader_id, reader.version), reader.updated_at))
+    return reader
+
+
+@router.get("/readers/{reader_id}/dashboard", response_model=ReaderDashboard)
+async def get_reader_dashboard(
+        db: Annotated[AsyncSession, Depends(get_read_session)],
         librarian: Annotated[Librarian, Depends(get_current_user)],
         reader_id: int
 ):
-    """ Получение одного читателя """
+    """ Читатель и его активные выдачи вместе с названиями и авторами книг """
     reader_service = ReaderService(db)
     try:
-        await reader_service.get_particular_reader(reader_id)
+        return await reader_service.get_reader_dashboard(reader_id)
+    except NoResultFound:
+        raise HTTPException(
+            detail="Читателя с таким id не существует",
+            status_code=status.HTTP_400_BAD_REQUEST
+        )
+
+
+@router.get("/readers/{reader_id}/history", response_model=ReaderHistoryPage)
+async def get_reader_history(
+        db: Annotated[AsyncSession, Depends(get_read_session)],
+        librarian: Annotated[Librarian, Depends(get_current_user)],
+        reader_id: int,
+        limit: Annotated[int, Query(ge=1, le=500)] = 50,
+        cursor: Optional[str] = None
+):
+    """ История выдач читателя от новых к старым, включая архив. Для следующей страницы нужно передать
+    next_cursor из ответа """
+    reader_service = ReaderService(db)
+    try:
+        loans, next_cursor = await reader_service.get_reader_history(reader_id, limit, cursor)
+    except NoResultFound:
+        raise HTTPException(
+            detail="Читателя с таким id не существует",
+            status_code=status.HTTP_400_BAD_REQUEST
+        )
+    except ValueError as error:
+        raise HTTPException(
+            detail=error.args[0],
+            status_code=status.HTTP_400_BAD_REQUEST
+        )
+    return {"items": loans, "next_cursor": next_cursor}
+
+
+@router.get("/readers/{reader_id}/stats", response_model=ReaderStats)
+async def get_reader_stats(
+        db: Annotated[AsyncSession, Depends(get_read_session)],
+        librarian: Annotated[Librarian, Depends(get_current_user)],
+        reader_id: int
+):
+    """ Статистика выдач читателя: количество, средний срок чтения и любимые авторы """
+    reader_service = ReaderService(db)
+    try:
+        return await reader_service.get_reader_stats(reader_id)
     except NoResultFound:
         raise HTTPException(
             detail="Читателя с таким id не существует",
@@ -43,20 +114,29 @@ async def get_reader(
 
 @router.patch("/readers/{reader_id}")
 async def update_reader(
+        response: Response,
         db: Annotated[AsyncSession, Depends(get_db_session)],
         librarian: Annotated[Librarian, Depends(get_current_user)],
         reader_id: int,
-        reader_data: UpdateReader
+        reader_data: UpdateReader,
+        if_match: Annotated[Optional[str], Header()] = None
 ):
-    """ Обновление одного читателя """
+    """ Обновление одного читателя, меняются только переданные поля. С заголовком If-Match читатель обновляется,
+    только если его ETag не изменился """
     reader_service = ReaderService(db)
     try:
-        await reader_service.update_particular_reader(reader_id, reader_data)
+        version, updated_at = await reader_service.update_particular_reader(reader_id, reader_data, if_match)
     except NoResultFound:
         raise HTTPException(
             detail="Читателя с таким id не существует",
             status_code=status.HTTP_400_BAD_REQUEST
         )
+    except PreconditionFailed:
+        raise HTTPException(
+            detail="Читатель изменен другим запросом, получите его заново",
+            status_code=status.HTTP_412_PRECONDITION_FAILED
+        )
+    response.headers.update(cache_headers(row_etag(reader_id, version), updated_at))
 
 
 @router.patch("/readers/{reader_id}")
@@ -0,0 +1,34 @@
+# base
+import argparse
+import asyncio
+import time
+# local
+from app.backend.db import async_session_maker, engine
+from app.services.archive_service import (
+    ARCHIVE_AFTER_DAYS,
+    ARCHIVE_BATCH_PAUSE_SECONDS,
+    ARCHIVE_BATCH_SIZE,
+    BorrowArchiveService,
+)
+
+
+async def archive(batch_size: int, after_days: int, pause: float):
+    """ Переносит в архив все накопившиеся закрытые выдачи и печатает количество """
+    started_at = time.perf_counter()
+    async with async_session_maker() as db:
+        moved = await BorrowArchiveService(db).archive_returned(batch_size, after_days, pause)
+    await engine.dispose()
+    print(f"перенесено выдач: {moved} за {time.perf_counter() - started_at:.1f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Перенос закрытых выдач из borrowed_book в архив")
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE, help="выдач в одной транзакции")
+    parser.add_argument(
+        "--after-days", type=int, default=ARCHIVE_AFTER_DAYS, help="через сколько дней после возврата переносить"
+    )
+    parser.add_argument(
+        "--pause", type=float, default=ARCHIVE_BATCH_PAUSE_SECONDS, help="пауза между пачками в секундах"
+    )
+    args = parser.parse_args()
+    asyncio.run(archive(args.batch_size, args.after_days, args.pause))
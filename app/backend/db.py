@@ -1,10 +1,22 @@
 # base
 import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+from uuid import uuid4
 # install
 from dotenv import load_dotenv
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession, AsyncEngine
 from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool
+# local
+from app.backend.metrics import Counter, Gauge, Histogram
 
+# .env загружается один раз для всего приложения: db импортируется раньше модулей, которые читают настройки
 load_dotenv()
 
 db_name = os.getenv("POSTGRES_DB")
@@ -13,11 +25,185 @@ password = os.getenv("POSTGRES_PASSWORD")
 host = os.getenv("POSTGRES_HOST")
 port = os.getenv("POSTGRES_PORT")
 
+
+def env_flag(name: str, default: bool) -> bool:
+    """ Булева настройка из переменной окружения: 1/true/yes/on """
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# постоянные соединения пула и сколько можно открыть сверх них под пиковую нагрузку
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 20))
+# сколько секунд запрос ждет свободное соединение, прежде чем получить ошибку
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))
+# через сколько секунд соединение переоткрывается, -1 - никогда
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+# проверка соединения перед выдачей из пула, стоит включать, если БД или сеть обрывают простаивающие соединения
+DB_POOL_PRE_PING = env_flag("DB_POOL_PRE_PING", False)
+# режим работы через PgBouncer в режиме transaction: без подготовленных выражений и без своего пула
+DB_PGBOUNCER = env_flag("DB_PGBOUNCER", False)
+# размер кэша подготовленных выражений на соединение при прямом подключении к PostgreSQL
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", 500))
+
+DB_POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Время получения соединения из пула, включая открытие нового",
+    ["pool"]
+)
+DB_POOL_CHECKOUT_TIMEOUTS = Counter(
+    "db_pool_checkout_timeouts_total",
+    "Запросы, не дождавшиеся свободного соединения",
+    ["pool"]
+)
+DB_POOL_CHECKED_OUT = Gauge("db_pool_checked_out", "Выданные из пула соединения", ["pool"])
+DB_POOL_OVERFLOW = Gauge("db_pool_overflow", "Открытые сверх размера пула соединения", ["pool"])
+
+
+class InstrumentedPoolMixin:
+    """ Замеряет ожидание соединения и заполненность пула """
+    # имя пула в метриках
+    label = "primary"
+
+    def _update_gauges(self):
+        DB_POOL_CHECKED_OUT.set(self.checkedout(), self.label)
+        DB_POOL_OVERFLOW.set(max(0, self.overflow()), self.label)
+
+    def _do_get(self):
+        started_at = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            DB_POOL_CHECKOUT_TIMEOUTS.inc(self.label)
+            raise
+        finally:
+            DB_POOL_CHECKOUT_WAIT.observe(time.perf_counter() - started_at, self.label)
+        self._update_gauges()
+        return connection
+
+    def _do_return_conn(self, record):
+        super()._do_return_conn(record)
+        self._update_gauges()
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.label = self.label
+        return pool
+
+
+class InstrumentedAsyncPool(InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+# заголовки X-DB-Queries и Server-Timing с количеством и временем запросов в БД в каждом ответе
+QUERY_STATS_HEADERS = env_flag("QUERY_STATS_HEADERS", False)
+# запросы к приложению, выполнившие больше запросов в БД, пишутся в лог, 0 - не писать
+QUERY_LOG_THRESHOLD = int(os.getenv("QUERY_LOG_THRESHOLD", 10))
+
+
+class QueryStats:
+    """ Количество запросов в БД и суммарное время их выполнения в рамках одного запроса к приложению """
+    __slots__ = ("count", "duration", "parent")
+
+    def __init__(self, parent: Optional["QueryStats"] = None):
+        self.count = 0
+        self.duration = 0.0
+        # статистика внешнего блока track_queries, запросы вложенного блока учитываются и в ней
+        self.parent = parent
+
+
+# статистика текущего запроса к приложению, None - запросы не считаются (например, в фоновых задачах)
+current_query_stats: ContextVar[Optional[QueryStats]] = ContextVar("current_query_stats", default=None)
+
+
+@contextmanager
+def track_queries():
+    """ Считает запросы в БД, выполненные внутри блока, в том числе в задачах, созданных в нем.
+    Блоки могут быть вложенными: запрос учитывается во всех блоках, внутри которых выполнен """
+    stats = QueryStats(current_query_stats.get())
+    token = current_query_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        current_query_stats.reset(token)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_query_stats.get() is not None:
+        conn.info["query_started_at"] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = current_query_stats.get()
+    if stats is not None:
+        duration = time.perf_counter() - conn.info.pop("query_started_at", time.perf_counter())
+        while stats is not None:
+            stats.count += 1
+            stats.duration += duration
+            stats = stats.parent
+
+
+def instrument_engine(engine: Engine):
+    """ Подключает подсчет запросов к движку, для AsyncEngine передается engine.sync_engine """
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def engine_options(pgbouncer: bool = DB_PGBOUNCER) -> dict:
+    """ Параметры create_async_engine из настроек окружения """
+    if pgbouncer:
+        # PgBouncer в режиме transaction отдает каждую транзакцию произвольному серверному соединению,
+        # поэтому подготовленные выражения не кэшируются, а их имена не должны повторяться.
+        # Очередь соединений держит сам PgBouncer, свой пул не нужен
+        return {
+            "poolclass": NullPool,
+            "connect_args": {
+                "statement_cache_size": 0,
+                "prepared_statement_cache_size": 0,
+                "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4().hex}__",
+            },
+        }
+    return {
+        "poolclass": InstrumentedAsyncPool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "connect_args": {
+            "prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+        },
+    }
+
+
+def make_engine(url: str, label: str) -> AsyncEngine:
+    """ Движок с настройками пула из окружения, label - имя пула в метриках """
+    engine = create_async_engine(url, **engine_options())
+    engine.pool.label = label
+    instrument_engine(engine.sync_engine)
+    return engine
+
+
 DATABASE_URL = f"postgresql+asyncpg://{username}:{password}@{host}:{port}/{db_name}"
-engine = create_async_engine(DATABASE_URL)
+engine = make_engine(DATABASE_URL, "primary")
 async_session_maker = async_sessionmaker(bind=engine, expire_on_commit=False, class_=AsyncSession)
 
+# необязательная реплика только для чтения, например балансировщик перед несколькими репликами
+replica_host = os.getenv("POSTGRES_REPLICA_HOST")
+replica_port = os.getenv("POSTGRES_REPLICA_PORT", port)
+# сколько секунд после записи клиент читает с основной БД, чтобы видеть свои изменения, 0 - не закреплять
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", 5))
+
+REPLICA_DATABASE_URL = None
+replica_engine = None
+replica_session_maker = None
+if replica_host:
+    REPLICA_DATABASE_URL = f"postgresql+asyncpg://{username}:{password}@{replica_host}:{replica_port}/{db_name}"
+    replica_engine = make_engine(REPLICA_DATABASE_URL, "replica")
+    replica_session_maker = async_sessionmaker(bind=replica_engine, expire_on_commit=False, class_=AsyncSession)
+
 
 class Base(DeclarativeBase):
     pass
-
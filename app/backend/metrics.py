@@ -0,0 +1,104 @@
+# base
+from bisect import bisect_left
+from typing import Callable, Optional, Sequence
+
+
+# все созданные метрики, в порядке создания
+REGISTRY = []
+
+
+def _format_labels(labelnames: Sequence[str], labelvalues: Sequence, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """ Монотонно растущий счетчик """
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        REGISTRY.append(self)
+
+    def inc(self, *labelvalues, amount: float = 1.0):
+        self.values[labelvalues] = self.values.get(labelvalues, 0.0) + amount
+
+    def samples(self):
+        for labelvalues, value in self.values.items():
+            yield self.name + _format_labels(self.labelnames, labelvalues), value
+
+
+class Gauge(Counter):
+    """ Текущее значение, может задаваться функцией, которая вызывается при выгрузке метрик """
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 function: Optional[Callable[[], float]] = None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def set(self, value: float, *labelvalues):
+        self.values[labelvalues] = value
+
+    def dec(self, *labelvalues, amount: float = 1.0):
+        self.inc(*labelvalues, amount=-amount)
+
+    def samples(self):
+        if self.function is not None:
+            yield self.name, self.function()
+        else:
+            yield from super().samples()
+
+
+class Histogram:
+    """ Гистограмма с фиксированными границами корзин """
+    type = "histogram"
+
+    DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labelvalues -> [количество по корзинам..., количество выше последней, сумма]
+        self.series = {}
+        REGISTRY.append(self)
+
+    def observe(self, value: float, *labelvalues):
+        series = self.series.get(labelvalues)
+        if series is None:
+            series = self.series[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self):
+        for labelvalues, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                labels = _format_labels(self.labelnames, labelvalues, f'le="{bound}"')
+                yield f"{self.name}_bucket{labels}", cumulative
+            cumulative += series[-2]
+            labels = _format_labels(self.labelnames, labelvalues, 'le="+Inf"')
+            yield f"{self.name}_bucket{labels}", cumulative
+            labels = _format_labels(self.labelnames, labelvalues)
+            yield f"{self.name}_sum{labels}", series[-1]
+            yield f"{self.name}_count{labels}", cumulative
+
+
+def render_metrics() -> str:
+    """ Выгрузка всех метрик в текстовом формате Prometheus """
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        for sample, value in metric.samples():
+            lines.append(f"{sample} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,139 @@
+# base
+import logging
+import time
+from http.cookies import SimpleCookie
+# local
+from app.backend.db import READ_YOUR_WRITES_SECONDS, QUERY_STATS_HEADERS, QUERY_LOG_THRESHOLD, track_queries
+from app.backend.metrics import Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+# cookie с моментом (unix time), до которого чтения клиента идут в основную БД
+PRIMARY_PIN_COOKIE = "primary_until"
+
+# методы, которые не меняют данные и не закрепляют клиента за основной БД
+READ_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+# имя маршрута для запросов, не попавших ни в один маршрут, чтобы произвольные url не создавали новые серии метрик
+UNMATCHED_ROUTE = "<unmatched>"
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Время обработки запроса по шаблону маршрута и коду ответа",
+    ["method", "route", "status"]
+)
+
+
+def is_pinned_to_primary(cookies: dict) -> bool:
+    """ Клиент недавно писал в БД и должен читать с основной БД, чтобы видеть свои изменения """
+    try:
+        return float(cookies.get(PRIMARY_PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+class ReadYourWritesMiddleware:
+    """ После успешного изменяющего запроса закрепляет клиента за основной БД на READ_YOUR_WRITES_SECONDS """
+
+    def __init__(self, app, seconds: float = READ_YOUR_WRITES_SECONDS):
+        self.app = app
+        self.seconds = seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in READ_METHODS or self.seconds <= 0:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_pin(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                cookie = SimpleCookie()
+                cookie[PRIMARY_PIN_COOKIE] = f"{time.time() + self.seconds:.3f}"
+                cookie[PRIMARY_PIN_COOKIE]["max-age"] = int(self.seconds) + 1
+                cookie[PRIMARY_PIN_COOKIE]["path"] = "/"
+                cookie[PRIMARY_PIN_COOKIE]["httponly"] = True
+                cookie[PRIMARY_PIN_COOKIE]["samesite"] = "lax"
+                header = cookie.output(header="").strip().encode("latin-1")
+                message = {**message, "headers": [*message.get("headers", []), (b"set-cookie", header)]}
+            await send(message)
+
+        await self.app(scope, receive, send_with_pin)
+
+
+class MetricsMiddleware:
+    """ Время обработки запросов по шаблону маршрута и количество запросов в обработке. Чистый ASGI без
+    BaseHTTPMiddleware, поэтому на запрос добавляются только замер времени и запись в гистограмму """
+
+    # запросы в обработке во всех экземплярах, счетчик в атрибуте дешевле записи в метрику при каждом запросе
+    in_flight = 0
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # ответ не начат, если обработчик упал с исключением, его превратит в 500 внешний ServerErrorMiddleware
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        MetricsMiddleware.in_flight += 1
+        started_at = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            duration = time.perf_counter() - started_at
+            MetricsMiddleware.in_flight -= 1
+            # маршрут, совпавший с запросом, FastAPI записывает в scope
+            route = scope.get("route")
+            route = route.path_format if route is not None else UNMATCHED_ROUTE
+            HTTP_REQUEST_DURATION.observe(duration, scope["method"], route, status)
+
+
+class QueryStatsMiddleware:
+    """ Считает запросы в БД каждого запроса к приложению: отдает их в заголовках ответа и пишет в лог запросы,
+    выполнившие больше log_threshold запросов в БД """
+
+    def __init__(self, app, headers: bool = QUERY_STATS_HEADERS, log_threshold: int = QUERY_LOG_THRESHOLD):
+        self.app = app
+        self.headers = headers
+        self.log_threshold = log_threshold
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        with track_queries() as stats:
+            async def send_with_stats(message):
+                if self.headers and message["type"] == "http.response.start":
+                    # запросы потокового ответа после начала отправки в заголовки не попадают, только в лог
+                    message = {**message, "headers": [
+                        *message.get("headers", []),
+                        (b"x-db-queries", str(stats.count).encode()),
+                        (b"server-timing", f"db;dur={stats.duration * 1000:.2f}".encode()),
+                    ]}
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_stats)
+            finally:
+                if 0 < self.log_threshold < stats.count:
+                    route = scope.get("route")
+                    logger.warning(
+                        "%s %s: %d запросов в БД за %.1f мс", scope["method"],
+                        route.path_format if route is not None else scope["path"], stats.count, stats.duration * 1000
+                    )
+
+
+HTTP_REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight",
+    "Запросы, которые обрабатываются сейчас",
+    function=lambda: MetricsMiddleware.in_flight
+)
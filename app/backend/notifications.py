@@ -0,0 +1,113 @@
+# base
+import asyncio
+import logging
+import os
+from typing import Awaitable, Callable, Dict, List, Optional
+# installed
+import asyncpg
+# local
+from app.backend.db import DATABASE_URL, DB_PGBOUNCER
+from app.backend.metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+# LISTEN держит сессию, поэтому слушатель подключается к PostgreSQL напрямую, минуя пул SQLAlchemy.
+# PgBouncer в режиме transaction не сохраняет LISTEN между транзакциями, поэтому при DB_PGBOUNCER
+# адрес PostgreSQL в обход PgBouncer (или PgBouncer в режиме session) задается в NOTIFY_DATABASE_URL
+NOTIFY_DATABASE_URL = os.getenv("NOTIFY_DATABASE_URL")
+LISTEN_DATABASE_URL = (NOTIFY_DATABASE_URL or DATABASE_URL).replace("postgresql+asyncpg://", "postgresql://", 1)
+# как часто проверяется живое ли соединение слушателя
+LISTEN_PING_SECONDS = 30
+# пауза перед повторным подключением после обрыва
+LISTEN_RECONNECT_SECONDS = 1
+
+NOTIFICATIONS_RECEIVED = Counter(
+    "pg_notifications_received_total",
+    "Полученные через LISTEN уведомления PostgreSQL",
+    ["channel"]
+)
+LISTEN_RECONNECTS = Counter("pg_listen_reconnects_total", "Переподключения слушателя уведомлений PostgreSQL")
+
+# обработчик получает полезную нагрузку NOTIFY
+NotificationHandler = Callable[[str], Awaitable[None]]
+# вызывается после (пере)подключения: уведомления, отправленные без соединения, потеряны
+ReconnectHandler = Callable[[], Awaitable[None]]
+
+
+class NotificationListener:
+    """ Одно соединение LISTEN на процесс, уведомления раздаются подписчикам каналов """
+
+    def __init__(self, dsn: str = LISTEN_DATABASE_URL):
+        self.dsn = dsn
+        self._handlers: Dict[str, List[NotificationHandler]] = {}
+        self._reconnect_handlers: List[ReconnectHandler] = []
+        self._task: Optional[asyncio.Task] = None
+        self._pending = set()
+
+    def subscribe(self, channel: str, handler: NotificationHandler, on_reconnect: Optional[ReconnectHandler] = None):
+        """ Подписка на канал, подписываться нужно до start """
+        self._handlers.setdefault(channel, []).append(handler)
+        if on_reconnect is not None:
+            self._reconnect_handlers.append(on_reconnect)
+
+    async def start(self):
+        if self._task is None and self._handlers:
+            if DB_PGBOUNCER and NOTIFY_DATABASE_URL is None:
+                # иначе LISTEN молча теряет уведомления, и кэш каталога перестает сбрасываться
+                raise RuntimeError("При DB_PGBOUNCER нужен NOTIFY_DATABASE_URL с прямым подключением к PostgreSQL")
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def _on_notification(self, connection, pid: int, channel: str, payload: str):
+        NOTIFICATIONS_RECEIVED.inc(channel)
+        for handler in self._handlers.get(channel, []):
+            # ссылка на задачу хранится до ее завершения, иначе ее может собрать сборщик мусора
+            task = asyncio.create_task(self._dispatch(handler, payload))
+            self._pending.add(task)
+            task.add_done_callback(self._pending.discard)
+
+    @staticmethod
+    async def _dispatch(handler: NotificationHandler, payload: str):
+        try:
+            await handler(payload)
+        except Exception:
+            logger.exception("Ошибка обработки уведомления PostgreSQL")
+
+    async def _run(self):
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(self.dsn)
+                lost = asyncio.Event()
+                connection.add_termination_listener(lambda _: lost.set())
+                for channel in self._handlers:
+                    await connection.add_listener(channel, self._on_notification)
+                for handler in self._reconnect_handlers:
+                    await handler()
+
+                while not lost.is_set():
+                    try:
+                        await asyncio.wait_for(lost.wait(), LISTEN_PING_SECONDS)
+                    except asyncio.TimeoutError:
+                        # обрыв сети без закрытия сокета виден только по неудачному запросу
+                        await connection.execute("SELECT 1")
+            except (OSError, asyncio.TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError) as error:
+                logger.warning("Соединение LISTEN потеряно: %s", error)
+            finally:
+                if connection is not None and not connection.is_closed():
+                    await connection.close(timeout=LISTEN_RECONNECT_SECONDS)
+            LISTEN_RECONNECTS.inc()
+            await asyncio.sleep(LISTEN_RECONNECT_SECONDS)
+
+
+# слушатель процесса, запускается и останавливается в lifespan приложения
+notification_listener = NotificationListener()
@@ -0,0 +1,71 @@
+# base
+import argparse
+import json
+import os
+import time
+from datetime import datetime, timedelta
+# installed
+from jose import jwt
+# local
+from app.schemas.auth import TokenPayload
+from app.services.auth_service import UTC_3, ACCESS_TOKEN_EXPIRE_MINUTES, AuthEngine
+
+
+# количество операций одного замера
+OPERATIONS = 20_000
+SUBJECT = "bench-librarian-1@example.com"
+
+
+def issue_per_request() -> str:
+    """ Прежний путь: настройки читаются из окружения, а ключ строится из строки при каждой подписи """
+    algorithm = os.getenv("ALGORITHM")
+    secret_key = os.getenv("JWT_SECRET_KEY")
+    payload = {
+        "exp": datetime.now(UTC_3) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES),
+        "sub": SUBJECT,
+        "scope": "access"
+    }
+    return jwt.encode(payload, secret_key, algorithm)
+
+
+def verify_per_request(token: str) -> TokenPayload:
+    payload = jwt.decode(token=token, key=os.getenv("JWT_SECRET_KEY"), algorithms=[os.getenv("ALGORITHM")])
+    return TokenPayload(**payload)
+
+
+def cpu_time(function, operations: int, repeat: int) -> float:
+    """ Процессорное время одной операции в микросекундах, лучшее из repeat """
+    best = float("inf")
+    for _ in range(repeat):
+        started_at = time.process_time()
+        for _ in range(operations):
+            function()
+        best = min(best, time.process_time() - started_at)
+    return best / operations * 1e6
+
+
+def measure(operations: int, repeat: int) -> dict:
+    engine = AuthEngine.from_env()
+    token = engine.create_access_token(SUBJECT)
+    results = {
+        "issue_per_request": cpu_time(issue_per_request, operations, repeat),
+        "issue_engine": cpu_time(lambda: engine.create_access_token(SUBJECT), operations, repeat),
+        "verify_per_request": cpu_time(lambda: verify_per_request(token), operations, repeat),
+        "verify_engine": cpu_time(lambda: engine.decode_access_token(token), operations, repeat),
+    }
+    results = {name: round(value, 2) for name, value in results.items()}
+    return {
+        "operations": operations,
+        "unit": "cpu us per operation",
+        **results,
+        "issue_saved": round(results["issue_per_request"] - results["issue_engine"], 2),
+        "verify_saved": round(results["verify_per_request"] - results["verify_engine"], 2),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Затраты CPU на выдачу и проверку токена до и после AuthEngine")
+    parser.add_argument("--operations", type=int, default=OPERATIONS, help="количество операций одного замера")
+    parser.add_argument("--repeat", type=int, default=5, help="количество повторов, берется лучший")
+    args = parser.parse_args()
+    print(json.dumps(measure(args.operations, args.repeat), ensure_ascii=False, indent=2))
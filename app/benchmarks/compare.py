@@ -0,0 +1,61 @@
+# base
+import argparse
+import json
+import sys
+from typing import List
+
+
+# показатели эндпоинта, рост которых считается регрессией
+COMPARED_METRICS = ("p50_ms", "p95_ms", "p99_ms", "db_queries_per_request")
+
+
+def compare_reports(baseline: dict, current: dict, threshold: float) -> List[dict]:
+    """ Изменения показателей по эндпоинтам, присутствующим в обоих отчетах """
+    changes = []
+    for scenario, current_scenario in current["scenarios"].items():
+        baseline_scenario = baseline["scenarios"].get(scenario)
+        if baseline_scenario is None:
+            continue
+        for endpoint, metrics in current_scenario["endpoints"].items():
+            baseline_metrics = baseline_scenario["endpoints"].get(endpoint)
+            if baseline_metrics is None:
+                continue
+            for metric in COMPARED_METRICS:
+                before, after = baseline_metrics.get(metric), metrics.get(metric)
+                if before is None or after is None:
+                    continue
+                change = (after - before) / before * 100 if before else (0.0 if after == before else float("inf"))
+                changes.append({
+                    "scenario": scenario,
+                    "endpoint": endpoint,
+                    "metric": metric,
+                    "before": before,
+                    "after": after,
+                    "change_percent": round(change, 1),
+                    "regression": change > threshold,
+                })
+    return changes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сравнение двух отчетов нагрузочного тестирования")
+    parser.add_argument("baseline", help="отчет базовой версии")
+    parser.add_argument("current", help="отчет проверяемой версии")
+    parser.add_argument("--threshold", type=float, default=10, help="допустимый рост показателя в процентах")
+    args = parser.parse_args()
+
+    with open(args.baseline, encoding="utf-8") as file:
+        baseline_report = json.load(file)
+    with open(args.current, encoding="utf-8") as file:
+        current_report = json.load(file)
+
+    regressions = 0
+    for item in compare_reports(baseline_report, current_report, args.threshold):
+        regressions += item["regression"]
+        mark = "!!" if item["regression"] else "  "
+        print(
+            f"{mark} {item['scenario']:<12} {item['endpoint']:<48} {item['metric']:<24} "
+            f"{item['before']:>10} -> {item['after']:>10} ({item['change_percent']:+.1f}%)"
+        )
+    print(f"{baseline_report.get('commit')} -> {current_report.get('commit')}: регрессий {regressions}")
+    sys.exit(1 if regressions else 0)
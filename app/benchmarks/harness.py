@@ -0,0 +1,131 @@
+# base
+import math
+import time
+from collections import Counter as CounterDict, defaultdict
+from typing import Dict, List, Optional
+# installed
+import httpx
+# local
+from app.backend.db import track_queries
+
+# через сколько секунд после получения access токена клиент запрашивает новую пару
+ACCESS_TOKEN_REFRESH_SECONDS = 45
+
+
+def percentile(values: List[float], percent: float) -> Optional[float]:
+    """ Перцентиль методом ближайшего ранга, values должен быть отсортирован """
+    if not values:
+        return None
+    rank = max(1, math.ceil(percent / 100 * len(values)))
+    return values[rank - 1]
+
+
+class Recorder:
+    """ Собирает длительности и статусы ответов по эндпоинтам """
+
+    def __init__(self, count_queries: bool = False):
+        # запросы в БД видны, только если приложение вызывается в этом же процессе
+        self.count_queries = count_queries
+        self.durations = defaultdict(list)
+        self.statuses = defaultdict(CounterDict)
+        self.queries = CounterDict()
+        self.started_at = time.perf_counter()
+        self.finished_at = None
+
+    def record(self, endpoint: str, duration: float, status: str, queries: int = 0):
+        self.durations[endpoint].append(duration)
+        self.statuses[endpoint][status] += 1
+        self.queries[endpoint] += queries
+
+    def finish(self):
+        self.finished_at = time.perf_counter()
+
+    def summary(self) -> Dict:
+        """ Отчет: перцентили задержки в миллисекундах, пропускная способность и количество запросов в БД """
+        elapsed = (self.finished_at or time.perf_counter()) - self.started_at
+        endpoints = {}
+        for endpoint in sorted(self.durations):
+            durations = sorted(self.durations[endpoint])
+            statuses = self.statuses[endpoint]
+            report = {
+                "requests": len(durations),
+                # ошибки сервера и сети, ответы 4xx считаются ожидаемыми бизнес результатами
+                "errors": sum(count for status, count in statuses.items() if not status.isdigit() or int(status) >= 500),
+                "statuses": dict(statuses),
+                "throughput_rps": round(len(durations) / elapsed, 2) if elapsed else None,
+                "mean_ms": round(sum(durations) / len(durations) * 1000, 3),
+                "p50_ms": round(percentile(durations, 50) * 1000, 3),
+                "p95_ms": round(percentile(durations, 95) * 1000, 3),
+                "p99_ms": round(percentile(durations, 99) * 1000, 3),
+                "max_ms": round(durations[-1] * 1000, 3),
+                "db_queries": None,
+                "db_queries_per_request": None,
+            }
+            if self.count_queries:
+                queries = self.queries[endpoint]
+                report["db_queries"] = queries
+                report["db_queries_per_request"] = round(queries / len(durations), 2)
+            endpoints[endpoint] = report
+
+        total = sum(len(durations) for durations in self.durations.values())
+        return {
+            "duration_seconds": round(elapsed, 3),
+            "requests": total,
+            "throughput_rps": round(total / elapsed, 2) if elapsed else None,
+            "endpoints": endpoints,
+        }
+
+
+class BenchmarkClient:
+    """ HTTP клиент виртуального пользователя, замеряет каждый запрос по шаблону пути эндпоинта """
+
+    def __init__(self, client: httpx.AsyncClient, recorder: Recorder):
+        self.client = client
+        self.recorder = recorder
+        self.email = None
+        self.password = None
+        self.access_token = None
+        self.refresh_token = None
+        self.token_received_at = 0.0
+
+    async def request(self, method: str, path: str, *, path_params: Optional[Dict] = None, **kwargs) -> Optional[httpx.Response]:
+        """ Выполняет запрос к path с подставленными path_params, None означает ошибку сети """
+        endpoint = f"{method} {path}"
+        url = path.format(**path_params) if path_params else path
+        # запросы в БД считаются тем же механизмом, что и в приложении (track_queries)
+        with track_queries() as stats:
+            started_at = time.perf_counter()
+            try:
+                response = await self.client.request(method, url, **kwargs)
+                # тело читается до остановки таймера, чтобы потоковые ответы замерялись целиком
+                await response.aread()
+            except httpx.HTTPError as error:
+                self.recorder.record(endpoint, time.perf_counter() - started_at, type(error).__name__, stats.count)
+                return None
+        self.recorder.record(endpoint, time.perf_counter() - started_at, str(response.status_code), stats.count)
+        return response
+
+    async def login(self, email: str, password: str) -> bool:
+        self.email, self.password = email, password
+        response = await self.request("POST", "/auth/login", data={"username": email, "password": password})
+        return self._store_tokens(response)
+
+    async def refresh(self) -> bool:
+        response = await self.request("POST", "/auth/refresh", json={"refresh_token": self.refresh_token})
+        return self._store_tokens(response)
+
+    def _store_tokens(self, response: Optional[httpx.Response]) -> bool:
+        if response is None or response.status_code != 200:
+            return False
+        tokens = response.json()
+        self.access_token = tokens["access_token"]
+        self.refresh_token = tokens["refresh_token"]
+        self.token_received_at = time.monotonic()
+        return True
+
+    async def auth_headers(self) -> Dict[str, str]:
+        """ Заголовок авторизации, access токен обновляется до истечения срока действия """
+        if time.monotonic() - self.token_received_at > ACCESS_TOKEN_REFRESH_SECONDS:
+            if not await self.refresh():
+                await self.login(self.email, self.password)
+        return {"Authorization": f"Bearer {self.access_token}"}
@@ -0,0 +1,67 @@
+# base
+import argparse
+import asyncio
+import json
+import time
+# installed
+from fastapi.routing import APIRoute
+# local
+from app.backend.middleware import MetricsMiddleware
+
+
+# количество запросов одного замера
+REQUESTS = 200_000
+
+
+async def endpoint():
+    return None
+
+
+ROUTE = APIRoute("/books/{book_id}", endpoint, methods=["GET"])
+
+START = {"type": "http.response.start", "status": 200, "headers": []}
+BODY = {"type": "http.response.body", "body": b"{}"}
+
+
+async def bare_app(scope, receive, send):
+    """ Приложение без работы: только совпадение маршрута и ответ, чтобы в замер попадали лишь затраты middleware """
+    scope["route"] = ROUTE
+    await send(START)
+    await send(BODY)
+
+
+async def receive():
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+
+async def send(message):
+    pass
+
+
+async def wall_time(app, requests: int) -> float:
+    """ Время обработки requests запросов в секундах """
+    started_at = time.perf_counter()
+    for _ in range(requests):
+        await app({"type": "http", "method": "GET", "path": "/books/1"}, receive, send)
+    return time.perf_counter() - started_at
+
+
+async def measure(requests: int, repeat: int) -> dict:
+    instrumented = MetricsMiddleware(bare_app)
+    bare = min([await wall_time(bare_app, requests) for _ in range(repeat)])
+    wrapped = min([await wall_time(instrumented, requests) for _ in range(repeat)])
+    return {
+        "requests": requests,
+        "unit": "us per request",
+        "bare": round(bare / requests * 1e6, 3),
+        "with_metrics": round(wrapped / requests * 1e6, 3),
+        "overhead": round((wrapped - bare) / requests * 1e6, 3),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Затраты MetricsMiddleware на один запрос")
+    parser.add_argument("--requests", type=int, default=REQUESTS, help="количество запросов одного замера")
+    parser.add_argument("--repeat", type=int, default=5, help="количество повторов, берется лучший")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(measure(args.requests, args.repeat)), ensure_ascii=False, indent=2))
@@ -0,0 +1,112 @@
+# base
+import argparse
+import asyncio
+import datetime
+import json
+import random
+import subprocess
+import time
+from typing import List, Optional
+# installed
+import httpx
+# local
+from app.backend.db import engine
+from app.benchmarks.harness import BenchmarkClient, Recorder
+from app.benchmarks.scenarios import SCENARIOS, Dataset, VirtualUser, run_iteration
+from app.main import app
+
+
+def git_commit() -> Optional[str]:
+    """ Текущий коммит, чтобы отчеты разных версий можно было сопоставить """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_scenario(scenario: str, client: httpx.AsyncClient, dataset: Dataset, users: int,
+                       duration: float, seed: int, count_queries: bool) -> dict:
+    """ Запускает users виртуальных пользователей на duration секунд и возвращает отчет """
+    setup_recorder = Recorder()
+    virtual_users = [
+        VirtualUser(BenchmarkClient(client, setup_recorder), dataset, random.Random(seed + number))
+        for number in range(users)
+    ]
+    # вход пользователей перед стартом не попадает в замеры сценария
+    await asyncio.gather(*(user.start() for user in virtual_users))
+
+    recorder = Recorder(count_queries)
+    for user in virtual_users:
+        user.client.recorder = recorder
+    deadline = time.perf_counter() + duration
+
+    async def loop(user: VirtualUser):
+        while time.perf_counter() < deadline:
+            await run_iteration(scenario, user)
+
+    await asyncio.gather(*(loop(user) for user in virtual_users))
+    recorder.finish()
+    return {"users": users, **recorder.summary()}
+
+
+async def run(scenarios: List[str], users: int, duration: float, seed: int, base_url: Optional[str]) -> dict:
+    dataset = await Dataset.load(engine)
+    report = {
+        "commit": git_commit(),
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "target": base_url or "in-process",
+        "dataset": vars(dataset),
+        "scenarios": {},
+    }
+
+    if base_url is None:
+        # приложение вызывается напрямую через ASGI, поэтому запросы в БД можно отнести к эндпоинтам
+        # необработанные исключения приложения превращаются в ответ 500 и учитываются как ошибки
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        async with app.router.lifespan_context(app):
+            async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+                for scenario in scenarios:
+                    report["scenarios"][scenario] = await run_scenario(
+                        scenario, client, dataset, users, duration, seed, True
+                    )
+    else:
+        # запущенный сервер в другом процессе, запросы в БД не считаются
+        limits = httpx.Limits(max_connections=users)
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+            for scenario in scenarios:
+                report["scenarios"][scenario] = await run_scenario(
+                    scenario, client, dataset, users, duration, seed, False
+                )
+
+    await engine.dispose()
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Нагрузочное тестирование эндпоинтов")
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=sorted(SCENARIOS),
+        help="сценарий нагрузки, можно указать несколько раз, по умолчанию mixed"
+    )
+    parser.add_argument("--users", type=int, default=20, help="количество одновременных виртуальных пользователей")
+    parser.add_argument("--duration", type=float, default=30, help="длительность каждого сценария в секундах")
+    parser.add_argument("--seed", type=int, default=1, help="зерно генератора случайных чисел")
+    parser.add_argument(
+        "--base-url",
+        default=None,
+        help="адрес запущенного сервера, по умолчанию приложение вызывается в этом же процессе"
+    )
+    parser.add_argument("--output", default=None, help="файл для JSON отчета, по умолчанию вывод в консоль")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args.scenario or ["mixed"], args.users, args.duration, args.seed, args.base_url))
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
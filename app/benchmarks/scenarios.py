@@ -0,0 +1,188 @@
+# base
+import random
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+# installed
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+# local
+from app.benchmarks.harness import BenchmarkClient
+from app.benchmarks.seed import BENCHMARK_PASSWORD, LIBRARIAN_EMAIL, WORDS
+
+
+@dataclass
+class Dataset:
+    """ Диапазоны id сидированных данных, из которых виртуальные пользователи выбирают книги и читателей """
+    first_book_id: int
+    last_book_id: int
+    first_reader_id: int
+    last_reader_id: int
+    librarians: int
+
+    @classmethod
+    async def load(cls, engine: AsyncEngine) -> "Dataset":
+        async with engine.connect() as connection:
+            result = await connection.execute(text(
+                "SELECT (SELECT min(id) FROM book), (SELECT max(id) FROM book), "
+                "(SELECT min(id) FROM reader), (SELECT max(id) FROM reader), "
+                "(SELECT count(*) FROM librarian WHERE email LIKE 'bench-librarian-%')"
+            ))
+            row = result.one()
+        if None in row or not row[4]:
+            raise SystemExit("БД не заполнена, сначала выполните python -m app.benchmarks.seed")
+        return cls(*row)
+
+    def book_id(self, rng: random.Random) -> int:
+        return rng.randint(self.first_book_id, self.last_book_id)
+
+    def reader_id(self, rng: random.Random) -> int:
+        return rng.randint(self.first_reader_id, self.last_reader_id)
+
+    def librarian_email(self, rng: random.Random) -> str:
+        return LIBRARIAN_EMAIL.format(rng.randint(1, self.librarians))
+
+
+@dataclass
+class VirtualUser:
+    """ Состояние одного виртуального пользователя между итерациями сценария """
+    client: BenchmarkClient
+    dataset: Dataset
+    rng: random.Random
+    # выданные этим пользователем книги (book_id, reader_id), которые он позже возвращает
+    loans: List[Tuple[int, int]] = field(default_factory=list)
+    # ETag последних ответов по адресу для условных запросов
+    etags: Dict[str, str] = field(default_factory=dict)
+
+    async def start(self):
+        await self.client.login(self.dataset.librarian_email(self.rng), BENCHMARK_PASSWORD)
+
+
+async def browse_catalog(user: VirtualUser):
+    """ Просмотр каталога: несколько страниц списка, поиск и карточка книги """
+    client, rng = user.client, user.rng
+    params = {"limit": 50, "order_by": rng.choice(["id", "author"])}
+    for _ in range(rng.randint(1, 3)):
+        response = await client.request("GET", "/books/", params=params)
+        if response is None or response.status_code != 200 or not response.json()["next_cursor"]:
+            break
+        params["cursor"] = response.json()["next_cursor"]
+
+    query = " ".join(rng.sample(WORDS, rng.randint(1, 2)))
+    await client.request("GET", "/books/search", params={"q": query, "limit": 20})
+    await client.request(
+        "GET", "/books/{book_id}",
+        path_params={"book_id": user.dataset.book_id(rng)},
+        headers=await client.auth_headers()
+    )
+
+
+async def poll_catalog(user: VirtualUser):
+    """ Киоск: опрос первой страницы каталога и популярных книг с If-None-Match """
+    client, dataset, rng = user.client, user.dataset, user.rng
+    headers = await client.auth_headers()
+    # небольшой набор книг, чтобы опросы повторялись
+    book_id = dataset.first_book_id + rng.randint(0, 20)
+    for path, path_params, request_headers in (
+            ("/books/", None, {}),
+            ("/books/{book_id}", {"book_id": book_id}, headers),
+    ):
+        url = path.format(**path_params) if path_params else path
+        etag = user.etags.get(url)
+        response = await client.request(
+            "GET", path, path_params=path_params,
+            headers={**request_headers, **({"If-None-Match": etag} if etag else {})}
+        )
+        if response is not None and "etag" in response.headers:
+            user.etags[url] = response.headers["etag"]
+
+
+async def login_storm(user: VirtualUser):
+    """ Повторные входы библиотекарей и обновление токенов """
+    client = user.client
+    if await client.login(user.dataset.librarian_email(user.rng), BENCHMARK_PASSWORD):
+        await client.refresh()
+
+
+async def checkout_desk(user: VirtualUser):
+    """ Стойка выдачи: выдача и возврат книг, книги читателя и пакетные операции """
+    client, dataset, rng = user.client, user.dataset, user.rng
+    headers = await client.auth_headers()
+    book_id, reader_id = dataset.book_id(rng), dataset.reader_id(rng)
+    response = await client.request(
+        "POST", "/books/borrow/{book_id}/reader/{reader_id}",
+        path_params={"book_id": book_id, "reader_id": reader_id},
+        headers=headers
+    )
+    if response is not None and response.status_code == 201:
+        user.loans.append((book_id, reader_id))
+
+    await client.request(
+        "GET", "/books/reader/{reader_id}", path_params={"reader_id": reader_id}, headers=headers
+    )
+
+    if len(user.loans) > 2:
+        book_id, reader_id = user.loans.pop(0)
+        await client.request(
+            "POST", "/books/return/{book_id}/reader/{reader_id}",
+            path_params={"book_id": book_id, "reader_id": reader_id},
+            headers=headers
+        )
+
+    # изредка библиотекарь оформляет пачку выдач и сразу принимает ее обратно
+    if rng.random() < 0.1:
+        items = [{"book_id": dataset.book_id(rng), "reader_id": dataset.reader_id(rng)} for _ in range(10)]
+        response = await client.request("POST", "/books/borrow:batch", json=items, headers=headers)
+        if response is not None and response.status_code == 200:
+            returned = [item for item in response.json() if item["success"]]
+            if returned:
+                returned = [{"book_id": item["book_id"], "reader_id": item["reader_id"]} for item in returned]
+                await client.request("POST", "/books/return:batch", json=returned, headers=headers)
+
+
+async def manage_catalog(user: VirtualUser):
+    """ Редактирование: создание и изменение книг, изменение читателей, чтение метрик """
+    client, dataset, rng = user.client, user.dataset, user.rng
+    headers = await client.auth_headers()
+    suffix = rng.randint(1, 10 ** 9)
+    response = await client.request("POST", "/books/", headers=headers, json={
+        "name": f"Новая книга {suffix}",
+        "author": f"Автор {suffix % 50000}",
+        "publication_year": 2000 + suffix % 26,
+    })
+    if response is not None and response.status_code == 201:
+        book_id = response.json()["id"]
+        await client.request(
+            "PATCH", "/books/{book_id}", path_params={"book_id": book_id},
+            json={"copies_quantity": 1 + suffix % 7}, headers=headers
+        )
+        await client.request("DELETE", "/books/{book_id}", path_params={"book_id": book_id}, headers=headers)
+
+    reader_id = dataset.reader_id(rng)
+    await client.request("GET", "/users/readers/{reader_id}", path_params={"reader_id": reader_id}, headers=headers)
+    await client.request(
+        "PATCH", "/users/readers/{reader_id}", path_params={"reader_id": reader_id},
+        json={"name": f"Читатель {reader_id}"}, headers=headers
+    )
+    await client.request("GET", "/metrics")
+
+
+async def export_catalog(user: VirtualUser):
+    """ Полная потоковая выгрузка каталога """
+    await user.client.request("GET", "/books/stream", params={"batch_size": 5000})
+
+
+# сценарий -> список (шаг, вес), на каждой итерации шаг выбирается случайно с учетом веса
+SCENARIOS = {
+    "catalog": [(browse_catalog, 1)],
+    "login-storm": [(login_storm, 1)],
+    "checkout": [(checkout_desk, 1)],
+    "polling": [(poll_catalog, 1)],
+    "export": [(export_catalog, 1)],
+    "mixed": [(browse_catalog, 70), (checkout_desk, 20), (manage_catalog, 7), (login_storm, 3)],
+}
+
+
+async def run_iteration(scenario: str, user: VirtualUser):
+    steps, weights = zip(*SCENARIOS[scenario])
+    step = user.rng.choices(steps, weights)[0]
+    await step(user)
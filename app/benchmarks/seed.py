@@ -0,0 +1,133 @@
+# base
+import argparse
+import asyncio
+import time
+# installed
+from sqlalchemy import text
+# local
+from app.backend.db import engine
+from app.services.hashing import password_hasher
+
+
+# объемы данных при scale=1
+BOOKS = 1_000_000
+READERS = 200_000
+BORROWS = 10_000_000
+LIBRARIANS = 100
+
+# пароль всех сидированных библиотекарей
+BENCHMARK_PASSWORD = "benchmark-password"
+LIBRARIAN_EMAIL = "bench-librarian-{}@example.com"
+
+# история выдач вставляется частями, чтобы не держать одну огромную транзакцию
+BORROWS_CHUNK_SIZE = 1_000_000
+
+# слова для названий и описаний, по ним же ищут виртуальные пользователи
+WORDS = (
+    "война", "мир", "море", "город", "ночь", "сад", "дом", "река", "звезда", "дорога",
+    "история", "тайна", "зима", "лето", "остров", "сердце", "ветер", "огонь", "время", "песня",
+)
+
+BOOKS_SQL = f"""
+    INSERT INTO book (name, author, publication_year, isbn, copies_quantity, description)
+    SELECT
+        initcap(w[1 + g % {len(WORDS)}]) || ' и ' || w[1 + (g / {len(WORDS)}) % {len(WORDS)}] || ' ' || g,
+        'Автор ' || (g % 50000),
+        1900 + g % 125,
+        lpad(g::text, 13, '0'),
+        1 + g % 10,
+        'Книга о том, как ' || w[1 + (g / 7) % {len(WORDS)}] || ' встречает ' || w[1 + (g / 3) % {len(WORDS)}]
+    FROM generate_series(1, :count) g, (SELECT ARRAY[{', '.join(repr(word) for word in WORDS)}] AS w) words
+"""
+
+READERS_SQL = """
+    INSERT INTO reader (name, email)
+    SELECT 'Читатель ' || g, 'bench-reader-' || g || '@example.com'
+    FROM generate_series(1, :count) g
+"""
+
+LIBRARIANS_SQL = """
+    INSERT INTO librarian (name, email, password)
+    SELECT 'Библиотекарь ' || g, 'bench-librarian-' || g || '@example.com', :password
+    FROM generate_series(1, :count) g
+"""
+
+# выдачи после :active_from активны, по одной на каждого читателя, остальное - история возвратов
+BORROWS_SQL = """
+    INSERT INTO borrowed_book (borrow_date, return_date, due_date, is_active, book_id, reader_id)
+    SELECT
+        current_date - (g % 3650),
+        CASE WHEN g > CAST(:active_from AS integer) THEN NULL ELSE current_date - (g % 3650) + 14 END,
+        current_date - (g % 3650) + 14,
+        g > CAST(:active_from AS integer),
+        b.first_id + g % CAST(:books AS integer),
+        r.first_id + g % CAST(:readers AS integer)
+    FROM generate_series(CAST(:start AS integer), CAST(:stop AS integer)) g,
+        (SELECT min(id) AS first_id FROM book) b,
+        (SELECT min(id) AS first_id FROM reader) r
+"""
+
+READER_COUNTS_SQL = """
+    UPDATE reader SET active_borrow_count = active.count
+    FROM (SELECT reader_id, count(*) AS count FROM borrowed_book WHERE is_active GROUP BY reader_id) active
+    WHERE reader.id = active.reader_id
+"""
+
+
+async def seed(scale: float, reset: bool):
+    """ Заполняет БД данными для нагрузочного тестирования """
+    books = max(1, int(BOOKS * scale))
+    readers = max(1, int(READERS * scale))
+    borrows = max(readers, int(BORROWS * scale))
+    librarians = LIBRARIANS
+    started_at = time.perf_counter()
+
+    def log(message: str):
+        print(f"[{time.perf_counter() - started_at:8.1f}s] {message}", flush=True)
+
+    async with engine.begin() as connection:
+        if reset:
+            await connection.execute(text(
+                "TRUNCATE borrowed_book, borrowed_book_archive, book, reader, librarian, revoked_token "
+                "RESTART IDENTITY CASCADE"
+            ))
+            log("таблицы очищены")
+        elif await connection.scalar(text("SELECT EXISTS (SELECT 1 FROM book)")):
+            raise SystemExit("В БД уже есть книги, для повторного заполнения используйте --reset")
+
+        await connection.execute(text(BOOKS_SQL), {"count": books})
+        log(f"книги: {books}")
+        await connection.execute(text(READERS_SQL), {"count": readers})
+        log(f"читатели: {readers}")
+        # все библиотекари получают один хэш, bcrypt считается один раз
+        password = password_hasher.context.hash(BENCHMARK_PASSWORD)
+        await connection.execute(text(LIBRARIANS_SQL), {"count": librarians, "password": password})
+        log(f"библиотекари: {librarians}")
+
+    for start in range(1, borrows + 1, BORROWS_CHUNK_SIZE):
+        stop = min(borrows, start + BORROWS_CHUNK_SIZE - 1)
+        async with engine.begin() as connection:
+            await connection.execute(text(BORROWS_SQL), {
+                "start": start, "stop": stop, "active_from": borrows - readers, "books": books, "readers": readers
+            })
+        log(f"выдачи: {stop}/{borrows}")
+
+    async with engine.begin() as connection:
+        await connection.execute(text(READER_COUNTS_SQL))
+        for table in ("book", "reader", "librarian", "borrowed_book"):
+            await connection.execute(text(f"ANALYZE {table}"))
+    log("статистика обновлена")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Заполнение БД данными для нагрузочного тестирования")
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help=f"множитель объема: при 1.0 {BOOKS} книг, {READERS} читателей и {BORROWS} выдач"
+    )
+    parser.add_argument("--reset", action="store_true", help="очистить таблицы перед заполнением")
+    args = parser.parse_args()
+    asyncio.run(seed(args.scale, args.reset))
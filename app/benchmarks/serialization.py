@@ -0,0 +1,101 @@
+# base
+import argparse
+import asyncio
+import json
+import time
+from typing import List
+# installed
+import orjson
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+from sqlalchemy import select
+# local
+from app.backend.db import async_session_maker, engine
+from app.models.book import Book
+from app.schemas.book import BookResponse
+from app.services.book_service import BOOK_COLUMNS
+
+
+# количество строк, на которое пересчитываются все замеры
+ROWS = 10_000
+
+
+def cpu_time(function, repeat: int) -> float:
+    """ Процессорное время одного вызова в миллисекундах, лучшее из repeat """
+    best = float("inf")
+    for _ in range(repeat):
+        started_at = time.process_time()
+        function()
+        best = min(best, time.process_time() - started_at)
+    return best * 1000
+
+
+async def async_cpu_time(function, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started_at = time.process_time()
+        await function()
+        best = min(best, time.process_time() - started_at)
+    return best * 1000
+
+
+def render_json(content) -> bytes:
+    """ Как JSONResponse из starlette """
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+async def measure(rows: int, repeat: int) -> dict:
+    adapter = TypeAdapter(List[BookResponse])
+
+    async with async_session_maker() as db:
+        async def fetch_orm():
+            db.expunge_all()
+            return (await db.scalars(select(Book).order_by(Book.id).limit(rows))).all()
+
+        async def fetch_rows():
+            return [row._asdict() for row in await db.execute(select(*BOOK_COLUMNS).order_by(Book.id).limit(rows))]
+
+        book_rows = await fetch_rows()
+        if not book_rows:
+            raise SystemExit("В БД нет книг, сначала выполните python -m app.benchmarks.seed")
+        fetch_orm_ms = await async_cpu_time(fetch_orm, repeat)
+        fetch_rows_ms = await async_cpu_time(fetch_rows, repeat)
+        books = await fetch_orm()
+
+    # прежний путь: ORM объекты без response_model проходят через jsonable_encoder и json.dumps
+    serialize_orm_ms = cpu_time(lambda: render_json(jsonable_encoder(books)), repeat)
+    # новый путь: строки проверяются response_model, как это делает FastAPI, и пишутся через orjson
+    serialize_rows_ms = cpu_time(
+        lambda: orjson.dumps(adapter.dump_python(adapter.validate_python(book_rows), mode="json")), repeat
+    )
+    # нижняя граница: строки сразу в orjson без проверки схемы
+    serialize_raw_ms = cpu_time(lambda: orjson.dumps(book_rows), repeat)
+    await engine.dispose()
+
+    scale = ROWS / len(book_rows)
+
+    def per_rows(value: float) -> float:
+        return round(value * scale, 2)
+
+    before = per_rows(fetch_orm_ms + serialize_orm_ms)
+    after = per_rows(fetch_rows_ms + serialize_rows_ms)
+    return {
+        "rows": len(book_rows),
+        "unit": f"cpu ms per {ROWS} rows",
+        "fetch_orm": per_rows(fetch_orm_ms),
+        "fetch_rows": per_rows(fetch_rows_ms),
+        "serialize_orm_jsonable_encoder": per_rows(serialize_orm_ms),
+        "serialize_rows_response_model_orjson": per_rows(serialize_rows_ms),
+        "serialize_rows_orjson_only": per_rows(serialize_raw_ms),
+        "total_before": before,
+        "total_after": after,
+        "saved": round(before - after, 2),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сравнение затрат CPU на выдачу списка книг до и после перехода на строки")
+    parser.add_argument("--rows", type=int, default=ROWS, help="сколько книг загружать")
+    parser.add_argument("--repeat", type=int, default=5, help="количество повторов, берется лучший")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(measure(args.rows, args.repeat)), ensure_ascii=False, indent=2))
@@ -0,0 +1,34 @@
+# base
+import argparse
+import asyncio
+import json
+# local
+from app.backend.db import async_session_maker, engine
+from app.services.import_service import BookImportService
+
+
+async def import_file(path: str, file_format: str):
+    """ Импортирует файл каталога и печатает отчет """
+    with open(path, "rb") as file:
+        async with async_session_maker() as db:
+            import_service = BookImportService(db)
+            summary = await import_service.import_books(file, file_format)
+    await engine.dispose()
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Импорт каталога книг из CSV или NDJSON файла")
+    parser.add_argument("path", help="путь к файлу каталога")
+    parser.add_argument(
+        "--format",
+        choices=["csv", "ndjson"],
+        default=None,
+        help="формат файла, по умолчанию определяется по расширению"
+    )
+    args = parser.parse_args()
+    file_format = args.format or ("ndjson" if args.path.endswith((".ndjson", ".jsonl")) else "csv")
+    try:
+        asyncio.run(import_file(args.path, file_format))
+    except ValueError as error:
+        parser.exit(1, f"{error.args[0]}\n")
@@ -1,12 +1,56 @@
+# base
+from contextlib import asynccontextmanager
 # installed
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 # local
-from app.api import book, auth, user
+from app.api import book, auth, user, metrics
+from app.backend.db import replica_engine
+from app.backend.middleware import MetricsMiddleware, QueryStatsMiddleware, ReadYourWritesMiddleware
+from app.backend.notifications import notification_listener
+from app.services.archive_service import ARCHIVE_ENABLED, borrow_archiver
+from app.services.availability import AVAILABILITY_STREAM_ENABLED, availability_hub
+from app.services.auth_service import init_auth_engine
+from app.services.catalog_cache import CATALOG_CACHE_ENABLED, CATALOG_CHANNEL, catalog_cache
+from app.services.overdue_service import OVERDUE_SCAN_ENABLED, overdue_scanner
 
 
-app = FastAPI()
+# изменения каталога из других воркеров приходят через LISTEN/NOTIFY
+if CATALOG_CACHE_ENABLED:
+    notification_listener.subscribe(CATALOG_CHANNEL, catalog_cache.handle_notification, catalog_cache.handle_reconnect)
+# триггеры таблицы book сообщают id измененных книг, количество экземпляров рассылается подписчикам потока
+if AVAILABILITY_STREAM_ENABLED:
+    notification_listener.subscribe(
+        CATALOG_CHANNEL, availability_hub.handle_notification, availability_hub.handle_reconnect
+    )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # ключи JWT разбираются при запуске, без настроек приложение не стартует
+    init_auth_engine()
+    await notification_listener.start()
+    if ARCHIVE_ENABLED:
+        await borrow_archiver.start()
+    if OVERDUE_SCAN_ENABLED:
+        await overdue_scanner.start()
+    yield
+    await overdue_scanner.stop()
+    await borrow_archiver.stop()
+    await notification_listener.stop()
+
+
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
+
+# закрепление за основной БД нужно, только если чтения идут с реплики
+if replica_engine is not None:
+    app.add_middleware(ReadYourWritesMiddleware)
+app.add_middleware(QueryStatsMiddleware)
+# добавляется последним, чтобы замер включал остальные middleware
+app.add_middleware(MetricsMiddleware)
 
 
 app.include_router(book.router)
 app.include_router(auth.router)
-app.include_router(user.router)
\ No newline at end of file
+app.include_router(user.router)
+app.include_router(metrics.router)
@@ -25,7 +25,7 @@ if config.config_file_name is not None:
 # from myapp import mymodel
 # target_metadata = mymodel.Base.metadata
 from app.backend.db import Base
-from app.models import book, reader, librarian
+from app.models import book, reader, librarian, token
 
 target_metadata = Base.metadata
 
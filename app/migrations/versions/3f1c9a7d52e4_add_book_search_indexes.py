@@ -0,0 +1,46 @@
+"""add_book_search_indexes
+
+Revision ID: 3f1c9a7d52e4
+Revises: be7a5e3e1849
+Create Date: 2026-10-18 11:03:47.918244
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision: str = '3f1c9a7d52e4'
+down_revision: Union[str, None] = 'be7a5e3e1849'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.add_column('book',
+                  sa.Column('search_vector', postgresql.TSVECTOR(),
+                            sa.Computed(
+                                "setweight(to_tsvector('simple', coalesce(name, '')), 'A') || "
+                                "setweight(to_tsvector('simple', coalesce(author, '')), 'B') || "
+                                "setweight(to_tsvector('simple', coalesce(description, '')), 'C')",
+                                persisted=True
+                            ),
+                            nullable=True))
+    op.create_index('ix_book_search_vector', 'book', ['search_vector'], unique=False,
+                    postgresql_using='gin')
+    op.create_index('ix_book_name_trgm', 'book', ['name'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+    op.create_index('ix_book_author_trgm', 'book', ['author'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'author': 'gin_trgm_ops'})
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_book_author_trgm', table_name='book')
+    op.drop_index('ix_book_name_trgm', table_name='book')
+    op.drop_index('ix_book_search_vector', table_name='book')
+    op.drop_column('book', 'search_vector')
@@ -0,0 +1,36 @@
+"""add_reader_active_borrow_count
+
+Revision ID: 5a7e3c9b0d14
+Revises: 9d2b6e4f1a83
+Create Date: 2026-10-18 15:02:18.447120
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '5a7e3c9b0d14'
+down_revision: Union[str, None] = '9d2b6e4f1a83'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('reader',
+                  sa.Column('active_borrow_count', sa.Integer(), nullable=False, server_default='0'))
+    # заполняем счетчик по активным выдачам (использует частичный индекс по reader_id)
+    op.execute(
+        "UPDATE reader SET active_borrow_count = active.count "
+        "FROM (SELECT reader_id, count(*) AS count FROM borrowed_book WHERE is_active GROUP BY reader_id) active "
+        "WHERE reader.id = active.reader_id"
+    )
+    op.create_check_constraint('check_reader_active_borrow_count_positive', 'reader', 'active_borrow_count >= 0')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('check_reader_active_borrow_count_positive', 'reader', type_='check')
+    op.drop_column('reader', 'active_borrow_count')
@@ -0,0 +1,32 @@
+"""add_borrowed_book_reader_history_index
+
+Revision ID: 5e9b3a7d2c48
+Revises: d41a7f3e9c25
+Create Date: 2026-10-18 21:14:37.918204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '5e9b3a7d2c48'
+down_revision: Union[str, None] = 'd41a7f3e9c25'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # индекс строится без блокировки записи в горячую таблицу выдач
+    with op.get_context().autocommit_block():
+        op.create_index('ix_borrowed_book_reader_borrow_date', 'borrowed_book', ['reader_id', 'borrow_date', 'id'],
+                        unique=False, postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_borrowed_book_reader_borrow_date', table_name='borrowed_book',
+                      postgresql_concurrently=True, if_exists=True)
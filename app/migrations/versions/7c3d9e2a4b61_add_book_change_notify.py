@@ -0,0 +1,88 @@
+"""add_book_change_notify
+
+Revision ID: 7c3d9e2a4b61
+Revises: e2b7d4c1f805
+Create Date: 2026-10-18 18:05:12.504117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '7c3d9e2a4b61'
+down_revision: Union[str, None] = 'e2b7d4c1f805'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# одно уведомление на запрос: id измененных книг, при большем количестве строк ids = null (сбросить весь каталог),
+# предел держит полезную нагрузку NOTIFY ниже 8000 байт
+NOTIFY_FUNCTION = """
+CREATE FUNCTION notify_book_change() RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+    changed bigint;
+    ids bigint[];
+    reordered boolean := false;
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        changed := NULL;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT count(*) INTO changed FROM old_rows;
+        IF changed <= 500 THEN
+            SELECT array_agg(id) INTO ids FROM old_rows;
+        END IF;
+    ELSE
+        SELECT count(*) INTO changed FROM new_rows;
+        IF changed <= 500 THEN
+            SELECT array_agg(id) INTO ids FROM new_rows;
+        END IF;
+        IF TG_OP = 'UPDATE' AND changed <= 500 THEN
+            -- порядок страниц по автору меняется только при изменении названия или автора
+            SELECT coalesce(bool_or(n.name IS DISTINCT FROM o.name OR n.author IS DISTINCT FROM o.author), false)
+            INTO reordered FROM new_rows n JOIN old_rows o USING (id);
+        END IF;
+    END IF;
+
+    IF changed = 0 THEN
+        RETURN NULL;
+    END IF;
+    PERFORM pg_notify(
+        'catalog_invalidation',
+        json_build_object('op', lower(TG_OP), 'ids', ids, 'reordered', reordered)::text
+    );
+    RETURN NULL;
+END
+$$
+"""
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute(NOTIFY_FUNCTION)
+    # переходные таблицы разрешены только у триггеров на одно событие
+    op.execute(
+        "CREATE TRIGGER book_insert_notify AFTER INSERT ON book REFERENCING NEW TABLE AS new_rows "
+        "FOR EACH STATEMENT EXECUTE FUNCTION notify_book_change()"
+    )
+    op.execute(
+        "CREATE TRIGGER book_update_notify AFTER UPDATE ON book "
+        "REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows "
+        "FOR EACH STATEMENT EXECUTE FUNCTION notify_book_change()"
+    )
+    op.execute(
+        "CREATE TRIGGER book_delete_notify AFTER DELETE ON book REFERENCING OLD TABLE AS old_rows "
+        "FOR EACH STATEMENT EXECUTE FUNCTION notify_book_change()"
+    )
+    op.execute(
+        "CREATE TRIGGER book_truncate_notify AFTER TRUNCATE ON book "
+        "FOR EACH STATEMENT EXECUTE FUNCTION notify_book_change()"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for trigger in ('book_insert_notify', 'book_update_notify', 'book_delete_notify', 'book_truncate_notify'):
+        op.execute(f"DROP TRIGGER {trigger} ON book")
+    op.execute("DROP FUNCTION notify_book_change()")
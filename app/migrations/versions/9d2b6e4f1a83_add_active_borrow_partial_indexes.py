@@ -0,0 +1,38 @@
+"""add_active_borrow_partial_indexes
+
+Revision ID: 9d2b6e4f1a83
+Revises: c4e81d0b7a26
+Create Date: 2026-10-18 14:20:55.130842
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '9d2b6e4f1a83'
+down_revision: Union[str, None] = 'c4e81d0b7a26'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CREATE INDEX CONCURRENTLY не блокирует запись в таблицу, но не может выполняться в транзакции
+    with op.get_context().autocommit_block():
+        op.create_index('ix_borrowed_book_active_reader', 'borrowed_book', ['reader_id'], unique=False,
+                        postgresql_where=sa.text('is_active'), postgresql_concurrently=True,
+                        if_not_exists=True)
+        op.create_index('ix_borrowed_book_active_book_reader', 'borrowed_book', ['book_id', 'reader_id'],
+                        unique=False, postgresql_where=sa.text('is_active'), postgresql_concurrently=True,
+                        if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_borrowed_book_active_book_reader', table_name='borrowed_book',
+                      postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_borrowed_book_active_reader', table_name='borrowed_book',
+                      postgresql_concurrently=True, if_exists=True)
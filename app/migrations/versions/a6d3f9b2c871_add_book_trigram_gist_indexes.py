@@ -0,0 +1,45 @@
+"""add_book_trigram_gist_indexes
+
+Revision ID: a6d3f9b2c871
+Revises: 5e9b3a7d2c48
+Create Date: 2026-10-18 22:41:09.537164
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = 'a6d3f9b2c871'
+down_revision: Union[str, None] = '5e9b3a7d2c48'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # поиск берет ближайших по триграммам кандидатов через ORDER BY <-> LIMIT, это умеет только GiST индекс,
+    # он же обслуживает оператор %, поэтому GIN индексы больше не нужны
+    with op.get_context().autocommit_block():
+        op.create_index('ix_book_name_trgm_gist', 'book', ['name'], unique=False,
+                        postgresql_using='gist', postgresql_ops={'name': 'gist_trgm_ops'},
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_book_author_trgm_gist', 'book', ['author'], unique=False,
+                        postgresql_using='gist', postgresql_ops={'author': 'gist_trgm_ops'},
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.drop_index('ix_book_name_trgm', table_name='book', postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_book_author_trgm', table_name='book', postgresql_concurrently=True, if_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.create_index('ix_book_name_trgm', 'book', ['name'], unique=False,
+                        postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'},
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_book_author_trgm', 'book', ['author'], unique=False,
+                        postgresql_using='gin', postgresql_ops={'author': 'gin_trgm_ops'},
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.drop_index('ix_book_name_trgm_gist', table_name='book', postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_book_author_trgm_gist', table_name='book', postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,58 @@
+"""add_borrowed_book_archive
+
+Revision ID: b8f2c6d4e913
+Revises: 7c3d9e2a4b61
+Create Date: 2026-10-18 19:12:37.781204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = 'b8f2c6d4e913'
+down_revision: Union[str, None] = '7c3d9e2a4b61'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # новая таблица создается пустой, история переносится архиватором пачками уже после миграции,
+    # поэтому миграция не блокирует borrowed_book на время копирования
+    op.create_table(
+        'borrowed_book_archive',
+        sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('borrow_date', sa.Date(), nullable=False),
+        sa.Column('return_date', sa.Date(), nullable=True),
+        sa.Column('book_id', sa.Integer(), nullable=False),
+        sa.Column('reader_id', sa.Integer(), nullable=False),
+        sa.Column('archived_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.ForeignKeyConstraint(['book_id'], ['book.id'], ),
+        sa.ForeignKeyConstraint(['reader_id'], ['reader.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_borrowed_book_archive_reader_borrow_date', 'borrowed_book_archive',
+                    ['reader_id', 'borrow_date', 'id'], unique=False)
+    op.create_index('ix_borrowed_book_archive_book_id', 'borrowed_book_archive', ['book_id'], unique=False)
+    # CREATE INDEX CONCURRENTLY не блокирует запись в таблицу, но не может выполняться в транзакции
+    with op.get_context().autocommit_block():
+        op.create_index('ix_borrowed_book_returned', 'borrowed_book', ['return_date'], unique=False,
+                        postgresql_where=sa.text('NOT is_active'), postgresql_concurrently=True,
+                        if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # перенесенные выдачи возвращаются в borrowed_book, чтобы не потерять историю
+    op.execute(
+        "INSERT INTO borrowed_book (id, borrow_date, return_date, is_active, book_id, reader_id) "
+        "SELECT id, borrow_date, return_date, false, book_id, reader_id FROM borrowed_book_archive"
+    )
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_borrowed_book_returned', table_name='borrowed_book',
+                      postgresql_concurrently=True, if_exists=True)
+    op.drop_index('ix_borrowed_book_archive_book_id', table_name='borrowed_book_archive')
+    op.drop_index('ix_borrowed_book_archive_reader_borrow_date', table_name='borrowed_book_archive')
+    op.drop_table('borrowed_book_archive')
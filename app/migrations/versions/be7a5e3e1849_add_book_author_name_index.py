@@ -0,0 +1,28 @@
+"""add_book_author_name_index
+
+Revision ID: be7a5e3e1849
+Revises: 87f92b009f70
+Create Date: 2026-10-18 10:12:31.204518
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = 'be7a5e3e1849'
+down_revision: Union[str, None] = '87f92b009f70'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # индекс для keyset-пагинации каталога по (author, name, id)
+    op.create_index('ix_book_author_name_id', 'book', ['author', 'name', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_book_author_name_id', table_name='book')
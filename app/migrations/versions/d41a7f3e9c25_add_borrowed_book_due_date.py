@@ -0,0 +1,58 @@
+"""add_borrowed_book_due_date
+
+Revision ID: d41a7f3e9c25
+Revises: b8f2c6d4e913
+Create Date: 2026-10-18 20:03:51.226730
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = 'd41a7f3e9c25'
+down_revision: Union[str, None] = 'b8f2c6d4e913'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# срок выдачи для уже выданных книг, как LOAN_PERIOD_DAYS по умолчанию
+LOAN_PERIOD_DAYS = 14
+# сколько активных выдач заполняется одной транзакцией
+BACKFILL_BATCH_SIZE = 10000
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # столбец без значения по умолчанию добавляется без перезаписи таблицы
+    op.add_column('borrowed_book', sa.Column('due_date', sa.Date(), nullable=True))
+    op.add_column('borrowed_book_archive', sa.Column('due_date', sa.Date(), nullable=True))
+    op.alter_column('borrowed_book', 'borrow_date', server_default=sa.text('CURRENT_DATE'))
+
+    # срок нужен только активным выдачам, они заполняются пачками, чтобы не держать долгие блокировки
+    with op.get_context().autocommit_block():
+        connection = op.get_bind()
+        while True:
+            updated = connection.execute(
+                sa.text(
+                    "UPDATE borrowed_book SET due_date = borrow_date + CAST(:period AS integer) "
+                    "WHERE id IN (SELECT id FROM borrowed_book WHERE is_active AND due_date IS NULL LIMIT :batch)"
+                ),
+                {"period": LOAN_PERIOD_DAYS, "batch": BACKFILL_BATCH_SIZE}
+            )
+            if updated.rowcount < BACKFILL_BATCH_SIZE:
+                break
+        op.create_index('ix_borrowed_book_active_due_date', 'borrowed_book', ['due_date', 'id'], unique=False,
+                        postgresql_where=sa.text('is_active'), postgresql_concurrently=True,
+                        if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_borrowed_book_active_due_date', table_name='borrowed_book',
+                      postgresql_concurrently=True, if_exists=True)
+    op.alter_column('borrowed_book', 'borrow_date', server_default=None)
+    op.drop_column('borrowed_book_archive', 'due_date')
+    op.drop_column('borrowed_book', 'due_date')
@@ -0,0 +1,33 @@
+"""add_book_reader_version
+
+Revision ID: e2b7d4c1f805
+Revises: 5a7e3c9b0d14
+Create Date: 2026-10-18 16:21:40.118392
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = 'e2b7d4c1f805'
+down_revision: Union[str, None] = '5a7e3c9b0d14'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # константные значения по умолчанию не переписывают таблицу, существующие строки получают их сразу
+    for table in ('book', 'reader'):
+        op.add_column(table, sa.Column('version', sa.Integer(), nullable=False, server_default='1'))
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(timezone=True), nullable=False,
+                                       server_default=sa.text('now()')))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table in ('book', 'reader'):
+        op.drop_column(table, 'updated_at')
+        op.drop_column(table, 'version')
@@ -1,3 +1,4 @@
-from app.models.book import Book, BorrowedBook
+from app.models.book import Book, BorrowedBook, BorrowedBookArchive
 from app.models.librarian import Librarian
 from app.models.reader import Reader
+from app.models.token import RevokedToken
@@ -2,7 +2,8 @@
 import datetime
 from typing import List, Optional
 # installed
-from sqlalchemy import ForeignKey, String, CheckConstraint
+from sqlalchemy import ForeignKey, String, CheckConstraint, Index, Computed, DateTime, func, text
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 # local
 from app.backend.db import Base
@@ -12,6 +13,13 @@ class Book(Base):
     __tablename__ = "book"
     __table_args__ = (
         CheckConstraint("copies_quantity >= 0", name="check_book_copies_positive"),
+        Index("ix_book_author_name_id", "author", "name", "id"),
+        Index("ix_book_search_vector", "search_vector", postgresql_using="gin"),
+        # GiST, а не GIN: кроме похожести % он отдает ближайшие строки по расстоянию <-> (KNN) для поиска
+        Index("ix_book_name_trgm_gist", "name", postgresql_using="gist", postgresql_ops={"name": "gist_trgm_ops"}),
+        Index(
+            "ix_book_author_trgm_gist", "author", postgresql_using="gist", postgresql_ops={"author": "gist_trgm_ops"}
+        ),
     )
 
     id: Mapped[int] = mapped_column(primary_key=True, index=True)
@@ -20,17 +28,49 @@ class Book(Base):
     publication_year: Mapped[Optional[int]] = mapped_column()
     isbn: Mapped[Optional[str]] = mapped_column(String(13), unique=True)
     copies_quantity: Mapped[int] = mapped_column(default=1)
-    description: Mapped[str] = mapped_column(String(500))
+    description: Mapped[str] = mapped_column(String(500), server_default="тут будет описание")
+    # вычисляемый столбец для полнотекстового поиска, не загружается вместе с книгой
+    search_vector: Mapped[Optional[str]] = mapped_column(
+        TSVECTOR,
+        Computed(
+            "setweight(to_tsvector('simple', coalesce(name, '')), 'A') || "
+            "setweight(to_tsvector('simple', coalesce(author, '')), 'B') || "
+            "setweight(to_tsvector('simple', coalesce(description, '')), 'C')",
+            persisted=True
+        ),
+        deferred=True
+    )
+
+    # версия строки и время ее изменения для ETag и Last-Modified, меняются каждым UPDATE книги
+    version: Mapped[int] = mapped_column(default=1, server_default="1")
+    updated_at: Mapped[datetime.datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
 
     borrowed_books: Mapped[List["BorrowedBook"]] = relationship(back_populates="book")
 
+    # значения по умолчанию из БД возвращаются сразу в INSERT ... RETURNING
+    __mapper_args__ = {"eager_defaults": True}
+
 
 class BorrowedBook(Base):
     __tablename__ = "borrowed_book"
+    __table_args__ = (
+        # частичные индексы только по активным выдачам, история возвратов в них не попадает
+        Index("ix_borrowed_book_active_reader", "reader_id", postgresql_where=text("is_active")),
+        Index("ix_borrowed_book_active_book_reader", "book_id", "reader_id", postgresql_where=text("is_active")),
+        # очередь архиватора: закрытые выдачи по дате возврата
+        Index("ix_borrowed_book_returned", "return_date", postgresql_where=text("NOT is_active")),
+        # просроченные выдачи по сроку возврата для keyset-обхода
+        Index("ix_borrowed_book_active_due_date", "due_date", "id", postgresql_where=text("is_active")),
+        # история выдач читателя, еще не перенесенных в архив, от новых к старым
+        Index("ix_borrowed_book_reader_borrow_date", "reader_id", "borrow_date", "id"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, index=True)
-    borrow_date: Mapped[datetime.date] = mapped_column(default=datetime.date.today())
+    # дата вычисляется при каждой вставке, а не один раз при импорте модуля
+    borrow_date: Mapped[datetime.date] = mapped_column(default=datetime.date.today, server_default=func.current_date())
     return_date: Mapped[Optional[datetime.date]] = mapped_column(nullable=True, default=None)
+    # срок возврата, задается при выдаче, у выдач до его появления заполнен только для активных
+    due_date: Mapped[Optional[datetime.date]] = mapped_column(nullable=True)
     is_active: Mapped[bool] = mapped_column(default=True)
 
     book_id: Mapped[int] = mapped_column(ForeignKey("book.id"))
@@ -40,4 +80,21 @@ class BorrowedBook(Base):
     reader: Mapped["Reader"] = relationship(back_populates="borrowed_books")
 
 
+class BorrowedBookArchive(Base):
+    """ Закрытые выдачи, перенесенные архиватором из borrowed_book, чтобы горячая таблица содержала
+    только активные и недавно закрытые выдачи """
+    __tablename__ = "borrowed_book_archive"
+    __table_args__ = (
+        # id в конце индекса нужен keyset-пагинации истории читателя по (borrow_date, id)
+        Index("ix_borrowed_book_archive_reader_borrow_date", "reader_id", "borrow_date", "id"),
+        Index("ix_borrowed_book_archive_book_id", "book_id"),
+    )
 
+    # id сохраняется из borrowed_book
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    borrow_date: Mapped[datetime.date] = mapped_column()
+    return_date: Mapped[Optional[datetime.date]] = mapped_column(nullable=True)
+    due_date: Mapped[Optional[datetime.date]] = mapped_column(nullable=True)
+    book_id: Mapped[int] = mapped_column(ForeignKey("book.id"))
+    reader_id: Mapped[int] = mapped_column(ForeignKey("reader.id"))
+    archived_at: Mapped[datetime.datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
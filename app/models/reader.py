@@ -1,15 +1,30 @@
 # base
+import datetime
 from typing import List
 # installed
-from sqlalchemy.orm import Mapped, relationship
+from sqlalchemy import CheckConstraint, DateTime, func
+from sqlalchemy.orm import Mapped, mapped_column, relationship
 # local
 from app.models.user import BaseUser
 
 
 class Reader(BaseUser):
     __tablename__ = "reader"
+    __table_args__ = (
+        CheckConstraint("active_borrow_count >= 0", name="check_reader_active_borrow_count_positive"),
+    )
 
+    # количество невозвращенных книг, меняется вместе с выдачей и возвратом
+    active_borrow_count: Mapped[int] = mapped_column(default=0, server_default="0")
+    # версия строки и время ее изменения для ETag и Last-Modified, меняются каждым UPDATE читателя
+    version: Mapped[int] = mapped_column(default=1, server_default="1")
+    updated_at: Mapped[datetime.datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+
+    # история выдач не загружается вместе с читателем, при необходимости ее нужно запрашивать явно
     borrowed_books: Mapped[List["BorrowedBook"]] = relationship(
         back_populates="reader",
-        lazy="selectin"
-    )
\ No newline at end of file
+        lazy="raise"
+    )
+
+    # значения по умолчанию из БД возвращаются сразу в INSERT ... RETURNING
+    __mapper_args__ = {"eager_defaults": True}
\ No newline at end of file
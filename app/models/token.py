@@ -0,0 +1,15 @@
+# base
+import datetime
+# installed
+from sqlalchemy import String, DateTime
+from sqlalchemy.orm import Mapped, mapped_column
+# local
+from app.backend.db import Base
+
+
+class RevokedToken(Base):
+    __tablename__ = "revoked_token"
+
+    jti: Mapped[str] = mapped_column(String(32), primary_key=True)
+    # после истечения токена запись больше не нужна и удаляется
+    expires_at: Mapped[datetime.datetime] = mapped_column(DateTime(timezone=True), index=True)
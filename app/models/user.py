@@ -1,9 +1,9 @@
 # installed
-from email_validator import validate_email
 from sqlalchemy import String
 from sqlalchemy.orm import Mapped, mapped_column, validates
 # local
 from app.backend.db import Base
+from app.services.email_validation import email_validator
 
 
 class BaseUser(Base):
@@ -15,6 +15,5 @@ class BaseUser(Base):
 
     @validates("email")
     def email_validate(self, key, address):
-        if not validate_email(address):
-            raise ValueError("Некорректный адрес электронной почты")
-        return address
+        # режим проверки (только синтаксис или еще и DNS домена) задается EMAIL_VALIDATION_MODE
+        return email_validator.validate(address)
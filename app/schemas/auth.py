@@ -1,5 +1,6 @@
 # base
 from datetime import datetime
+from typing import Optional
 # installed
 from pydantic import BaseModel
 
@@ -7,4 +8,14 @@ from pydantic import BaseModel
 class TokenPayload(BaseModel):
     exp: datetime
     sub: str
-    scope: str
\ No newline at end of file
+    scope: str
+    jti: Optional[str] = None
+
+
+class RefreshToken(BaseModel):
+    refresh_token: str
+
+
+class TokenPair(BaseModel):
+    access_token: str
+    refresh_token: str
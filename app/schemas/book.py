@@ -1,7 +1,8 @@
 # base
-from typing import Optional
+from datetime import date
+from typing import List, Optional
 # installed
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 
 
 class CreateBook(BaseModel):
@@ -16,4 +17,96 @@ class UpdateBook(BaseModel):
     author: Optional[str] = None
     publication_year: Optional[int] = None
     isbn: Optional[str] = None
-    copies_quantity: Optional[int] = None
\ No newline at end of file
+    copies_quantity: Optional[int] = None
+
+
+class BatchUpdateBook(UpdateBook):
+    id: int
+    # версия книги из ответа GET, при несовпадении книга не обновляется
+    version: Optional[int] = None
+
+
+class BorrowItem(BaseModel):
+    book_id: int
+    reader_id: int
+
+
+class BookResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    name: str
+    author: str
+    publication_year: Optional[int]
+    isbn: Optional[str]
+    copies_quantity: int
+    description: str
+    version: int
+
+
+class BookPage(BaseModel):
+    items: List[BookResponse]
+    next_cursor: Optional[str]
+
+
+class BookSearchResult(BookResponse):
+    rank: float
+
+
+class BorrowedBookResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    borrow_date: date
+    return_date: Optional[date]
+    due_date: Optional[date]
+    is_active: bool
+    book_id: int
+    reader_id: int
+
+
+class BookBrief(BaseModel):
+    id: int
+    name: str
+    author: str
+    isbn: Optional[str]
+
+
+class ReaderLoan(BorrowedBookResponse):
+    book: BookBrief
+
+
+class OverdueLoan(BorrowedBookResponse):
+    days_overdue: int
+
+
+class OverdueLoanPage(BaseModel):
+    items: List[OverdueLoan]
+    next_cursor: Optional[str]
+
+
+class BorrowResult(BaseModel):
+    book_id: int
+    reader_id: int
+    success: bool
+    detail: Optional[str]
+    borrowed_book: Optional[BorrowedBookResponse]
+
+
+class BookUpdateResult(BaseModel):
+    id: int
+    success: bool
+    detail: Optional[str]
+    version: Optional[int]
+
+
+class ImportRowError(BaseModel):
+    line: int
+    detail: str
+
+
+class ImportSummary(BaseModel):
+    inserted: int
+    updated: int
+    rejected: int
+    errors: List[ImportRowError]
@@ -1,7 +1,10 @@
 # base
-from typing import Optional
+from datetime import date
+from typing import List, Optional
 # installed
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
+# local
+from app.schemas.book import ReaderLoan
 
 
 class BaseCreateUser(BaseModel):
@@ -14,9 +17,64 @@ class CreateReader(BaseCreateUser):
 
 
 class UpdateReader(BaseCreateUser):
-    name: Optional[str]
-    email: Optional[str]
+    name: Optional[str] = None
+    email: Optional[str] = None
 
 
 class CreateLibrarian(BaseCreateUser):
     password: str
+
+
+class ReaderResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    name: str
+    email: str
+    active_borrow_count: int
+
+
+class LibrarianResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    name: str
+    email: str
+
+
+class RejectedReader(BaseModel):
+    index: int
+    email: str
+    detail: str
+
+
+class ReaderBatchSummary(BaseModel):
+    created: List[ReaderResponse]
+    duplicates: List[str]
+    rejected: List[RejectedReader]
+
+
+class ReaderDashboard(BaseModel):
+    reader: ReaderResponse
+    active_loans: List[ReaderLoan]
+
+
+class ReaderHistoryPage(BaseModel):
+    items: List[ReaderLoan]
+    next_cursor: Optional[str]
+
+
+class AuthorLoans(BaseModel):
+    author: str
+    loans: int
+
+
+class ReaderStats(BaseModel):
+    total_loans: int
+    active_loans: int
+    overdue_loans: int
+    returned_late: int
+    average_loan_days: Optional[float]
+    first_loan_date: Optional[date]
+    last_loan_date: Optional[date]
+    favorite_authors: List[AuthorLoans]
@@ -0,0 +1,116 @@
+# base
+import asyncio
+import logging
+import os
+from typing import Optional
+# installed
+from sqlalchemy import select, delete, insert, func
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+# local
+from app.backend.db import async_session_maker, env_flag
+from app.backend.metrics import Counter
+from app.models.book import BorrowedBook, BorrowedBookArchive
+
+logger = logging.getLogger(__name__)
+
+# перенос закрытых выдач в архив в фоне каждого воркера
+ARCHIVE_ENABLED = env_flag("ARCHIVE_ENABLED", True)
+# сколько выдач переносится одной транзакцией
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", 5000))
+# через сколько дней после возврата выдача уходит в архив
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", 1))
+# пауза между проходами, когда переносить больше нечего
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv("ARCHIVE_INTERVAL_SECONDS", 60))
+# пауза между пачками одного прохода, чтобы перенос большой истории не занимал БД целиком
+ARCHIVE_BATCH_PAUSE_SECONDS = float(os.getenv("ARCHIVE_BATCH_PAUSE_SECONDS", 0.1))
+
+ARCHIVED_BORROWS = Counter("borrow_archive_moved_total", "Закрытые выдачи, перенесенные в архив")
+
+ARCHIVE_COLUMNS = ("id", "borrow_date", "return_date", "due_date", "book_id", "reader_id")
+
+
+class BorrowArchiveService:
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def archive_batch(self, batch_size: int = ARCHIVE_BATCH_SIZE, after_days: int = ARCHIVE_AFTER_DAYS) -> int:
+        """ Переносит до batch_size закрытых выдач в архив одной транзакцией, возвращает количество """
+        # строки, заблокированные другим архиватором, пропускаются, поэтому воркеры не мешают друг другу
+        returned = (
+            select(BorrowedBook.id)
+            .where(BorrowedBook.is_active == False)
+            .where(BorrowedBook.return_date <= func.current_date() - after_days)
+            .order_by(BorrowedBook.return_date)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        moved = (
+            delete(BorrowedBook)
+            .where(BorrowedBook.id.in_(returned.scalar_subquery()))
+            .returning(*(BorrowedBook.__table__.c[column] for column in ARCHIVE_COLUMNS))
+            .cte("moved")
+        )
+        stmt = (
+            insert(BorrowedBookArchive)
+            .from_select(ARCHIVE_COLUMNS, select(*(moved.c[column] for column in ARCHIVE_COLUMNS)))
+        )
+        result = await self.db.execute(stmt)
+        await self.db.commit()
+        ARCHIVED_BORROWS.inc(amount=result.rowcount)
+        return result.rowcount
+
+    async def archive_returned(
+            self,
+            batch_size: int = ARCHIVE_BATCH_SIZE,
+            after_days: int = ARCHIVE_AFTER_DAYS,
+            pause: float = ARCHIVE_BATCH_PAUSE_SECONDS,
+            max_batches: Optional[int] = None,
+    ) -> int:
+        """ Переносит закрытые выдачи пачками, пока они есть, возвращает общее количество """
+        total = 0
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            moved = await self.archive_batch(batch_size, after_days)
+            total += moved
+            batches += 1
+            if moved < batch_size:
+                break
+            await asyncio.sleep(pause)
+        return total
+
+
+class BorrowArchiver:
+    """ Фоновый перенос закрытых выдач в архив, запускается и останавливается в lifespan приложения """
+
+    def __init__(self, session_maker: async_sessionmaker = async_session_maker,
+                 interval: float = ARCHIVE_INTERVAL_SECONDS):
+        self.session_maker = session_maker
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                async with self.session_maker() as db:
+                    await BorrowArchiveService(db).archive_returned()
+            except Exception:
+                # недоступная БД не должна останавливать архиватор, следующая попытка через interval
+                logger.exception("Ошибка переноса выдач в архив")
+            await asyncio.sleep(self.interval)
+
+
+borrow_archiver = BorrowArchiver()
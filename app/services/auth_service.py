@@ -1,55 +1,155 @@
 # base
 import os
+import uuid
 from datetime import datetime, timedelta, timezone
+from typing import Optional
 # installed
-from dotenv import load_dotenv
-from passlib.context import CryptContext
-from jose import jwt
+from jose import jwk, jwt
+from jose.exceptions import JWTClaimsError
+from sqlalchemy import delete, func
+from sqlalchemy.dialects.postgresql import insert
+# local
+from app.models.token import RevokedToken
+from app.schemas.auth import TokenPayload
+from app.services.cache import TTLCache
+from app.services.hashing import PasswordHasher, password_hasher
 
 
-load_dotenv()
+UTC_3 = timezone(timedelta(hours=3))
+ACCESS_TOKEN_EXPIRE_MINUTES = 1  # 1 минута
+REFRESH_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 дней
 
 
-class AuthService:
-    def __init__(self, db):
-        self.db = db
-        self.UTC_3 = timezone(timedelta(hours=3))
+class RevocationStore:
+    """ Отозванные refresh токены: множество в памяти процесса поверх таблицы revoked_token """
 
-        self.bcrypt_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
-        self.ACCESS_TOKEN_EXPIRE_MINUTES = 1  # 1 минута
-        self.REFRESH_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 дней
-        self.ALGORITHM = os.getenv("ALGORITHM")
-        self.JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY")
-        self.JWT_REFRESH_SECRET_KEY = os.getenv("JWT_REFRESH_SECRET_KEY")
+    def __init__(self, maxsize: int):
+        # запись в памяти живет не дольше самого токена
+        self._revoked = TTLCache(maxsize, ttl=float("inf"))
 
-    def hash_password(self, password: str):
-        """ Хэширует пароль """
-        return self.bcrypt_context.hash(password)
+    async def revoke(self, db, jti: str, expires_at: datetime) -> bool:
+        """ Отзывает токен и фиксирует транзакцию, возвращает False, если он уже был отозван
+        (в том числе другим процессом) """
+        if self._revoked.get(jti):
+            return False
 
-    def verify_password(self, password: str, hashed_password: str):
-        """ Проверяет password на соответствие с hashed_password в БД """
-        return self.bcrypt_context.verify(password, hashed_password)
+        # заодно удаляются записи об уже истекших токенах, чтобы таблица оставалась маленькой
+        purge_expired = (
+            delete(RevokedToken)
+            .where(RevokedToken.expires_at < func.now())
+            .cte("purge_expired")
+        )
+        stmt = (
+            insert(RevokedToken)
+            .values(jti=jti, expires_at=expires_at)
+            .on_conflict_do_nothing(index_elements=[RevokedToken.jti])
+            .returning(RevokedToken.jti)
+            .add_cte(purge_expired)
+        )
+        revoked = await db.scalar(stmt)
+        if revoked is not None:
+            await db.commit()
 
-    def create_access_token(self, subject: str):
-        """ Создает access token """
-        expires_delta = datetime.now(self.UTC_3) + timedelta(minutes=self.ACCESS_TOKEN_EXPIRE_MINUTES)
+        # запись в памяти появляется только после фиксации: если commit не прошел, токен не отозван
+        # и повторная попытка снова идет в БД
+        self._revoked.set(jti, True, (expires_at - datetime.now(timezone.utc)).total_seconds())
+        return revoked is not None
+
+
+revocation_store = RevocationStore(maxsize=int(os.getenv("REVOKED_TOKENS_CACHE_SIZE", 100000)))
+
+
+class AuthEngine:
+    """ Ключи JWT и пул bcrypt процесса. Ключи разбираются один раз, а не при каждой подписи и проверке токена """
+
+    def __init__(self, algorithm: str, secret_key: str, refresh_secret_key: str,
+                 hasher: PasswordHasher = password_hasher):
+        if not (algorithm and secret_key and refresh_secret_key):
+            raise RuntimeError("Не заданы ALGORITHM, JWT_SECRET_KEY или JWT_REFRESH_SECRET_KEY")
+        self.algorithm = algorithm
+        self.algorithms = [algorithm]
+        # с готовым ключом jose не строит его заново и не пробует разобрать секрет как JSON
+        self.access_key = jwk.construct(secret_key, algorithm)
+        self.refresh_key = jwk.construct(refresh_secret_key, algorithm)
+        self.hasher = hasher
 
+    @classmethod
+    def from_env(cls) -> "AuthEngine":
+        return cls(os.getenv("ALGORITHM"), os.getenv("JWT_SECRET_KEY"), os.getenv("JWT_REFRESH_SECRET_KEY"))
+
+    def create_access_token(self, subject: str) -> str:
         payload = {
-            "exp": expires_delta,
+            "exp": datetime.now(UTC_3) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES),
             "sub": subject,
             "scope": "access"
         }
-        encoded_jwt = jwt.encode(payload, self.JWT_SECRET_KEY, self.ALGORITHM)
-        return encoded_jwt
+        return jwt.encode(payload, self.access_key, self.algorithm)
+
+    def create_refresh_token(self, subject: str) -> str:
+        payload = {
+            "exp": datetime.now(UTC_3) + timedelta(minutes=REFRESH_TOKEN_EXPIRE_MINUTES),
+            "sub": subject,
+            "scope": "refresh",
+            "jti": uuid.uuid4().hex
+        }
+        return jwt.encode(payload, self.refresh_key, self.algorithm)
+
+    def decode_access_token(self, token: str) -> TokenPayload:
+        """ Проверяет подпись и срок access токена """
+        return TokenPayload(**jwt.decode(token=token, key=self.access_key, algorithms=self.algorithms))
+
+    def decode_refresh_token(self, token: str) -> TokenPayload:
+        """ Проверяет подпись и срок refresh токена """
+        return TokenPayload(**jwt.decode(token=token, key=self.refresh_key, algorithms=self.algorithms))
+
+
+auth_engine: Optional[AuthEngine] = None
+
+
+def init_auth_engine() -> AuthEngine:
+    """ Создает AuthEngine процесса из настроек окружения, вызывается в lifespan приложения """
+    global auth_engine
+    auth_engine = AuthEngine.from_env()
+    return auth_engine
+
+
+def get_auth_engine() -> AuthEngine:
+    """ AuthEngine процесса, создается при первом обращении, если lifespan не запускался (скрипты, тесты) """
+    return auth_engine if auth_engine is not None else init_auth_engine()
+
+
+class AuthService:
+    def __init__(self, db, engine: Optional[AuthEngine] = None):
+        self.db = db
+        self.engine = engine if engine is not None else get_auth_engine()
+
+    async def hash_password(self, password: str):
+        """ Хэширует пароль в пуле bcrypt """
+        return await self.engine.hasher.hash(password)
+
+    async def verify_password(self, password: str, hashed_password: str):
+        """ Проверяет password на соответствие с hashed_password в БД в пуле bcrypt """
+        return await self.engine.hasher.verify(password, hashed_password)
+
+    def create_access_token(self, subject: str):
+        """ Создает access token """
+        return self.engine.create_access_token(subject)
 
     def create_refresh_token(self, subject: str):
         """ Создает refresh token """
-        expires_delta = datetime.now(self.UTC_3) + timedelta(minutes=self.REFRESH_TOKEN_EXPIRE_MINUTES)
+        return self.engine.create_refresh_token(subject)
 
-        payload = {
-            "exp": expires_delta,
-            "sub": subject,
-            "scope": "refresh"
+    async def refresh_tokens(self, refresh_token: str):
+        """ Выдает новую пару токенов по refresh токену, старый refresh токен отзывается """
+        token_data = self.engine.decode_refresh_token(refresh_token)
+        if token_data.scope != "refresh" or token_data.jti is None:
+            raise JWTClaimsError("Токен не является refresh токеном")
+
+        # ротация: каждый refresh токен можно использовать только один раз
+        if not await revocation_store.revoke(self.db, token_data.jti, token_data.exp):
+            raise ValueError("Refresh токен уже использован или отозван")
+
+        return {
+            "access_token": self.create_access_token(token_data.sub),
+            "refresh_token": self.create_refresh_token(token_data.sub),
         }
-        encoded_jwt = jwt.encode(payload, self.JWT_REFRESH_SECRET_KEY, self.ALGORITHM)
-        return encoded_jwt
@@ -0,0 +1,205 @@
+# base
+import asyncio
+import json
+import os
+from contextlib import contextmanager
+from typing import AsyncIterator, Dict, Iterable, Optional, Set
+# installed
+import orjson
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+# local
+from app.backend.db import async_session_maker, env_flag
+from app.backend.metrics import Counter, Gauge
+from app.models.book import Book
+
+# поток изменений количества экземпляров (SSE) вместо опроса GET /books
+AVAILABILITY_STREAM_ENABLED = env_flag("AVAILABILITY_STREAM_ENABLED", True)
+# как часто в поток отправляется комментарий, чтобы прокси не закрывали простаивающее соединение
+AVAILABILITY_HEARTBEAT_SECONDS = float(os.getenv("AVAILABILITY_HEARTBEAT_SECONDS", 15))
+# сколько неотправленных изменений копится у медленного клиента, сверх этого он получает resync
+AVAILABILITY_MAX_PENDING = int(os.getenv("AVAILABILITY_MAX_PENDING", 1000))
+# сколько книг можно отслеживать в одном потоке
+AVAILABILITY_MAX_BOOK_IDS = 1000
+
+AVAILABILITY_EVENTS = Counter("availability_events_total", "Отправленные в потоки события доступности", ["event"])
+AVAILABILITY_COALESCED = Counter(
+    "availability_coalesced_total",
+    "Изменения, замененные более новыми до отправки медленному клиенту"
+)
+
+
+def format_event(event: str, data) -> bytes:
+    """ Событие в формате text/event-stream """
+    AVAILABILITY_EVENTS.inc(event)
+    return b"event: " + event.encode() + b"\ndata: " + orjson.dumps(data) + b"\n\n"
+
+
+class AvailabilitySubscription:
+    """ Подписка одного клиента. Изменения одной книги склеиваются: пока клиент не прочитал предыдущее значение,
+    оно заменяется новым, поэтому медленный клиент не накапливает очередь и получает последнее состояние """
+
+    def __init__(self, book_ids: Optional[frozenset], max_pending: int = AVAILABILITY_MAX_PENDING):
+        # None - все книги каталога
+        self.book_ids = book_ids
+        self.max_pending = max_pending
+        # id книги -> copies_quantity, None - книга удалена
+        self.pending: Dict[int, Optional[int]] = {}
+        self.resync = False
+        self._ready = asyncio.Event()
+
+    def push(self, book_id: int, copies_quantity: Optional[int]):
+        if book_id in self.pending:
+            AVAILABILITY_COALESCED.inc()
+        elif len(self.pending) >= self.max_pending:
+            # клиент не успевает читать поток: вместо отдельных изменений он перечитает каталог
+            self.push_resync()
+            return
+        self.pending[book_id] = copies_quantity
+        self._ready.set()
+
+    def push_resync(self):
+        self.pending.clear()
+        self.resync = True
+        self._ready.set()
+
+    async def wait(self, timeout: float):
+        """ Ждет изменений не дольше timeout, возвращает (resync, изменения), при таймауте - (False, {}) """
+        if not self._ready.is_set():
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return False, {}
+        self._ready.clear()
+        changes, self.pending = self.pending, {}
+        resync, self.resync = self.resync, False
+        return resync, changes
+
+
+class AvailabilityHub:
+    """ Раздача изменений количества экземпляров подписчикам воркера. Изменения из всех воркеров приходят
+    через LISTEN от триггеров таблицы book, количество читается одним запросом на уведомление,
+    независимо от числа подписчиков """
+
+    def __init__(self, session_maker: async_sessionmaker = async_session_maker):
+        self.session_maker = session_maker
+        self._by_book: Dict[int, Set[AvailabilitySubscription]] = {}
+        self._catalog: Set[AvailabilitySubscription] = set()
+        # книги, количество которых нужно прочитать и разослать
+        self._dirty: Set[int] = set()
+        self._flushing = False
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._catalog) + len({subscription for subs in self._by_book.values() for subscription in subs})
+
+    @contextmanager
+    def subscribe(self, book_ids: Optional[Iterable[int]] = None):
+        """ Подписка на изменения книг book_ids или всего каталога, снимается при выходе из блока """
+        subscription = AvailabilitySubscription(frozenset(book_ids) if book_ids is not None else None)
+        if subscription.book_ids is None:
+            self._catalog.add(subscription)
+        else:
+            for book_id in subscription.book_ids:
+                self._by_book.setdefault(book_id, set()).add(subscription)
+        try:
+            yield subscription
+        finally:
+            self._catalog.discard(subscription)
+            for book_id in subscription.book_ids or ():
+                subscribers = self._by_book.get(book_id)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._by_book[book_id]
+
+    async def fetch_quantities(self, book_ids: Iterable[int]) -> Dict[int, int]:
+        """ Текущее количество экземпляров. Сессия открывается только на время запроса, поток соединение с БД
+        не держит; читается основная БД, потому что реплика может отставать от уведомления """
+        async with self.session_maker() as db:
+            rows = await db.execute(select(Book.id, Book.copies_quantity).where(Book.id.in_(list(book_ids))))
+            return dict(rows.all())
+
+    async def publish(self, book_ids: Iterable[int]):
+        """ Читает количество экземпляров книг и отправляет его подписчикам """
+        self._dirty.update(book_ids)
+        if self._flushing:
+            # изменения заберет уже идущая рассылка: запросы не выполняются параллельно, поэтому более старое
+            # значение не может прийти подписчикам после нового, а частые уведомления склеиваются в один запрос
+            return
+        self._flushing = True
+        try:
+            while self._dirty:
+                book_ids, self._dirty = self._dirty, set()
+                try:
+                    quantities = await self.fetch_quantities(book_ids)
+                except Exception:
+                    # изменения не теряются: книги перечитаются со следующим уведомлением, а их подписчики
+                    # получают resync сразу, потому что следующего уведомления может и не быть
+                    self._dirty |= book_ids
+                    self.push_resync(self._dirty)
+                    raise
+                for book_id in book_ids:
+                    copies_quantity = quantities.get(book_id)
+                    for subscription in self._by_book.get(book_id, ()):
+                        subscription.push(book_id, copies_quantity)
+                    for subscription in self._catalog:
+                        subscription.push(book_id, copies_quantity)
+        finally:
+            self._flushing = False
+
+    def push_resync(self, book_ids: Iterable[int]):
+        """ Отправляет resync подписчикам книг book_ids и всего каталога """
+        subscriptions = set(self._catalog)
+        for book_id in book_ids:
+            subscriptions.update(self._by_book.get(book_id, ()))
+        for subscription in subscriptions:
+            subscription.push_resync()
+
+    async def handle_notification(self, payload: str):
+        """ Изменение таблицы book из любого воркера, пришедшее через LISTEN """
+        if not self._by_book and not self._catalog:
+            return
+        change = json.loads(payload)
+        if change["op"] == "truncate" or change["ids"] is None:
+            # список id не передан: отслеживаемые книги перечитываются, подписчики каталога перечитывают его сами
+            await self.handle_reconnect()
+            return
+        if self._catalog:
+            await self.publish(change["ids"])
+        else:
+            await self.publish(book_id for book_id in change["ids"] if book_id in self._by_book)
+
+    async def handle_reconnect(self):
+        """ Пока слушатель был отключен, уведомления могли потеряться """
+        for subscription in self._catalog:
+            subscription.push_resync()
+        await self.publish(list(self._by_book))
+
+    async def stream(self, book_ids: Optional[Iterable[int]] = None,
+                     heartbeat: float = AVAILABILITY_HEARTBEAT_SECONDS) -> AsyncIterator[bytes]:
+        """ Поток text/event-stream: сначала текущее количество отслеживаемых книг, затем изменения """
+        with self.subscribe(book_ids) as subscription:
+            # подписка оформляется до чтения текущего состояния, чтобы не потерять изменения между ними
+            if subscription.book_ids:
+                quantities = await self.fetch_quantities(subscription.book_ids)
+                yield format_event("availability", [
+                    {"id": book_id, "copies_quantity": quantities.get(book_id)}
+                    for book_id in sorted(subscription.book_ids)
+                ])
+            while True:
+                resync, changes = await subscription.wait(heartbeat)
+                if resync:
+                    yield format_event("resync", {})
+                if changes:
+                    yield format_event("availability", [
+                        {"id": book_id, "copies_quantity": copies_quantity}
+                        for book_id, copies_quantity in changes.items()
+                    ])
+                if not resync and not changes:
+                    yield b": ping\n\n"
+
+
+availability_hub = AvailabilityHub()
+
+Gauge("availability_subscribers", "Открытые потоки доступности книг", function=lambda: availability_hub.subscribers)
@@ -1,24 +1,162 @@
 # base
-import datetime
+import os
+from collections import Counter
+from typing import List, Optional
 # installed
-from sqlalchemy import select, delete, update
+from sqlalchemy import select, delete, update, insert, tuple_, func, or_, exists, literal, true, case, cast, bindparam, union
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.exc import NoResultFound
 from sqlalchemy.ext.asyncio import AsyncSession
 # local
+from app.backend.db import replica_engine
 from app.models.book import Book, BorrowedBook
-from app.schemas.book import CreateBook, UpdateBook
-from app.services.other import model_to_dict
-from app.services.reader_service import ReaderService
+from app.models.reader import Reader
+from app.schemas.book import CreateBook, UpdateBook, BatchUpdateBook, BorrowItem
+from app.services.catalog_cache import catalog_cache, book_tags, page_tags, CREATED_BOOK_TAGS
+from app.services.other import encode_cursor, decode_cursor, bump_version, changed_values, partial_update
+
+
+# ключи сортировки для keyset-пагинации каталога, последний элемент всегда уникальный id
+BOOK_ORDERINGS = {
+    "id": (Book.id,),
+    "author": (Book.author, Book.name, Book.id),
+}
+
+# колонки книги, которые отдаются в списках и при потоковой выгрузке каталога
+BOOK_COLUMNS = (
+    Book.id,
+    Book.name,
+    Book.author,
+    Book.publication_year,
+    Book.isbn,
+    Book.copies_quantity,
+    Book.description,
+    Book.version,
+)
+
+# поля книги, которые меняются через PATCH
+UPDATABLE_BOOK_FIELDS = tuple(UpdateBook.model_fields)
+
+# колонки выдачи, которые отдаются в списках
+BORROWED_BOOK_COLUMNS = (
+    BorrowedBook.id,
+    BorrowedBook.borrow_date,
+    BorrowedBook.return_date,
+    BorrowedBook.due_date,
+    BorrowedBook.is_active,
+    BorrowedBook.book_id,
+    BorrowedBook.reader_id,
+)
+
+# максимальное количество книг, которые читатель может держать одновременно
+BORROW_LIMIT = 3
+# срок выдачи в днях, по нему вычисляется due_date
+LOAN_PERIOD_DAYS = int(os.getenv("LOAN_PERIOD_DAYS", 14))
+
+# конфигурация полнотекстового поиска, должна совпадать с выражением Book.search_vector
+SEARCH_CONFIG = "simple"
+# сколько кандидатов берется из каждого индекса поиска до ранжирования
+SEARCH_CANDIDATES = 200
 
 
 class BookService:
     def __init__(self, db: AsyncSession):
         self.db = db
 
-    async def get_all_books(self):
-        """ Получение всех книг """
-        books = await self.db.scalars(select(Book))
-        return books.all()
+    @property
+    def fills_cache(self) -> bool:
+        """ Реплика может отставать от уведомления о сбросе кэша, и прочитанное с нее старое значение
+        осталось бы в кэше до конца TTL, поэтому кэш заполняется только чтениями с основной БД """
+        return replica_engine is None or self.db.bind is not replica_engine
+
+    async def get_all_books(self, limit: int = 50, cursor: Optional[str] = None, order_by: str = "id"):
+        """ Получение страницы книг, возвращает книги и курсор следующей страницы """
+        key = ("page", order_by, cursor, limit)
+        page = await catalog_cache.get(key)
+        if page is not None:
+            return page
+
+        generation = catalog_cache.generation
+        # книги читаются строками без создания ORM объектов, версия нужна для ETag страницы
+        columns = (*BOOK_COLUMNS, Book.updated_at)
+        rows, next_cursor = await self._get_books_page(columns, limit, cursor, order_by)
+        books = [row._asdict() for row in rows]
+        if self.fills_cache:
+            await catalog_cache.set(key, (books, next_cursor), page_tags(books, order_by, next_cursor), generation)
+        return books, next_cursor
+
+    async def get_all_books_versions(self, limit: int = 50, cursor: Optional[str] = None, order_by: str = "id"):
+        """ Версии книг той же страницы, что и get_all_books, без загрузки остальных колонок """
+        # закэшированная страница уже содержит версии
+        page = await catalog_cache.get(("page", order_by, cursor, limit))
+        if page is not None:
+            return page
+
+        columns = (Book.version, Book.updated_at, *BOOK_ORDERINGS[order_by])
+        rows, next_cursor = await self._get_books_page(columns, limit, cursor, order_by)
+        return [row._asdict() for row in rows], next_cursor
+
+    async def _get_books_page(self, columns: tuple, limit: int, cursor: Optional[str], order_by: str):
+        """ Keyset-пагинация каталога: строки страницы и курсор следующей страницы """
+        keys = BOOK_ORDERINGS[order_by]
+        stmt = select(*columns).order_by(*keys).limit(limit + 1)
+
+        if cursor is not None:
+            # курсор хранит порядок сортировки и значения ключа последней книги предыдущей страницы
+            cursor_order, *last_values = decode_cursor(cursor)
+            if cursor_order != order_by or len(last_values) != len(keys) or not all(
+                    isinstance(value, key.type.python_type) for key, value in zip(keys, last_values)
+            ):
+                raise ValueError("Некорректный курсор")
+            stmt = stmt.where(tuple_(*keys) > tuple_(*last_values))
+
+        rows = (await self.db.execute(stmt)).all()
+
+        # лишняя запись означает, что есть следующая страница
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last_book = rows[-1]
+            next_cursor = encode_cursor([order_by, *(getattr(last_book, key.key) for key in keys)])
+        return rows, next_cursor
+
+    async def stream_all_books(self, batch_size: int = 1000):
+        """ Потоковое получение всех книг пачками через серверный курсор """
+        stmt = select(*BOOK_COLUMNS).order_by(Book.id).execution_options(yield_per=batch_size)
+        result = await self.db.stream(stmt)
+        async for partition in result.partitions():
+            yield [row._asdict() for row in partition]
+
+    async def search_books(self, query: str, limit: int = 20):
+        """ Полнотекстовый и нечеткий поиск книг по названию, автору и описанию """
+        ts_query = func.websearch_to_tsquery(SEARCH_CONFIG, query)
+        # ранг считается только для ограниченного набора кандидатов, а не для всех совпадений широкого запроса:
+        # ближайшие по триграммам названия и авторы (KNN по GiST индексам) и первые совпадения полнотекстового поиска
+        candidates = union(
+            select(Book.id).where(Book.search_vector.op("@@")(ts_query)).limit(SEARCH_CANDIDATES),
+            select(Book.id)
+            .where(Book.name.op("%")(query))
+            .order_by(Book.name.op("<->")(query))
+            .limit(SEARCH_CANDIDATES),
+            select(Book.id)
+            .where(Book.author.op("%")(query))
+            .order_by(Book.author.op("<->")(query))
+            .limit(SEARCH_CANDIDATES),
+        ).subquery("candidates")
+        # ранг складывается из полнотекстового совпадения и похожести названия или автора (опечатки)
+        rank = func.ts_rank_cd(Book.search_vector, ts_query) + func.greatest(
+            func.similarity(Book.name, query),
+            func.similarity(Book.author, query)
+        )
+
+        stmt = (
+            select(*BOOK_COLUMNS, rank.label("rank"))
+            .join(candidates, candidates.c.id == Book.id)
+            .order_by(rank.desc(), Book.id)
+            .limit(limit)
+        )
+        books = await self.db.execute(stmt)
+        return [book._asdict() for book in books]
 
     async def get_particular_book(self, book_id: int):
         """ Получение конкретной книги """
@@ -27,17 +165,49 @@ class BookService:
             raise NoResultFound()
         return book
 
+    async def get_book_data(self, book_id: int):
+        """ Колонки книги с версией для выдачи клиенту, без создания ORM объекта """
+        key = ("book", book_id)
+        book = await catalog_cache.get(key)
+        if book is not None:
+            return book
+
+        generation = catalog_cache.generation
+        row = (await self.db.execute(
+            select(*BOOK_COLUMNS, Book.updated_at).where(Book.id == book_id)
+        )).one_or_none()
+        if row is None:
+            raise NoResultFound()
+        book = row._asdict()
+        if self.fills_cache:
+            await catalog_cache.set(key, book, book_tags([book_id]), generation)
+        return book
+
+    async def get_book_version(self, book_id: int):
+        """ Версия и время изменения книги для проверки условных запросов """
+        book = await catalog_cache.get(("book", book_id))
+        if book is not None:
+            return book["version"], book["updated_at"]
+
+        version = (await self.db.execute(
+            select(Book.version, Book.updated_at).where(Book.id == book_id)
+        )).one_or_none()
+        if version is None:
+            raise NoResultFound()
+        return version
+
     async def get_reader_all_books(self, reader_id: int):
         """ Получение книг взятых читателем, которые он не вернул"""
-        # проверка на существование читателя
-        reader_service = ReaderService(self.db)
-        reader = await reader_service.get_particular_reader(reader_id)
+        # проверка на существование читателя, без загрузки его истории выдач
+        reader = await self.db.scalar(select(Reader.id).where(Reader.id == reader_id))
+        if reader is None:
+            raise NoResultFound()
 
-        stmt = (select(BorrowedBook)
+        stmt = (select(*BORROWED_BOOK_COLUMNS)
                 .where(BorrowedBook.reader_id == reader_id)
                 .where(BorrowedBook.is_active == True))
-        borrowed_books = await self.db.scalars(stmt)
-        return borrowed_books.all()
+        borrowed_books = await self.db.execute(stmt)
+        return [row._asdict() for row in borrowed_books]
 
     async def create_particular_book(self, book_data: CreateBook):
         """ Создание книги """
@@ -50,89 +220,376 @@ class BookService:
 
         self.db.add(book)
         await self.db.commit()
+        await catalog_cache.invalidate(CREATED_BOOK_TAGS)
         return book
 
-    async def update_particular_book(self, book_id: int, book_data: UpdateBook):
-        """ Обновление книги """
-        # получаем книгу, чтобы проверить ее на существование в БД
-        book = await self.get_particular_book(book_id)
-        # данные из запроса в виде dict
-        book_data_dict = dict(book_data)
-        # данные из БД в виде dict
-        book_db_dict = await model_to_dict(book)
+    async def update_particular_book(self, book_id: int, book_data: UpdateBook, if_match: Optional[str] = None):
+        """ Обновление переданных полей книги одним запросом, возвращает новую версию и время изменения """
+        values = changed_values(Book, book_data)
+        version = await partial_update(self.db, Book, book_id, values, if_match)
+        await self.db.commit()
+        if values:
+            # остальные воркеры узнают об изменении из уведомления триггера, свой кэш сбрасывается сразу
+            await catalog_cache.invalidate(book_tags([book_id], reordered="name" in values or "author" in values))
+        return version
 
-        # если в запросе какое-то поле имеет значение None, то оно остается без изменений
-        # для этого значение поля, которое содержит None, заменяется значением этого поля из БД
-        for key, value in book_data_dict.items():
-            if value is None:
-                book_data_dict[key] = book_db_dict.get(key)
+    async def update_books_batch(self, items: List[BatchUpdateBook]):
+        """ Пакетное обновление книг одним UPDATE, возвращает результат по каждой книге """
+        ids = [item.id for item in items]
+        if len(set(ids)) != len(ids):
+            raise ValueError("Книга не может повторяться в пакете")
+        changes = [changed_values(Book, item, exclude=("id", "version")) for item in items]
+
+        # пакет передается массивами по колонкам, поэтому текст запроса не зависит от размера пакета,
+        # флаг set_<поле> отличает "не менять" от присваивания NULL
+        columns = {"id": Book.id.type, "version": Book.version.type}
+        arrays = {"id": ids, "version": [item.version for item in items]}
+        for field in UPDATABLE_BOOK_FIELDS:
+            columns[f"set_{field}"] = true().type
+            arrays[f"set_{field}"] = [field in values for values in changes]
+            columns[field] = Book.__table__.c[field].type
+            arrays[field] = [values.get(field) for values in changes]
+        batch = (
+            func.unnest(*(
+                cast(bindparam(name, arrays[name], type_=ARRAY(column_type)), ARRAY(column_type))
+                for name, column_type in columns.items()
+            ))
+            .table_valued(*columns)
+            .render_derived(name="batch")
+        )
 
         stmt = (
             update(Book)
-            .where(Book.id == book_id)
-            .values(**book_data_dict)
+            .where(Book.id == batch.c.id)
+            .where(or_(batch.c.version.is_(None), Book.version == batch.c.version))
+            .values(
+                **{
+                    field: case((batch.c[f"set_{field}"], batch.c[field]), else_=Book.__table__.c[field])
+                    for field in UPDATABLE_BOOK_FIELDS
+                },
+                **bump_version(Book)
+            )
+            .returning(Book.id, Book.version)
+            .execution_options(synchronize_session=False)
         )
-        await self.db.execute(stmt)
+        updated = dict((await self.db.execute(stmt)).all())
+
+        # не обновленные книги либо не существуют, либо их версия не совпала
+        missing = [book_id for book_id in ids if book_id not in updated]
+        current_versions = {}
+        if missing:
+            current_versions = dict((await self.db.execute(
+                select(Book.id, Book.version).where(Book.id.in_(missing))
+            )).all())
         await self.db.commit()
 
+        reordered = any(
+            "name" in values or "author" in values
+            for item, values in zip(items, changes) if item.id in updated
+        )
+        await catalog_cache.invalidate(book_tags(updated, reordered=reordered))
+
+        results = []
+        for item in items:
+            if item.id in updated:
+                detail = None
+            elif item.id in current_versions:
+                detail = "Книга изменена другим запросом"
+            else:
+                detail = "Книги с таким id не существует"
+            results.append({
+                "id": item.id,
+                "success": detail is None,
+                "detail": detail,
+                "version": updated.get(item.id, current_versions.get(item.id)),
+            })
+        return results
+
     async def delete_particular_book(self, book_id: int):
         """ Удаление книги """
         # получаем книгу, чтобы проверить ее на существование в БД
         book = await self.get_particular_book(book_id)
         await self.db.execute(delete(Book).where(Book.id == book_id))
         await self.db.commit()
+        await catalog_cache.invalidate(book_tags([book_id]))
 
     async def borrow_particular_book_reader(self, book_id: int, reader_id: int):
         """ Выдача книги читателю """
-        # проверка количества экземпляров книги
-        book = await self.get_particular_book(book_id)
-        if book.copies_quantity <= 0:
-            raise ValueError("Нет доступных экземпляров данной книги")
-
-        reader_service = ReaderService(self.db)
-        reader = await reader_service.get_particular_reader(reader_id)
-        borrowed_books = reader.borrowed_books
-
-        # проверка на то что читатель еще не взял эту книгу
-        for reader_borrowed_book in borrowed_books:
-            if reader_borrowed_book.book_id == book_id:
-                raise ValueError("Читатель уже брал эту книгу и еще не вернул")
-
-        # проверка на то что у читателя взято не больше 2-х книг
-        if len(borrowed_books) >= 3:
-            raise ValueError("Читатель не может взять больше 3-х книг")
+        # резервируем место в лимите читателя, заодно строка читателя блокируется,
+        # и параллельные выдачи одному читателю идут по очереди
+        reserved = await self.db.scalar(
+            update(Reader)
+            .where(Reader.id == reader_id)
+            .where(Reader.active_borrow_count < BORROW_LIMIT)
+            .values(active_borrow_count=Reader.active_borrow_count + 1, **bump_version(Reader))
+            .returning(Reader.id)
+        )
+        if reserved is None:
+            await self.db.rollback()
+            await self._raise_borrow_conflict(book_id, reader_id)
 
-        # создание BorrowedBook
-        borrowed_book = BorrowedBook(
-            book_id=book_id,
-            reader_id=reader_id
+        already_borrowed = (
+            exists()
+            .where(BorrowedBook.reader_id == reader_id)
+            .where(BorrowedBook.book_id == book_id)
+            .where(BorrowedBook.is_active == True)
+        )
+        # экземпляр списывается только если он есть и читатель еще не держит эту книгу,
+        # BorrowedBook создается только если экземпляр удалось списать
+        take_copy = (
+            update(Book)
+            .where(Book.id == book_id)
+            .where(Book.copies_quantity > 0)
+            .where(~already_borrowed)
+            .values(copies_quantity=Book.copies_quantity - 1, **bump_version(Book))
+            .returning(Book.id)
+            .cte("take_copy")
         )
-        self.db.add(borrowed_book)
+        stmt = (
+            insert(BorrowedBook)
+            .from_select(
+                ["book_id", "reader_id", "borrow_date", "due_date", "is_active"],
+                select(
+                    take_copy.c.id,
+                    literal(reader_id),
+                    func.current_date(),
+                    func.current_date() + LOAN_PERIOD_DAYS,
+                    true()
+                )
+            )
+            .returning(*BorrowedBook.__table__.c)
+        )
+        borrowed_book = await self.db.scalar(select(BorrowedBook).from_statement(stmt))
 
-        # убираем у книги экземпляр, который забрал читатель
-        book.copies_quantity -= 1
+        if borrowed_book is None:
+            # откат также снимает резерв в лимите читателя
+            await self.db.rollback()
+            await self._raise_borrow_conflict(book_id, reader_id)
 
         await self.db.commit()
+        await catalog_cache.invalidate(book_tags([book_id]))
         return borrowed_book
 
+    async def _raise_borrow_conflict(self, book_id: int, reader_id: int):
+        """ Определяет, какое условие выдачи не выполнено, и вызывает соответствующую ошибку """
+        stmt = (
+            select(
+                Book.copies_quantity,
+                select(Reader.active_borrow_count).where(Reader.id == reader_id).scalar_subquery(),
+                exists()
+                .where(BorrowedBook.reader_id == reader_id)
+                .where(BorrowedBook.book_id == book_id)
+                .where(BorrowedBook.is_active == True)
+            )
+            .where(Book.id == book_id)
+        )
+        state = (await self.db.execute(stmt)).one_or_none()
+        if state is None or state[1] is None:
+            raise NoResultFound()
+
+        copies_quantity, active_borrows, already_borrowed = state
+        if copies_quantity <= 0:
+            raise ValueError("Нет доступных экземпляров данной книги")
+        if already_borrowed:
+            raise ValueError("Читатель уже брал эту книгу и еще не вернул")
+        if active_borrows >= BORROW_LIMIT:
+            raise ValueError("Читатель не может взять больше 3-х книг")
+        # условия изменились между попыткой выдачи и проверкой
+        raise ValueError("Не удалось выдать книгу, повторите попытку")
+
     async def return_particular_book_reader(self, book_id: int, reader_id: int):
         """ Возврат книги от читателя в библиотеку """
-        # Проверяем есть ли borrowed_book, которую не вернул этот читатель
-        stmt = (select(BorrowedBook)
-                .where(BorrowedBook.book_id == book_id)
+        # закрываем активную выдачу, возвращаем экземпляр книги и освобождаем лимит читателя одним запросом.
+        # Каждый CTE читает результат предыдущего, поэтому строки блокируются по порядку: читатель, выдача, книга -
+        # читатель раньше книги, как при выдаче, иначе возврат и выдача могут взаимоблокироваться
+        release = (
+            update(Reader)
+            .where(Reader.id == reader_id)
+            .where(
+                exists()
                 .where(BorrowedBook.reader_id == reader_id)
-                .where(BorrowedBook.is_active == True))
-        borrow_book = await self.db.scalar(stmt)
+                .where(BorrowedBook.book_id == book_id)
+                .where(BorrowedBook.is_active == True)
+            )
+            .values(active_borrow_count=Reader.active_borrow_count - 1, **bump_version(Reader))
+            .returning(Reader.id)
+            .cte("release")
+        )
+        closed = (
+            update(BorrowedBook)
+            .where(BorrowedBook.book_id == book_id)
+            .where(BorrowedBook.reader_id == release.c.id)
+            .where(BorrowedBook.is_active == True)
+            .values(is_active=False, return_date=func.current_date())
+            .returning(*BorrowedBook.__table__.c)
+            .cte("closed")
+        )
+        stmt = (
+            update(Book)
+            .where(Book.id == closed.c.book_id)
+            .values(copies_quantity=Book.copies_quantity + 1, **bump_version(Book))
+            .returning(*closed.c)
+            .execution_options(synchronize_session=False)
+        )
+        borrow_book = await self.db.scalar(select(BorrowedBook).from_statement(stmt))
         if borrow_book is None:
+            # выдачу успел закрыть параллельный возврат: откат снимает уменьшение лимита читателя
+            await self.db.rollback()
             raise ValueError("Читатель не брал эту книгу или уже вернул ее")
 
-        # возвращаем
-        borrow_book.is_active = False
-        borrow_book.return_date = datetime.date.today()
+        await self.db.commit()
+        await catalog_cache.invalidate(book_tags([book_id]))
+        return borrow_book
 
-        # прибавляем к экземплярам книги + 1
-        book = await self.get_particular_book(book_id)
-        book.copies_quantity += 1
+    async def borrow_books_batch(self, items: List[BorrowItem]):
+        """ Пакетная выдача книг читателям в одной транзакции, возвращает результат по каждой паре """
+        reader_ids = sorted({item.reader_id for item in items})
+        book_ids = sorted({item.book_id for item in items})
+
+        # блокируем читателей, затем книги, в порядке id - так же, как одиночные выдача и возврат
+        # и пакетный возврат, чтобы параллельные операции не взаимоблокировались
+        active_counts = dict((await self.db.execute(
+            select(Reader.id, Reader.active_borrow_count)
+            .where(Reader.id.in_(reader_ids))
+            .order_by(Reader.id)
+            .with_for_update(key_share=True)
+        )).all())
+        copies = dict((await self.db.execute(
+            select(Book.id, Book.copies_quantity)
+            .where(Book.id.in_(book_ids))
+            .order_by(Book.id)
+            .with_for_update(key_share=True)
+        )).all())
+        active_pairs = set((await self.db.execute(
+            select(BorrowedBook.reader_id, BorrowedBook.book_id)
+            .where(BorrowedBook.reader_id.in_(reader_ids))
+            .where(BorrowedBook.is_active == True)
+        )).all())
+
+        # проверяем пары по порядку, учитывая выдачи, принятые ранее в этом же пакете
+        results = []
+        taken = Counter()
+        added = Counter()
+        for item in items:
+            error = None
+            if item.reader_id not in active_counts:
+                error = "Читателя с таким id не существует"
+            elif item.book_id not in copies:
+                error = "Книги с таким id не существует"
+            elif copies[item.book_id] <= 0:
+                error = "Нет доступных экземпляров данной книги"
+            elif (item.reader_id, item.book_id) in active_pairs:
+                error = "Читатель уже брал эту книгу и еще не вернул"
+            elif active_counts[item.reader_id] >= BORROW_LIMIT:
+                error = "Читатель не может взять больше 3-х книг"
+            else:
+                copies[item.book_id] -= 1
+                active_pairs.add((item.reader_id, item.book_id))
+                active_counts[item.reader_id] += 1
+                taken[item.book_id] += 1
+                added[item.reader_id] += 1
+            results.append({
+                "book_id": item.book_id,
+                "reader_id": item.reader_id,
+                "success": error is None,
+                "detail": error,
+            })
 
+        borrowed = {}
+        if taken:
+            stmt = (
+                insert(BorrowedBook)
+                .values([
+                    {"book_id": result["book_id"], "reader_id": result["reader_id"],
+                     "borrow_date": func.current_date(), "due_date": func.current_date() + LOAN_PERIOD_DAYS,
+                     "is_active": True}
+                    for result in results if result["success"]
+                ])
+                .returning(*BorrowedBook.__table__.c)
+            )
+            borrowed_books = await self.db.scalars(select(BorrowedBook).from_statement(stmt))
+            borrowed = {(book.book_id, book.reader_id): book for book in borrowed_books}
+
+            await self.db.execute(
+                update(Book)
+                .where(Book.id.in_(taken))
+                .values(copies_quantity=Book.copies_quantity - case(taken, value=Book.id), **bump_version(Book))
+            )
+            await self.db.execute(
+                update(Reader)
+                .where(Reader.id.in_(added))
+                .values(
+                    active_borrow_count=Reader.active_borrow_count + case(added, value=Reader.id),
+                    **bump_version(Reader)
+                )
+            )
         await self.db.commit()
-        return borrow_book
+        await catalog_cache.invalidate(book_tags(taken))
+
+        for result in results:
+            result["borrowed_book"] = borrowed.get((result["book_id"], result["reader_id"])) if result["success"] else None
+        return results
+
+    async def return_books_batch(self, items: List[BorrowItem]):
+        """ Пакетный возврат книг от читателей в одной транзакции, возвращает результат по каждой паре """
+        pairs = {(item.book_id, item.reader_id) for item in items}
+
+        # блокируем читателей, затем книги, в порядке id - так же, как при выдаче, иначе закрытие выдач
+        # и возврат экземпляров заблокировали бы книги раньше читателей
+        await self.db.execute(
+            select(Reader.id)
+            .where(Reader.id.in_(sorted({reader_id for _, reader_id in pairs})))
+            .order_by(Reader.id)
+            .with_for_update(key_share=True)
+        )
+        await self.db.execute(
+            select(Book.id)
+            .where(Book.id.in_(sorted({book_id for book_id, _ in pairs})))
+            .order_by(Book.id)
+            .with_for_update(key_share=True)
+        )
+        # закрываем все найденные активные выдачи одним запросом
+        stmt = (
+            update(BorrowedBook)
+            .where(tuple_(BorrowedBook.book_id, BorrowedBook.reader_id).in_(pairs))
+            .where(BorrowedBook.is_active == True)
+            .values(is_active=False, return_date=func.current_date())
+            .returning(*BorrowedBook.__table__.c)
+        )
+        returned_books = await self.db.scalars(select(BorrowedBook).from_statement(stmt))
+        returned = {(book.book_id, book.reader_id): book for book in returned_books}
+
+        returned_counts = Counter(book_id for book_id, _ in returned)
+        released_counts = Counter(reader_id for _, reader_id in returned)
+        if returned_counts:
+            await self.db.execute(
+                update(Book)
+                .where(Book.id.in_(returned_counts))
+                .values(
+                    copies_quantity=Book.copies_quantity + case(returned_counts, value=Book.id),
+                    **bump_version(Book)
+                )
+            )
+            await self.db.execute(
+                update(Reader)
+                .where(Reader.id.in_(released_counts))
+                .values(
+                    active_borrow_count=Reader.active_borrow_count - case(released_counts, value=Reader.id),
+                    **bump_version(Reader)
+                )
+            )
+        await self.db.commit()
+        await catalog_cache.invalidate(book_tags(returned_counts))
+
+        # повторная пара в одном пакете считается уже возвращенной
+        results = []
+        for item in items:
+            returned_book = returned.pop((item.book_id, item.reader_id), None)
+            results.append({
+                "book_id": item.book_id,
+                "reader_id": item.reader_id,
+                "success": returned_book is not None,
+                "detail": None if returned_book else "Читатель не брал эту книгу или уже вернул ее",
+                "borrowed_book": returned_book,
+            })
+        return results
@@ -0,0 +1,66 @@
+# base
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+class TTLCache:
+    """ LRU кэш в памяти процесса с ограничением размера и временем жизни записей """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """ Возвращает значение по ключу или default, если записи нет или она устарела """
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """ Сохраняет значение, ttl не может превышать время жизни кэша """
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        self._data[key] = (value, time.monotonic() + ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def delete(self, key: Hashable):
+        """ Удаляет запись по ключу """
+        self._data.pop(key, None)
+
+    def delete_where(self, predicate: Callable[[Hashable, Any], bool]):
+        """ Удаляет все записи, для которых predicate(key, value) истинен """
+        for key in [key for key, (value, _) in self._data.items() if predicate(key, value)]:
+            del self._data[key]
+
+    def clear(self):
+        self._data.clear()
+
+
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", 60))
+AUTH_CACHE_MAXSIZE = int(os.getenv("AUTH_CACHE_MAXSIZE", 10000))
+
+# расшифрованные access токены: token -> TokenPayload
+token_cache = TTLCache(AUTH_CACHE_MAXSIZE, AUTH_CACHE_TTL_SECONDS)
+# авторизованные библиотекари: (sub, exp) токена -> Librarian
+librarian_cache = TTLCache(AUTH_CACHE_MAXSIZE, AUTH_CACHE_TTL_SECONDS)
+
+
+def invalidate_librarian(email: str):
+    """ Сбрасывает закэшированные токены и данные библиотекаря после его изменения """
+    token_cache.delete_where(lambda token, payload: payload.sub == email)
+    librarian_cache.delete_where(lambda key, librarian: key[0] == email)
@@ -0,0 +1,230 @@
+# base
+import json
+import logging
+import math
+import os
+import pickle
+from abc import ABC, abstractmethod
+from typing import Any, Hashable, Iterable, Optional
+# installed
+try:
+    import redis.asyncio as redis
+except ImportError:
+    # общий уровень кэша на Redis необязателен
+    redis = None
+# local
+from app.backend.db import env_flag
+from app.backend.metrics import Counter
+from app.services.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+CATALOG_CACHE_ENABLED = env_flag("CATALOG_CACHE_ENABLED", True)
+CATALOG_CACHE_TTL_SECONDS = float(os.getenv("CATALOG_CACHE_TTL_SECONDS", 30))
+CATALOG_CACHE_MAXSIZE = int(os.getenv("CATALOG_CACHE_MAXSIZE", 10000))
+# общий для всех воркеров уровень кэша, без него у каждого воркера только свой кэш в памяти
+CATALOG_CACHE_REDIS_URL = os.getenv("CATALOG_CACHE_REDIS_URL")
+
+# канал NOTIFY, в который пишут триггеры таблицы book, см. миграцию add_book_change_notify
+CATALOG_CHANNEL = "catalog_invalidation"
+
+# теги записей кэша, запись сбрасывается при изменении любого из ее тегов
+ALL_BOOKS = "books"
+# последняя страница по id: новые книги появляются только на ней
+LAST_PAGE = "books:last_page"
+# страницы по автору: новые и переименованные книги могут встать на любую из них
+AUTHOR_ORDER = "books:order:author"
+CREATED_BOOK_TAGS = frozenset((LAST_PAGE, AUTHOR_ORDER))
+
+CATALOG_CACHE_REQUESTS = Counter(
+    "catalog_cache_requests_total",
+    "Обращения к кэшу каталога по уровням",
+    ["tier", "result"]
+)
+CATALOG_CACHE_INVALIDATIONS = Counter("catalog_cache_invalidations_total", "Сбросы кэша каталога", ["source"])
+
+
+def book_tag(book_id: int) -> str:
+    return f"book:{book_id}"
+
+
+def book_tags(book_ids: Iterable[int], reordered: bool = False) -> frozenset:
+    """ Теги, которые сбрасываются при изменении книг, reordered - изменились название или автор """
+    tags = {book_tag(book_id) for book_id in book_ids}
+    if reordered:
+        tags.add(AUTHOR_ORDER)
+    return frozenset(tags)
+
+
+def page_tags(books: list, order_by: str, next_cursor: Optional[str]) -> frozenset:
+    """ Теги страницы каталога: книги на ней и позиции, куда могут встать новые книги """
+    # при keyset-пагинации удаление или изменение книги затрагивает только страницу, на которой она есть
+    tags = {ALL_BOOKS, *(book_tag(book["id"]) for book in books)}
+    if order_by == "author":
+        tags.add(AUTHOR_ORDER)
+    elif next_cursor is None:
+        tags.add(LAST_PAGE)
+    return frozenset(tags)
+
+
+def notification_tags(payload: str) -> frozenset:
+    """ Теги из уведомления триггера: {"op": ..., "ids": [...] или null, "reordered": ...} """
+    change = json.loads(payload)
+    if change["op"] == "truncate" or change["ids"] is None:
+        # слишком много строк в одном запросе, список id не передается
+        return frozenset((ALL_BOOKS,))
+    if change["op"] == "insert":
+        return CREATED_BOOK_TAGS
+    return book_tags(change["ids"], change.get("reordered", False))
+
+
+class SharedCache(ABC):
+    """ Общий для воркеров уровень кэша, записи хранятся вместе с тегами """
+
+    @abstractmethod
+    async def get(self, key: Hashable) -> Optional[tuple]:
+        """ Запись (value, tags) или None """
+
+    @abstractmethod
+    async def set(self, key: Hashable, entry: tuple, ttl: float):
+        """ Сохраняет запись (value, tags) на ttl секунд """
+
+    @abstractmethod
+    async def invalidate(self, tags: frozenset):
+        """ Удаляет записи, у которых есть хотя бы один из тегов """
+
+
+class LocalSharedCache(SharedCache):
+    """ Общий уровень в памяти процесса, заменяет Redis в тестах и при одном воркере """
+
+    def __init__(self, maxsize: int = CATALOG_CACHE_MAXSIZE, ttl: float = CATALOG_CACHE_TTL_SECONDS):
+        self.entries = TTLCache(maxsize, ttl)
+
+    async def get(self, key: Hashable) -> Optional[tuple]:
+        return self.entries.get(key)
+
+    async def set(self, key: Hashable, entry: tuple, ttl: float):
+        self.entries.set(key, entry, ttl)
+
+    async def invalidate(self, tags: frozenset):
+        self.entries.delete_where(lambda key, entry: not tags.isdisjoint(entry[1]))
+
+
+class RedisSharedCache(SharedCache):
+    """ Общий уровень в Redis: значение записи и множество ключей для каждого тега """
+
+    def __init__(self, url: str, prefix: str = "catalog:"):
+        if redis is None:
+            raise RuntimeError("Для CATALOG_CACHE_REDIS_URL нужен пакет redis: pip install redis")
+        self.client = redis.from_url(url)
+        self.prefix = prefix
+
+    def _key(self, key: Hashable) -> str:
+        return self.prefix + "entry:" + repr(key)
+
+    def _tag_key(self, tag: str) -> str:
+        return self.prefix + "tag:" + tag
+
+    async def get(self, key: Hashable) -> Optional[tuple]:
+        try:
+            raw = await self.client.get(self._key(key))
+        except redis.RedisError as error:
+            # недоступный Redis не должен ломать чтение каталога, запрос уйдет в БД
+            logger.warning("Кэш каталога в Redis недоступен: %s", error)
+            return None
+        return None if raw is None else pickle.loads(raw)
+
+    async def set(self, key: Hashable, entry: tuple, ttl: float):
+        redis_key = self._key(key)
+        seconds = math.ceil(ttl)
+        pipeline = self.client.pipeline(transaction=False)
+        pipeline.set(redis_key, pickle.dumps(entry), ex=seconds)
+        for tag in entry[1]:
+            pipeline.sadd(self._tag_key(tag), redis_key)
+            pipeline.expire(self._tag_key(tag), seconds)
+        try:
+            await pipeline.execute()
+        except redis.RedisError as error:
+            logger.warning("Кэш каталога в Redis недоступен: %s", error)
+
+    async def invalidate(self, tags: frozenset):
+        tag_keys = [self._tag_key(tag) for tag in tags]
+        try:
+            pipeline = self.client.pipeline(transaction=False)
+            for tag_key in tag_keys:
+                pipeline.smembers(tag_key)
+            keys = set().union(*await pipeline.execute())
+            await self.client.delete(*keys, *tag_keys)
+        except redis.RedisError as error:
+            # записи доживут до истечения CATALOG_CACHE_TTL_SECONDS
+            logger.warning("Не удалось сбросить кэш каталога в Redis: %s", error)
+
+
+class CatalogCache:
+    """ Двухуровневый кэш чтений каталога: LRU в памяти процесса и необязательный общий уровень """
+
+    def __init__(self, maxsize: int, ttl: float, shared: Optional[SharedCache] = None, enabled: bool = True):
+        self.local = TTLCache(maxsize, ttl)
+        self.ttl = ttl
+        self.shared = shared
+        self.enabled = enabled
+        # растет при каждом сбросе, чтение, начатое до сброса, не попадает в кэш
+        self.generation = 0
+
+    async def get(self, key: Hashable) -> Any:
+        """ Значение из ближайшего уровня или None """
+        if not self.enabled:
+            return None
+        entry = self.local.get(key)
+        if entry is not None:
+            CATALOG_CACHE_REQUESTS.inc("local", "hit")
+            return entry[0]
+        if self.shared is not None:
+            entry = await self.shared.get(key)
+            if entry is not None:
+                CATALOG_CACHE_REQUESTS.inc("shared", "hit")
+                self.local.set(key, entry)
+                return entry[0]
+        CATALOG_CACHE_REQUESTS.inc("local" if self.shared is None else "shared", "miss")
+        return None
+
+    async def set(self, key: Hashable, value: Any, tags: frozenset, generation: int):
+        """ Сохраняет значение, прочитанное из БД, generation - значение self.generation до чтения """
+        if not self.enabled or generation != self.generation:
+            # пока шло чтение, каталог изменился, и значение может быть уже устаревшим
+            return
+        entry = (value, tags)
+        self.local.set(key, entry)
+        if self.shared is not None:
+            await self.shared.set(key, entry, self.ttl)
+
+    async def invalidate(self, tags: Iterable[str], source: str = "write"):
+        """ Сбрасывает записи с любым из тегов на обоих уровнях """
+        tags = frozenset(tags)
+        if not self.enabled or not tags:
+            return
+        self.generation += 1
+        CATALOG_CACHE_INVALIDATIONS.inc(source)
+        if ALL_BOOKS in tags:
+            self.local.clear()
+        else:
+            self.local.delete_where(lambda key, entry: not tags.isdisjoint(entry[1]))
+        if self.shared is not None:
+            await self.shared.invalidate(tags)
+
+    async def handle_notification(self, payload: str):
+        """ Изменение каталога из любого воркера или внешнего процесса, пришедшее через LISTEN """
+        await self.invalidate(notification_tags(payload), source="notify")
+
+    async def handle_reconnect(self):
+        """ Пока слушатель был отключен, уведомления могли потеряться, поэтому кэш воркера сбрасывается """
+        self.generation += 1
+        self.local.clear()
+
+
+catalog_cache = CatalogCache(
+    CATALOG_CACHE_MAXSIZE,
+    CATALOG_CACHE_TTL_SECONDS,
+    shared=RedisSharedCache(CATALOG_CACHE_REDIS_URL) if CATALOG_CACHE_REDIS_URL else None,
+    enabled=CATALOG_CACHE_ENABLED,
+)
@@ -1,15 +1,19 @@
+# base
+from datetime import datetime, timezone
+from typing import Annotated
 # installed
 from pydantic import ValidationError
-from fastapi import HTTPException, status, Depends
+from fastapi import HTTPException, status, Depends, Request
 from fastapi.security import OAuth2PasswordBearer
-from jose import jwt
 from jose.exceptions import ExpiredSignatureError, JWTError
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import NoResultFound
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 # local
-from app.backend.db import async_session_maker
-from app.schemas.auth import TokenPayload
+from app.backend.db import async_session_maker, replica_session_maker
+from app.backend.middleware import is_pinned_to_primary
+from app.services.cache import token_cache, librarian_cache
 from app.services.librarian_service import LibrarianService
-from app.services.auth_service import AuthService
+from app.services.auth_service import get_auth_engine
 
 
 reusable_oauth = OAuth2PasswordBearer(
@@ -18,38 +22,68 @@ reusable_oauth = OAuth2PasswordBearer(
 )
 
 
-async def get_current_user(token: str = Depends(reusable_oauth)):
-    """ Зависимость для авторизации библиотекаря """
-    db = Depends(get_db_session)
-    auth_service = AuthService(db)
-    librarian_service = LibrarianService(db)
-
-    try:
-        payload = jwt.decode(
-            token=token,
-            key=auth_service.JWT_SECRET_KEY,
-            algorithms=[auth_service.ALGORITHM]
-        )
-        token_data = TokenPayload(**payload)
-
-    except ExpiredSignatureError:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Токен истек",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-
-    except (JWTError, ValidationError):
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Не удалось проверить учетные данные",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-
-    librarian = await librarian_service.get_particular_librarian(token_data.sub)
-    return librarian
+def seconds_until(moment: datetime) -> float:
+    """ Количество секунд до указанного момента """
+    return (moment - datetime.now(timezone.utc)).total_seconds()
 
 
 async def get_db_session() -> AsyncSession:
     async with async_session_maker() as session:
-        yield session
\ No newline at end of file
+        yield session
+
+
+def read_session_maker(request: Request) -> async_sessionmaker:
+    """ Фабрика сессий для чтения: реплика, если она настроена и клиент недавно ничего не менял """
+    if replica_session_maker is None or is_pinned_to_primary(request.cookies):
+        return async_session_maker
+    return replica_session_maker
+
+
+async def get_read_session(request: Request) -> AsyncSession:
+    """ Сессия только для чтения, изменения через нее не выполняются """
+    async with read_session_maker(request)() as session:
+        yield session
+
+
+async def get_current_user(
+        db: Annotated[AsyncSession, Depends(get_db_session)],
+        token: str = Depends(reusable_oauth)
+):
+    """ Зависимость для авторизации библиотекаря """
+    # токен уже проверялся, если он есть в кэше (запись живет не дольше самого токена)
+    token_data = token_cache.get(token)
+    if token_data is None:
+        try:
+            token_data = get_auth_engine().decode_access_token(token)
+
+        except ExpiredSignatureError:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Токен истек",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+
+        except (JWTError, ValidationError):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Не удалось проверить учетные данные",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        token_cache.set(token, token_data, seconds_until(token_data.exp))
+
+    cache_key = (token_data.sub, token_data.exp)
+    librarian = librarian_cache.get(cache_key)
+    if librarian is None:
+        librarian_service = LibrarianService(db)
+        try:
+            librarian = await librarian_service.get_particular_librarian(token_data.sub)
+        except NoResultFound:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Не удалось проверить учетные данные",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        # в кэше хранится отсоединенный от сессии объект
+        db.expunge(librarian)
+        librarian_cache.set(cache_key, librarian, seconds_until(token_data.exp))
+    return librarian
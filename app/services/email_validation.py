@@ -0,0 +1,68 @@
+# base
+import os
+import re
+# installed
+from email_validator import EmailNotValidError, validate_email
+from email_validator.deliverability import validate_email_deliverability
+# local
+from app.services.cache import TTLCache
+
+
+# syntax - проверяется только синтаксис адреса, без обращений к сети;
+# deliverability - дополнительно проверяются DNS записи домена (MX), результат кэшируется по домену
+EMAIL_VALIDATION_MODE = os.getenv("EMAIL_VALIDATION_MODE", "deliverability")
+EMAIL_DOMAIN_CACHE_TTL_SECONDS = float(os.getenv("EMAIL_DOMAIN_CACHE_TTL_SECONDS", 3600))
+EMAIL_DOMAIN_CACHE_MAXSIZE = int(os.getenv("EMAIL_DOMAIN_CACHE_MAXSIZE", 10000))
+
+EMAIL_VALIDATION_MODES = ("syntax", "deliverability")
+
+# обычный ASCII адрес: dot-atom до @ (RFC 5322) и домен из букв, цифр, точек и дефисов. Остальные адреса
+# (в кавычках, с юникодом, с IP вместо домена) проверяются полностью через email_validator
+ATEXT = r"[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+"
+SIMPLE_ADDRESS = re.compile(rf"({ATEXT}(?:\.{ATEXT})*)@([A-Za-z0-9.-]+)")
+# ограничения длины из RFC 5321, как в email_validator
+LOCAL_PART_MAX_LENGTH = 64
+ADDRESS_MAX_LENGTH = 254
+
+
+class EmailValidator:
+    """ Проверка адресов электронной почты. Домен проверяется один раз за время жизни записи кэша, поэтому
+    пакетная регистрация читателей с одного домена не повторяет разбор IDNA и DNS запросы на каждом адресе """
+
+    def __init__(self, mode: str = EMAIL_VALIDATION_MODE, cache_maxsize: int = EMAIL_DOMAIN_CACHE_MAXSIZE,
+                 cache_ttl: float = EMAIL_DOMAIN_CACHE_TTL_SECONDS):
+        if mode not in EMAIL_VALIDATION_MODES:
+            raise ValueError(f"Неизвестный режим проверки email: {mode}")
+        self.mode = mode
+        # домен -> текст ошибки, пустая строка - домен корректен (и в режиме deliverability принимает почту)
+        self.domains = TTLCache(cache_maxsize, cache_ttl)
+
+    def validate(self, address: str) -> str:
+        """ Проверяет адрес и возвращает его без изменений, при некорректном адресе вызывает ValueError """
+        simple = SIMPLE_ADDRESS.fullmatch(address)
+        if simple is None or len(simple.group(1)) > LOCAL_PART_MAX_LENGTH or len(address) > ADDRESS_MAX_LENGTH:
+            error = self.check_address(address)
+        else:
+            # проверка домена (IDNA, DNS) занимает почти все время, поэтому ее результат кэшируется по домену
+            domain = simple.group(2).lower()
+            error = self.domains.get(domain)
+            if error is None:
+                # локальная часть из одного символа не длиннее исходной, ограничения длины адреса не нарушаются
+                error = self.check_address(f"a@{domain}")
+                self.domains.set(domain, error)
+        if error:
+            raise ValueError(f"Некорректный адрес электронной почты: {error}")
+        return address
+
+    def check_address(self, address: str) -> str:
+        """ Полная проверка адреса через email_validator, возвращает текст ошибки или пустую строку """
+        try:
+            validated = validate_email(address, check_deliverability=False)
+            if self.mode == "deliverability":
+                validate_email_deliverability(validated.ascii_domain, validated.domain)
+        except EmailNotValidError as error:
+            return str(error)
+        return ""
+
+
+email_validator = EmailValidator()
@@ -0,0 +1,78 @@
+# base
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+# installed
+from passlib.context import CryptContext
+# local
+from app.backend.metrics import Counter, Gauge, Histogram
+
+
+# количество потоков для bcrypt, bcrypt отпускает GIL, поэтому потоки работают параллельно
+BCRYPT_WORKERS = int(os.getenv("BCRYPT_WORKERS", min(4, os.cpu_count() or 1)))
+# сколько операций может ждать свободного потока, остальные сразу отклоняются
+BCRYPT_MAX_QUEUE = int(os.getenv("BCRYPT_MAX_QUEUE", 64))
+
+BCRYPT_OPERATIONS = Counter("bcrypt_operations_total", "Выполненные операции bcrypt", ["operation"])
+BCRYPT_REJECTED = Counter("bcrypt_rejected_total", "Операции bcrypt, отклоненные из-за заполненной очереди", ["operation"])
+BCRYPT_QUEUE_WAIT = Histogram("bcrypt_queue_wait_seconds", "Время ожидания свободного потока bcrypt")
+
+
+class PasswordHasherBusy(Exception):
+    """ Очередь пула bcrypt заполнена """
+
+
+class PasswordHasher:
+    """ Хэширование и проверка паролей в ограниченном пуле потоков, не блокируя event loop """
+
+    def __init__(self, context: CryptContext, workers: int, max_queue: int):
+        self.context = context
+        self.workers = workers
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+
+    @property
+    def queued(self) -> int:
+        """ Операции, которые ждут свободного потока """
+        return max(0, self.in_flight - self.workers)
+
+    async def _run(self, operation: str, function, *args):
+        if self.in_flight >= self.workers + self.max_queue:
+            BCRYPT_REJECTED.inc(operation)
+            raise PasswordHasherBusy("Сервис перегружен, повторите попытку позже")
+
+        submitted_at = time.perf_counter()
+        # поток только запоминает момент начала, метрики без блокировок обновляются в event loop
+        started_at = []
+
+        def timed():
+            started_at.append(time.perf_counter())
+            return function(*args)
+
+        self.in_flight += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, timed)
+        finally:
+            self.in_flight -= 1
+            if started_at:
+                BCRYPT_QUEUE_WAIT.observe(started_at[0] - submitted_at)
+            BCRYPT_OPERATIONS.inc(operation)
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", self.context.hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._run("verify", self.context.verify, password, hashed_password)
+
+
+password_hasher = PasswordHasher(
+    CryptContext(schemes=['bcrypt'], deprecated='auto'),
+    workers=BCRYPT_WORKERS,
+    max_queue=BCRYPT_MAX_QUEUE
+)
+
+Gauge("bcrypt_in_flight", "Принятые операции bcrypt (выполняются и ждут)", function=lambda: password_hasher.in_flight)
+Gauge("bcrypt_queue_depth", "Операции bcrypt, ожидающие свободного потока", function=lambda: password_hasher.queued)
+Gauge("bcrypt_workers", "Размер пула потоков bcrypt", function=lambda: password_hasher.workers)
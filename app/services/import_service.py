@@ -0,0 +1,205 @@
+# base
+import asyncio
+import csv
+import io
+import json
+from itertools import islice
+from typing import BinaryIO, Iterator, Optional
+# installed
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+# local
+from app.services.catalog_cache import catalog_cache, ALL_BOOKS
+
+
+# количество строк файла, которое разбирается и отправляется через COPY за один раз
+IMPORT_CHUNK_SIZE = 5000
+# сколько ошибок разбора возвращается в отчете, остальные только считаются
+IMPORT_MAX_ERRORS = 100
+# описание по умолчанию, как в миграции add_description_to_book
+DEFAULT_DESCRIPTION = "тут будет описание"
+
+# диапазон столбцов integer в PostgreSQL
+INTEGER_MIN = -2 ** 31
+INTEGER_MAX = 2 ** 31 - 1
+
+STAGING_COLUMNS = ("line_no", "name", "author", "publication_year", "isbn", "copies_quantity", "description")
+
+
+def read_records(file: BinaryIO, file_format: str) -> Iterator[tuple[int, Optional[dict]]]:
+    """ Лениво читает файл CSV или NDJSON, возвращает номер строки и словарь полей (None если строка не разобрана).
+    Если файл не читается как CSV с заголовком, вызывает ValueError """
+    # некорректный UTF-8 не прерывает чтение: байты заменяются суррогатами, и строка отклоняется при проверке полей
+    stream = io.TextIOWrapper(file, encoding="utf-8-sig", errors="surrogateescape", newline="")
+    if file_format == "csv":
+        # csv.reader вместо DictReader: DictReader молча пропускает пустые строки, и номер строки записи
+        # не восстановить. Запись начинается со строки, следующей за прочитанной, даже если занимает несколько
+        # строк из-за переносов в кавычках
+        reader = csv.reader(stream)
+        try:
+            fieldnames = next(reader, [])
+        except csv.Error as error:
+            raise ValueError(f"Не удалось прочитать заголовок CSV: {error}")
+        if "name" not in fieldnames or "author" not in fieldnames:
+            raise ValueError("Первая строка CSV должна быть заголовком с полями name и author")
+        while True:
+            line_no = reader.line_num + 1
+            try:
+                values = next(reader)
+            except StopIteration:
+                return
+            except csv.Error:
+                yield line_no, None
+                continue
+            if not values:
+                continue
+            # как в DictReader: недостающие поля - None, лишние значения собираются под ключом None
+            row = dict(zip(fieldnames, values))
+            if len(values) > len(fieldnames):
+                row[None] = values[len(fieldnames):]
+            for key in fieldnames[len(values):]:
+                row[key] = None
+            yield line_no, row
+    else:
+        for line_no, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield line_no, row if isinstance(row, dict) else None
+
+
+def _optional_int(value) -> Optional[int]:
+    if value is None or value == "":
+        return None
+    return int(value)
+
+
+def _optional_str(value) -> Optional[str]:
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        value.encode()
+    except UnicodeEncodeError:
+        raise ValueError("Строка содержит некорректные символы UTF-8")
+    return value or None
+
+
+def parse_book_record(line_no: int, row: Optional[dict]) -> tuple:
+    """ Проверяет поля книги и возвращает строку для staging таблицы, при ошибке вызывает ValueError """
+    if row is None:
+        raise ValueError("Строка не разобрана")
+
+    name = _optional_str(row.get("name"))
+    author = _optional_str(row.get("author"))
+    isbn = _optional_str(row.get("isbn"))
+    description = _optional_str(row.get("description"))
+    try:
+        publication_year = _optional_int(row.get("publication_year"))
+        copies_quantity = _optional_int(row.get("copies_quantity"))
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError("publication_year и copies_quantity должны быть целыми числами")
+    for value in (publication_year, copies_quantity):
+        if value is not None and not INTEGER_MIN <= value <= INTEGER_MAX:
+            raise ValueError("publication_year и copies_quantity вне допустимого диапазона")
+
+    if not name or not author:
+        raise ValueError("Поля name и author обязательны")
+    if isbn is None:
+        # по isbn книга находится при повторном импорте, без него она добавлялась бы каждый раз заново
+        raise ValueError("Поле isbn обязательно")
+    if len(name) > 100 or len(author) > 100:
+        raise ValueError("Поля name и author не должны быть длиннее 100 символов")
+    if isbn is not None and len(isbn) > 13:
+        raise ValueError("isbn не должен быть длиннее 13 символов")
+    if description is not None and len(description) > 500:
+        raise ValueError("description не должен быть длиннее 500 символов")
+    if copies_quantity is not None and copies_quantity < 0:
+        raise ValueError("copies_quantity не может быть отрицательным")
+
+    return line_no, name, author, publication_year, isbn, copies_quantity, description
+
+
+def parse_chunk(records: Iterator[tuple[int, Optional[dict]]], size: int) -> tuple[list, list, bool]:
+    """ Читает и проверяет до size строк, возвращает корректные строки, ошибки и признак конца файла """
+    rows, errors = [], []
+    count = 0
+    for line_no, row in islice(records, size):
+        count += 1
+        try:
+            rows.append(parse_book_record(line_no, row))
+        except ValueError as error:
+            errors.append({"line": line_no, "detail": error.args[0]})
+    return rows, errors, count < size
+
+
+class BookImportService:
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def import_books(self, file: BinaryIO, file_format: str):
+        """ Потоковый импорт каталога: COPY пачками в staging таблицу и upsert в book по isbn """
+        await self.db.execute(text(
+            "CREATE TEMP TABLE book_import ("
+            "line_no bigint, name text, author text, publication_year integer, "
+            "isbn text, copies_quantity integer, description text"
+            ") ON COMMIT DROP"
+        ))
+        # COPY выполняется напрямую через asyncpg в той же транзакции, что и сессия
+        connection = await self.db.connection()
+        raw_connection = await connection.get_raw_connection()
+        asyncpg_connection = raw_connection.driver_connection
+
+        records = read_records(file, file_format)
+        rejected, errors = 0, []
+        finished = False
+        while not finished:
+            # разбор файла блокирующий, поэтому выполняется вне event loop
+            rows, chunk_errors, finished = await asyncio.to_thread(parse_chunk, records, IMPORT_CHUNK_SIZE)
+            rejected += len(chunk_errors)
+            errors.extend(chunk_errors[:IMPORT_MAX_ERRORS - len(errors)])
+            if rows:
+                await asyncpg_connection.copy_records_to_table(
+                    "book_import", records=rows, columns=STAGING_COLUMNS
+                )
+
+        # при повторе isbn в файле побеждает последняя строка, предыдущие считаются отклоненными
+        await self.db.execute(text("CREATE INDEX ON book_import (isbn)"))
+        duplicates = await self.db.execute(text(
+            "DELETE FROM book_import a USING book_import b "
+            "WHERE a.isbn = b.isbn AND a.line_no < b.line_no"
+        ))
+        rejected += duplicates.rowcount
+
+        # одним upsert по isbn: существующие книги обновляются, количество экземпляров не трогается,
+        # так как оно меняется выдачами. xmax = 0 только у добавленных строк. Строки идут в порядке isbn,
+        # чтобы параллельные импорты блокировали книги в одном порядке
+        inserted, updated = (await self.db.execute(
+            text(
+                "WITH upserted AS ("
+                "INSERT INTO book (name, author, publication_year, isbn, copies_quantity, description) "
+                "SELECT s.name, s.author, s.publication_year, s.isbn, coalesce(s.copies_quantity, 1), "
+                "coalesce(s.description, b.description, :default_description) "
+                "FROM book_import s LEFT JOIN book b ON b.isbn = s.isbn "
+                "ORDER BY s.isbn "
+                "ON CONFLICT (isbn) DO UPDATE SET name = excluded.name, author = excluded.author, "
+                "publication_year = excluded.publication_year, description = excluded.description, "
+                "version = book.version + 1, updated_at = now() "
+                "RETURNING (xmax = 0) AS inserted"
+                ") "
+                "SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted) FROM upserted"
+            ),
+            {"default_description": DEFAULT_DESCRIPTION}
+        )).one()
+        await self.db.commit()
+        await catalog_cache.invalidate((ALL_BOOKS,))
+
+        return {
+            "inserted": inserted,
+            "updated": updated,
+            "rejected": rejected,
+            "errors": errors,
+        }
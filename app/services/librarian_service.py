@@ -6,6 +6,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from app.models.librarian import Librarian
 from app.schemas.user import CreateLibrarian
 from app.services.auth_service import AuthService
+from app.services.cache import invalidate_librarian
 
 
 class LibrarianService:
@@ -16,7 +17,7 @@ class LibrarianService:
         """ Создание библиотекаря """
         # хешируем пароль
         auth_service = AuthService(self.db)
-        password = auth_service.hash_password(librarian_data.password)
+        password = await auth_service.hash_password(librarian_data.password)
 
         librarian = Librarian(
             name=librarian_data.name,
@@ -25,6 +26,7 @@ class LibrarianService:
         )
         self.db.add(librarian)
         await self.db.commit()
+        invalidate_librarian(librarian.email)
         return librarian
 
 
@@ -1,8 +1,160 @@
+# base
+import base64
+import datetime
+import hashlib
+import json
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Iterable, Mapping, Optional, Set
 # installed
-from sqlalchemy import inspect
+from pydantic import BaseModel
+from sqlalchemy import inspect, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import NoResultFound
+
+
+class PreconditionFailed(Exception):
+    """ Условие If-Match не выполнено: запись изменена другим запросом """
 
 
 async def model_to_dict(model):
     """ Функция преобразует экземпляр модели в словарь python """
     inspector = inspect(model)
-    return {attr.key: getattr(model, attr.key) for attr in inspector.mapper.column_attrs}
+    # незагруженные (отложенные) столбцы пропускаются, чтобы не делать ленивую загрузку
+    return {
+        attr.key: getattr(model, attr.key)
+        for attr in inspector.mapper.column_attrs
+        if attr.key not in inspector.unloaded
+    }
+
+
+def encode_cursor(values: list) -> str:
+    """ Кодирует значения ключа последней записи страницы в непрозрачный курсор """
+    raw = json.dumps(values, separators=(",", ":"), ensure_ascii=False).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> list:
+    """ Декодирует курсор, полученный от encode_cursor. При некорректном курсоре вызывает ValueError """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError("Некорректный курсор")
+    if not isinstance(values, list):
+        raise ValueError("Некорректный курсор")
+    return values
+
+
+def bump_version(model) -> dict:
+    """ Значения для UPDATE, которые увеличивают версию строки и обновляют время ее изменения """
+    return {"version": model.version + 1, "updated_at": func.now()}
+
+
+def changed_values(model, data: BaseModel, exclude: Iterable[str] = ()) -> dict:
+    """ Поля, которые клиент передал в запросе. null для NOT NULL колонки, как и раньше, означает "не менять",
+    а для колонки, допускающей NULL, очищает ее """
+    columns = model.__table__.c
+    return {
+        key: value
+        for key, value in data.model_dump(exclude_unset=True, exclude=set(exclude)).items()
+        if value is not None or columns[key].nullable
+    }
+
+
+async def partial_update(db: AsyncSession, model, row_id: int, values: dict, if_match: Optional[str] = None):
+    """ Обновление только переданных колонок одним UPDATE ... RETURNING без предварительной загрузки строки.
+    Возвращает новую версию и время изменения. if_match - заголовок If-Match: версии из него проверяются
+    условием того же UPDATE, при несовпадении вызывается PreconditionFailed """
+    condition = model.id == row_id
+    versions = None if if_match is None else if_match_versions(if_match, row_id)
+    if versions is not None:
+        condition &= model.version.in_(versions)
+    if values:
+        row = (await db.execute(
+            update(model)
+            .where(condition)
+            .values(**values, **bump_version(model))
+            .returning(model.version, model.updated_at)
+        )).one_or_none()
+    else:
+        # менять нечего, проверяется только существование строки и If-Match
+        row = (await db.execute(
+            select(model.version, model.updated_at).where(condition)
+        )).one_or_none()
+    if row is None:
+        # строка не изменена: отдельный запрос только на этом пути отличает отсутствие строки от другой версии
+        if versions is not None and await db.scalar(select(model.id).where(model.id == row_id)) is not None:
+            raise PreconditionFailed("Запись изменена другим запросом")
+        raise NoResultFound()
+    return row
+
+
+def make_etag(*parts) -> str:
+    """ Сильный ETag из частей, однозначно определяющих представление ресурса """
+    raw = json.dumps(parts, separators=(",", ":"), default=str).encode()
+    return '"' + hashlib.blake2b(raw, digest_size=12).hexdigest() + '"'
+
+
+def row_etag(row_id: int, version: int) -> str:
+    """ Сильный ETag одной записи. Версия записана в нем открыто, чтобы If-Match проверялся условием UPDATE """
+    return f'"{row_id}.{version}"'
+
+
+def if_match_versions(if_match: str, row_id: int) -> Optional[Set[int]]:
+    """ Версии записи row_id из заголовка If-Match, None - подходит любая версия ("*").
+    Сравнение сильное: слабые ETag (W/) и ETag других записей не совпадают никогда """
+    tags = {tag.strip() for tag in if_match.split(",")}
+    if "*" in tags:
+        return None
+    prefix = f'"{row_id}.'
+    versions = set()
+    for tag in tags:
+        version = tag[len(prefix):-1]
+        if tag.startswith(prefix) and tag.endswith('"') and version.isascii() and version.isdigit():
+            versions.add(int(version))
+    return versions
+
+
+def collection_validators(items: list, next_cursor: Optional[str]):
+    """ ETag и Last-Modified страницы списка по id и версиям ее записей """
+    etag = make_etag([(item["id"], item["version"]) for item in items], next_cursor)
+    last_modified = max((item["updated_at"] for item in items), default=None)
+    return etag, last_modified
+
+
+def http_date(moment: datetime.datetime) -> str:
+    """ Дата в формате HTTP заголовков (Last-Modified) """
+    return format_datetime(moment.astimezone(datetime.timezone.utc), usegmt=True)
+
+
+def cache_headers(etag: str, last_modified: Optional[datetime.datetime]) -> dict:
+    headers = {"ETag": etag}
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    return headers
+
+
+def is_conditional(headers: Mapping[str, str]) -> bool:
+    """ Запрос содержит условные заголовки, и перед загрузкой данных имеет смысл сверить версию """
+    return "if-none-match" in headers or "if-modified-since" in headers
+
+
+def is_not_modified(headers: Mapping[str, str], etag: str, last_modified: Optional[datetime.datetime]) -> bool:
+    """ Проверка If-None-Match, а при его отсутствии If-Modified-Since, по правилам RFC 9110 """
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        # для If-None-Match используется слабое сравнение, поэтому префикс W/ не учитывается
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or etag in tags
+
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since is None or last_modified is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=datetime.timezone.utc)
+    # в HTTP дате нет долей секунды
+    return last_modified.replace(microsecond=0) <= since
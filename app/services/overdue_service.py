@@ -0,0 +1,118 @@
+# base
+import asyncio
+import datetime
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Optional
+# installed
+from sqlalchemy import select, func, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+# local
+from app.backend.db import async_session_maker, env_flag
+from app.backend.metrics import Gauge
+from app.models.book import BorrowedBook
+from app.services.book_service import BORROWED_BOOK_COLUMNS
+from app.services.other import encode_cursor, decode_cursor
+
+logger = logging.getLogger(__name__)
+
+# периодический обход просроченных выдач в фоне каждого воркера
+OVERDUE_SCAN_ENABLED = env_flag("OVERDUE_SCAN_ENABLED", True)
+OVERDUE_SCAN_INTERVAL_SECONDS = float(os.getenv("OVERDUE_SCAN_INTERVAL_SECONDS", 300))
+# сколько выдач читается одним запросом при обходе
+OVERDUE_SCAN_BATCH_SIZE = int(os.getenv("OVERDUE_SCAN_BATCH_SIZE", 5000))
+
+OVERDUE_LOANS = Gauge("overdue_loans", "Просроченные выдачи по результату последнего обхода")
+OVERDUE_SCAN_DURATION = Gauge("overdue_scan_duration_seconds", "Длительность последнего обхода просроченных выдач")
+
+# обработчик пачки просроченных выдач, например отправка напоминаний
+OverdueHandler = Callable[[list], Awaitable[None]]
+
+
+class OverdueService:
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def get_overdue_loans(self, limit: int = 50, cursor: Optional[str] = None):
+        """ Страница просроченных выдач по сроку возврата, возвращает выдачи и курсор следующей страницы """
+        days_overdue = (func.current_date() - BorrowedBook.due_date).label("days_overdue")
+        # условия совпадают с частичным индексом (due_date, id) WHERE is_active, поэтому читаются только
+        # просроченные выдачи, без обхода активных и истории
+        stmt = (
+            select(*BORROWED_BOOK_COLUMNS, days_overdue)
+            .where(BorrowedBook.is_active == True)
+            .where(BorrowedBook.due_date < func.current_date())
+            .order_by(BorrowedBook.due_date, BorrowedBook.id)
+            .limit(limit + 1)
+        )
+        if cursor is not None:
+            # курсор хранит срок возврата и id последней выдачи предыдущей страницы
+            try:
+                due_date, loan_id = decode_cursor(cursor)
+                due_date = datetime.date.fromisoformat(due_date)
+            except (TypeError, ValueError):
+                raise ValueError("Некорректный курсор")
+            if not isinstance(loan_id, int):
+                raise ValueError("Некорректный курсор")
+            stmt = stmt.where(tuple_(BorrowedBook.due_date, BorrowedBook.id) > tuple_(due_date, loan_id))
+
+        loans = [row._asdict() for row in await self.db.execute(stmt)]
+        next_cursor = None
+        if len(loans) > limit:
+            loans = loans[:limit]
+            next_cursor = encode_cursor([loans[-1]["due_date"].isoformat(), loans[-1]["id"]])
+        return loans, next_cursor
+
+    async def scan_overdue_loans(self, batch_size: int = OVERDUE_SCAN_BATCH_SIZE,
+                                 handler: Optional[OverdueHandler] = None) -> int:
+        """ Обходит все просроченные выдачи keyset-пачками, возвращает их количество """
+        total = 0
+        cursor = None
+        while True:
+            loans, cursor = await self.get_overdue_loans(batch_size, cursor)
+            total += len(loans)
+            if handler is not None and loans:
+                await handler(loans)
+            if cursor is None:
+                return total
+
+
+class OverdueScanner:
+    """ Периодический обход просроченных выдач, запускается и останавливается в lifespan приложения """
+
+    def __init__(self, session_maker: async_sessionmaker = async_session_maker,
+                 interval: float = OVERDUE_SCAN_INTERVAL_SECONDS, handler: Optional[OverdueHandler] = None):
+        self.session_maker = session_maker
+        self.interval = interval
+        self.handler = handler
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            started_at = time.perf_counter()
+            try:
+                async with self.session_maker() as db:
+                    overdue = await OverdueService(db).scan_overdue_loans(handler=self.handler)
+                OVERDUE_LOANS.set(overdue)
+                OVERDUE_SCAN_DURATION.set(time.perf_counter() - started_at)
+            except Exception:
+                logger.exception("Ошибка обхода просроченных выдач")
+            await asyncio.sleep(self.interval)
+
+
+overdue_scanner = OverdueScanner()
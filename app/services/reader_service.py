@@ -1,11 +1,52 @@
+# base
+import datetime
+from typing import List, Optional
 # installed
-from sqlalchemy import select, update, delete
+from sqlalchemy import select, delete, func, tuple_, union_all, and_, false, cast, bindparam
+from sqlalchemy.dialects.postgresql import ARRAY, insert
 from sqlalchemy.exc import NoResultFound
 from sqlalchemy.ext.asyncio import AsyncSession
 # local
+from app.models.book import Book, BorrowedBook, BorrowedBookArchive
 from app.models.reader import Reader
 from app.schemas.user import CreateReader, UpdateReader
-from app.services.other import model_to_dict
+from app.services.book_service import BORROWED_BOOK_COLUMNS
+from app.services.email_validation import email_validator
+from app.services.other import changed_values, partial_update, encode_cursor, decode_cursor
+
+READER_COLUMNS = (Reader.id, Reader.name, Reader.email, Reader.active_borrow_count)
+
+# поля книги, которые возвращаются вместе с выдачей, чтобы клиенту не запрашивать каждую книгу отдельно
+LOAN_BOOK_COLUMNS = (
+    Book.name.label("book_name"),
+    Book.author.label("book_author"),
+    Book.isbn.label("book_isbn"),
+)
+
+# столбцы архива в порядке BORROWED_BOOK_COLUMNS, архивные выдачи всегда закрыты
+ARCHIVED_LOAN_COLUMNS = (
+    BorrowedBookArchive.id,
+    BorrowedBookArchive.borrow_date,
+    BorrowedBookArchive.return_date,
+    BorrowedBookArchive.due_date,
+    false().label("is_active"),
+    BorrowedBookArchive.book_id,
+    BorrowedBookArchive.reader_id,
+)
+
+# сколько любимых авторов возвращается в статистике читателя
+FAVORITE_AUTHORS_LIMIT = 5
+
+
+def reader_loan(loan: dict) -> dict:
+    """ Собирает выдачу с вложенной книгой из строки с полями LOAN_BOOK_COLUMNS """
+    loan["book"] = {
+        "id": loan["book_id"],
+        "name": loan.pop("book_name"),
+        "author": loan.pop("book_author"),
+        "isbn": loan.pop("book_isbn"),
+    }
+    return loan
 
 
 class ReaderService:
@@ -23,10 +64,58 @@ class ReaderService:
         await self.db.commit()
         return reader
 
+    async def create_readers_batch(self, readers: List[CreateReader]):
+        """ Регистрация пакета читателей одним INSERT. Адреса, которые уже зарегистрированы или повторяются
+        в пакете, возвращаются в duplicates, некорректные - в rejected """
+        name_length = Reader.__table__.c.name.type.length
+        names, emails, duplicates, rejected = [], [], [], []
+        seen = set()
+        for index, reader in enumerate(readers):
+            # INSERT из массивов обходит проверки модели, поэтому адрес и имя проверяются здесь
+            try:
+                email_validator.validate(reader.email)
+                if len(reader.name) > name_length:
+                    raise ValueError(f"Имя длиннее {name_length} символов")
+            except ValueError as error:
+                rejected.append({"index": index, "email": reader.email, "detail": error.args[0]})
+                continue
+            if reader.email in seen:
+                duplicates.append(reader.email)
+                continue
+            seen.add(reader.email)
+            names.append(reader.name)
+            emails.append(reader.email)
+
+        created = []
+        if emails:
+            # пакет передается двумя массивами, текст запроса не зависит от количества читателей
+            batch = (
+                func.unnest(
+                    cast(bindparam("names", names, type_=ARRAY(Reader.name.type)), ARRAY(Reader.name.type)),
+                    cast(bindparam("emails", emails, type_=ARRAY(Reader.email.type)), ARRAY(Reader.email.type)),
+                )
+                .table_valued("name", "email")
+                .render_derived(name="batch")
+            )
+            stmt = (
+                insert(Reader)
+                .from_select(["name", "email"], select(batch.c.name, batch.c.email))
+                .on_conflict_do_nothing(index_elements=[Reader.email])
+                .returning(*READER_COLUMNS)
+            )
+            created = [row._asdict() for row in await self.db.execute(stmt)]
+            await self.db.commit()
+            # строки, пропущенные ON CONFLICT, в RETURNING не попадают
+            inserted = {reader["email"] for reader in created}
+            duplicates.extend(email for email in emails if email not in inserted)
+        return {"created": created, "duplicates": duplicates, "rejected": rejected}
+
     async def get_all_readers(self):
         """ Получение всех читателей """
-        readers = await self.db.scalars(select(Reader))
-        return readers.all()
+        readers = await self.db.execute(
+            select(Reader.id, Reader.name, Reader.email, Reader.active_borrow_count).order_by(Reader.id)
+        )
+        return [row._asdict() for row in readers]
 
     async def get_particular_reader(self, reader_id: int):
         """ Получение конкретного читателя """
@@ -35,32 +124,130 @@ class ReaderService:
             raise NoResultFound()
         return reader
 
-    async def update_particular_reader(self, reader_id: int, reader_data: UpdateReader):
-        """ Обновление читателя """
-        # получаем читателя, чтобы проверить его существование
-        reader = await self.get_particular_reader(reader_id)
-        # данные из запроса в виде dict
-        reader_data_dict = dict(reader_data)
-        # данные из БД в виде dict
-        reader_db_dict = await model_to_dict(reader)
-
-        # если в запросе какое-то поле имеет значение None, то оно остается без изменений
-        # для этого значение поля, которое содержит None, заменяется значением этого поля из БД
-        for key, value in reader_data_dict.items():
-            if value is None:
-                reader_data_dict[key] = reader_db_dict.get(key)
+    async def get_reader_version(self, reader_id: int):
+        """ Версия и время изменения читателя для проверки условных запросов """
+        version = (await self.db.execute(
+            select(Reader.version, Reader.updated_at).where(Reader.id == reader_id)
+        )).one_or_none()
+        if version is None:
+            raise NoResultFound()
+        return version
 
-        stmt = (
-            update(Reader)
-            .where(Reader.id == reader_id)
-            .values(**reader_data_dict)
-        )
-        await self.db.execute(stmt)
+    async def update_particular_reader(self, reader_id: int, reader_data: UpdateReader, if_match: Optional[str] = None):
+        """ Обновление переданных полей читателя одним запросом, возвращает новую версию и время изменения """
+        version = await partial_update(self.db, Reader, reader_id, changed_values(Reader, reader_data), if_match)
         await self.db.commit()
+        return version
 
     async def delete_particular_reader(self, reader_id: int):
         """ Удаление читателя """
         # получаем читателя, чтобы проверить на существование в БД
         reader = await self.get_particular_reader(reader_id)
         await self.db.execute(delete(Reader).where(Reader.id == reader_id))
-        await self.db.commit()
\ No newline at end of file
+        await self.db.commit()
+
+    async def reader_exists(self, reader_id: int) -> bool:
+        """ Проверка существования читателя """
+        return await self.db.scalar(select(Reader.id).where(Reader.id == reader_id)) is not None
+
+    async def get_reader_dashboard(self, reader_id: int):
+        """ Читатель и его активные выдачи вместе с книгами одним запросом """
+        loan_columns = tuple(column.label(f"loan_{column.key}") for column in BORROWED_BOOK_COLUMNS)
+        # выдачи присоединяются к читателю, поэтому читатель без выдач возвращается одной строкой с пустыми полями
+        stmt = (
+            select(*READER_COLUMNS, *loan_columns, *LOAN_BOOK_COLUMNS)
+            .outerjoin(BorrowedBook, and_(BorrowedBook.reader_id == Reader.id, BorrowedBook.is_active == True))
+            .outerjoin(Book, Book.id == BorrowedBook.book_id)
+            .where(Reader.id == reader_id)
+            .order_by(BorrowedBook.due_date, BorrowedBook.id)
+        )
+        rows = [row._asdict() for row in await self.db.execute(stmt)]
+        if not rows:
+            raise NoResultFound()
+
+        reader = {column.key: rows[0][column.key] for column in READER_COLUMNS}
+        active_loans = []
+        for row in rows:
+            if row["loan_id"] is None:
+                continue
+            loan = {column.key: row[f"loan_{column.key}"] for column in BORROWED_BOOK_COLUMNS}
+            loan.update((column.key, row[column.key]) for column in LOAN_BOOK_COLUMNS)
+            active_loans.append(reader_loan(loan))
+        return {"reader": reader, "active_loans": active_loans}
+
+    async def get_reader_history(self, reader_id: int, limit: int = 50, cursor: Optional[str] = None):
+        """ История выдач читателя от новых к старым вместе с архивом, возвращает выдачи и курсор следующей
+        страницы """
+        current = select(*BORROWED_BOOK_COLUMNS).where(BorrowedBook.reader_id == reader_id)
+        archived = select(*ARCHIVED_LOAN_COLUMNS).where(BorrowedBookArchive.reader_id == reader_id)
+        if cursor is not None:
+            # курсор хранит дату выдачи и id последней выдачи предыдущей страницы
+            try:
+                borrow_date, loan_id = decode_cursor(cursor)
+                borrow_date = datetime.date.fromisoformat(borrow_date)
+            except (TypeError, ValueError):
+                raise ValueError("Некорректный курсор")
+            if not isinstance(loan_id, int):
+                raise ValueError("Некорректный курсор")
+            current = current.where(
+                tuple_(BorrowedBook.borrow_date, BorrowedBook.id) < tuple_(borrow_date, loan_id)
+            )
+            archived = archived.where(
+                tuple_(BorrowedBookArchive.borrow_date, BorrowedBookArchive.id) < tuple_(borrow_date, loan_id)
+            )
+        # каждая таблица отдает не больше страницы по своему индексу (reader_id, borrow_date, id), id выдачи
+        # сохраняется при переносе в архив, поэтому ключ (borrow_date, id) общий для обеих частей
+        current = current.order_by(BorrowedBook.borrow_date.desc(), BorrowedBook.id.desc()).limit(limit + 1)
+        archived = archived.order_by(
+            BorrowedBookArchive.borrow_date.desc(), BorrowedBookArchive.id.desc()
+        ).limit(limit + 1)
+        loans = union_all(current, archived).subquery("reader_loans")
+        stmt = (
+            select(loans, *LOAN_BOOK_COLUMNS)
+            .join(Book, Book.id == loans.c.book_id)
+            .order_by(loans.c.borrow_date.desc(), loans.c.id.desc())
+            .limit(limit + 1)
+        )
+
+        history = [reader_loan(row._asdict()) for row in await self.db.execute(stmt)]
+        if not history and not await self.reader_exists(reader_id):
+            raise NoResultFound()
+        next_cursor = None
+        if len(history) > limit:
+            history = history[:limit]
+            next_cursor = encode_cursor([history[-1]["borrow_date"].isoformat(), history[-1]["id"]])
+        return history, next_cursor
+
+    async def get_reader_stats(self, reader_id: int, authors_limit: int = FAVORITE_AUTHORS_LIMIT):
+        """ Статистика выдач читателя вместе с архивом, считается агрегатами в БД """
+        loans = union_all(
+            select(*BORROWED_BOOK_COLUMNS).where(BorrowedBook.reader_id == reader_id),
+            select(*ARCHIVED_LOAN_COLUMNS).where(BorrowedBookArchive.reader_id == reader_id),
+        ).subquery("reader_loans")
+        totals = (await self.db.execute(
+            select(
+                func.count().label("total_loans"),
+                func.count().filter(loans.c.is_active).label("active_loans"),
+                func.count().filter(
+                    and_(loans.c.is_active, loans.c.due_date < func.current_date())
+                ).label("overdue_loans"),
+                func.count().filter(loans.c.return_date > loans.c.due_date).label("returned_late"),
+                # разность дат в PostgreSQL дает число дней, у активных выдач return_date пустой и в среднее не входит
+                func.round(func.avg(loans.c.return_date - loans.c.borrow_date), 1).label("average_loan_days"),
+                func.min(loans.c.borrow_date).label("first_loan_date"),
+                func.max(loans.c.borrow_date).label("last_loan_date"),
+            )
+        )).one()._asdict()
+        if totals["total_loans"] == 0 and not await self.reader_exists(reader_id):
+            raise NoResultFound()
+
+        loans_count = func.count().label("loans")
+        authors = await self.db.execute(
+            select(Book.author, loans_count)
+            .join(loans, loans.c.book_id == Book.id)
+            .group_by(Book.author)
+            .order_by(loans_count.desc(), Book.author)
+            .limit(authors_limit)
+        )
+        totals["favorite_authors"] = [row._asdict() for row in authors]
+        return totals
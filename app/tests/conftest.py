@@ -1,11 +1,36 @@
+# base
+from contextlib import contextmanager
 # installed
 import pytest
 from starlette.testclient import TestClient
 # local
+from app.backend.db import track_queries
 from app.main import app
+from app.services.catalog_cache import catalog_cache
 
 
 @pytest.fixture(scope="module")
 def test_app():
     client = TestClient(app)
-    yield client  # testing happens here
\ No newline at end of file
+    yield client  # testing happens here
+
+
+@pytest.fixture(autouse=True)
+def clear_catalog_cache():
+    """ Кэш каталога общий для процесса, страницы одного теста не должны попадать в другой """
+    catalog_cache.local.clear()
+    yield
+    catalog_cache.local.clear()
+
+
+@pytest.fixture
+def query_budget():
+    """ Проверка бюджета запросов в БД: тест падает, если блок with query_budget(n) выполнил больше n запросов.
+    Считаются запросы движков, созданных make_engine или подключенных через instrument_engine """
+    @contextmanager
+    def budget(limit: int):
+        with track_queries() as stats:
+            yield stats
+        assert stats.count <= limit, f"Выполнено {stats.count} запросов в БД при бюджете {limit}"
+
+    return budget
@@ -1,3 +1,19 @@
+# base
+import asyncio
+import time
+# installed
+import pytest
+from unittest.mock import AsyncMock
+from jose.exceptions import JWTError
+# local
+from app.models.librarian import Librarian
+from app.services.auth_service import AuthEngine, AuthService
+from app.services.cache import TTLCache, token_cache, librarian_cache, invalidate_librarian
+from app.services.dependencies import get_current_user
+from app.services.email_validation import EmailValidator
+from app.services.hashing import BCRYPT_QUEUE_WAIT, PasswordHasher, PasswordHasherBusy
+
+
 # Тесты для проверки JWT
 def test_all_books(test_app):
     """ Эндпоинт без авторизации """
@@ -8,4 +24,163 @@ def test_all_books(test_app):
 def test_book(test_app):
     """ Эндпоинт с авторизации """
     response = test_app.get("/books/1")
-    assert response.status_code == 401
\ No newline at end of file
+    assert response.status_code == 401
+
+
+def test_librarian_registration_hides_password(test_app, mocker):
+    """ Ответ регистрации библиотекаря не содержит пароль """
+    librarian = mocker.MagicMock(spec=Librarian)
+    librarian.configure_mock(id=1, name="Библиотекарь", email="librarian@example.com", password="$2b$12$hash")
+    mock_service = mocker.patch("app.api.auth.LibrarianService").return_value
+    mock_service.create_particular_librarian = AsyncMock(return_value=librarian)
+
+    response = test_app.post("/auth/registration/librarian", json={
+        "name": "Библиотекарь", "email": "librarian@example.com", "password": "secret"
+    })
+
+    assert response.status_code == 201
+    assert response.json() == {"id": 1, "name": "Библиотекарь", "email": "librarian@example.com"}
+
+
+def test_ttl_cache_expires_and_evicts(mocker):
+    """ Тест TTL кэша: записи устаревают и вытесняются по LRU """
+    now = mocker.patch("app.services.cache.time.monotonic", return_value=100.0)
+    cache = TTLCache(maxsize=2, ttl=10)
+
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=1)
+    now.return_value = 101.0
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+
+    cache.set("c", 3)
+    cache.set("d", 4)
+    assert cache.get("a") is None
+    assert len(cache) == 2
+
+
+@pytest.mark.asyncio
+async def test_get_current_user_uses_cache(mocker):
+    """ Тест того, что повторный запрос с тем же токеном не обращается к БД """
+    token_cache.clear()
+    librarian_cache.clear()
+    mock_db = mocker.MagicMock()
+    librarian = mocker.MagicMock(spec=Librarian, email="librarian@example.com")
+    mock_service = mocker.MagicMock()
+    mock_service.get_particular_librarian = AsyncMock(return_value=librarian)
+    mocker.patch("app.services.dependencies.LibrarianService", return_value=mock_service)
+
+    token = AuthService(mock_db).create_access_token(librarian.email)
+    first = await get_current_user(mock_db, token)
+    second = await get_current_user(mock_db, token)
+
+    assert first is second is librarian
+    mock_service.get_particular_librarian.assert_awaited_once()
+
+    invalidate_librarian(librarian.email)
+    await get_current_user(mock_db, token)
+    assert mock_service.get_particular_librarian.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_password_hasher_rejects_when_queue_full(mocker):
+    """ Тест ограничения очереди пула bcrypt """
+    context = mocker.MagicMock()
+    context.hash = lambda password: time.sleep(0.05) or password[::-1]
+    hasher = PasswordHasher(context, workers=1, max_queue=1)
+    observed = sum(BCRYPT_QUEUE_WAIT.series.get((), [0])[:-1])
+
+    results = await asyncio.gather(*(hasher.hash("abc") for _ in range(3)), return_exceptions=True)
+
+    assert results[:2] == ["cba", "cba"]
+    assert isinstance(results[2], PasswordHasherBusy)
+    assert hasher.in_flight == 0
+    # ожидание потока записано для обеих принятых операций
+    assert sum(BCRYPT_QUEUE_WAIT.series[()][:-1]) == observed + 2
+
+
+@pytest.mark.asyncio
+async def test_refresh_tokens_rotates_refresh_token(mocker):
+    """ Тест ротации: refresh токен можно использовать только один раз """
+    mock_db = mocker.MagicMock()
+    mock_db.commit = AsyncMock()
+    mock_db.scalar = AsyncMock(side_effect=lambda stmt: stmt.compile().params["jti"])
+    auth_service = AuthService(mock_db)
+    refresh_token = auth_service.create_refresh_token("librarian@example.com")
+
+    tokens = await auth_service.refresh_tokens(refresh_token)
+
+    assert set(tokens) == {"access_token", "refresh_token"}
+    assert tokens["refresh_token"] != refresh_token
+    # повторное использование отсекается в памяти процесса, без запроса в БД
+    with pytest.raises(ValueError, match="Refresh токен уже использован или отозван"):
+        await auth_service.refresh_tokens(refresh_token)
+    mock_db.scalar.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_refresh_tokens_not_revoked_in_memory_when_commit_fails(mocker):
+    """ Тест отзыва: если транзакция не зафиксирована, токен не считается отозванным в памяти процесса """
+    mock_db = mocker.MagicMock()
+    mock_db.commit = AsyncMock(side_effect=[ConnectionError("БД недоступна"), None])
+    mock_db.scalar = AsyncMock(side_effect=lambda stmt: stmt.compile().params["jti"])
+    auth_service = AuthService(mock_db)
+    refresh_token = auth_service.create_refresh_token("librarian@example.com")
+
+    with pytest.raises(ConnectionError):
+        await auth_service.refresh_tokens(refresh_token)
+    # повторная попытка снова идет в БД и успешно отзывает токен
+    assert set(await auth_service.refresh_tokens(refresh_token)) == {"access_token", "refresh_token"}
+    assert mock_db.scalar.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_refresh_tokens_revoked_in_other_process(mocker):
+    """ Тест токена, который уже отозван в БД другим процессом """
+    mock_db = mocker.MagicMock()
+    mock_db.scalar = AsyncMock(return_value=None)
+    auth_service = AuthService(mock_db)
+
+    with pytest.raises(ValueError, match="Refresh токен уже использован или отозван"):
+        await auth_service.refresh_tokens(auth_service.create_refresh_token("librarian@example.com"))
+
+
+@pytest.mark.asyncio
+async def test_refresh_tokens_rejects_access_token(mocker):
+    """ Тест того, что access токен не подходит для обновления """
+    auth_service = AuthService(mocker.MagicMock())
+
+    with pytest.raises(JWTError):
+        await auth_service.refresh_tokens(auth_service.create_access_token("librarian@example.com"))
+
+
+def test_auth_engine_keys_built_once():
+    """ Тест AuthEngine: токены подписываются готовыми ключами, access и refresh ключи не взаимозаменяемы """
+    engine = AuthEngine("HS256", "access-secret", "refresh-secret")
+
+    access_token = engine.create_access_token("librarian@example.com")
+    assert engine.decode_access_token(access_token).sub == "librarian@example.com"
+    assert engine.decode_refresh_token(engine.create_refresh_token("librarian@example.com")).scope == "refresh"
+    with pytest.raises(JWTError):
+        engine.decode_access_token(engine.create_refresh_token("librarian@example.com"))
+    # без настроек ошибка возникает при запуске, а не при первом входе
+    with pytest.raises(RuntimeError):
+        AuthEngine("HS256", None, "refresh-secret")
+
+
+def test_email_validator_caches_domain_checks(mocker):
+    """ Тест проверки email: домен проверяется один раз, DNS запрашивается только в режиме deliverability """
+    deliverability = mocker.patch("app.services.email_validation.validate_email_deliverability")
+    validator = EmailValidator(mode="syntax")
+    assert validator.validate("reader.one+tag@Example.com") == "reader.one+tag@Example.com"
+    for address in ("reader..two@example.com", "reader@exa_mple.com", "\"quoted\"@example.com", "reader@[1.2.3.4]"):
+        with pytest.raises(ValueError, match="Некорректный адрес электронной почты"):
+            validator.validate(address)
+    deliverability.assert_not_called()
+
+    validator = EmailValidator(mode="deliverability")
+    for index in range(3):
+        validator.validate(f"reader-{index}@example.com")
+    deliverability.assert_called_once_with("example.com", "example.com")
+    with pytest.raises(ValueError):
+        EmailValidator(mode="dns")
@@ -0,0 +1,50 @@
+# local
+from app.benchmarks.compare import compare_reports
+from app.benchmarks.harness import Recorder, percentile
+
+
+def test_percentile_nearest_rank():
+    """ Тест перцентиля методом ближайшего ранга """
+    values = [float(value) for value in range(1, 101)]
+    assert percentile(values, 50) == 50
+    assert percentile(values, 95) == 95
+    assert percentile(values, 99) == 99
+    assert percentile([7.0], 99) == 7
+    assert percentile([], 50) is None
+
+
+def test_recorder_summary():
+    """ Тест сводки нагрузочного прогона: перцентили, ошибки и запросы в БД по эндпоинтам """
+    recorder = Recorder(count_queries=True)
+    for duration in (0.010, 0.020, 0.030):
+        recorder.record("GET /books/", duration, "200", queries=2)
+    recorder.record("POST /books/borrow/{book_id}/reader/{reader_id}", 0.050, "409")
+    recorder.record("POST /books/borrow/{book_id}/reader/{reader_id}", 0.100, "500")
+    recorder.record("POST /books/borrow/{book_id}/reader/{reader_id}", 0.200, "ReadTimeout")
+    recorder.finish()
+
+    summary = recorder.summary()
+    books = summary["endpoints"]["GET /books/"]
+    assert summary["requests"] == 6
+    assert books["requests"] == 3
+    assert books["errors"] == 0
+    assert books["p50_ms"] == 20.0
+    assert books["p99_ms"] == 30.0
+    assert books["db_queries_per_request"] == 2.0
+
+    borrow = summary["endpoints"]["POST /books/borrow/{book_id}/reader/{reader_id}"]
+    # 409 - ожидаемый бизнес ответ, ошибками считаются 5xx и ошибки сети
+    assert borrow["errors"] == 2
+    assert borrow["statuses"] == {"409": 1, "500": 1, "ReadTimeout": 1}
+
+
+def test_compare_reports_flags_regressions():
+    """ Тест сравнения отчетов: регрессией считается рост метрики сверх порога """
+    def report(p95, queries):
+        endpoint = {"p50_ms": 10.0, "p95_ms": p95, "p99_ms": 40.0, "db_queries_per_request": queries}
+        return {"scenarios": {"mixed": {"endpoints": {"GET /books/": endpoint}}}}
+
+    changes = compare_reports(report(20.0, 1.0), report(30.0, 2.0), threshold=10)
+    regressions = {change["metric"] for change in changes if change["regression"]}
+    assert regressions == {"p95_ms", "db_queries_per_request"}
+    assert compare_reports(report(20.0, 1.0), {"scenarios": {"login-storm": {"endpoints": {}}}}, 10) == []
@@ -0,0 +1,201 @@
+# base
+import sqlite3
+import time
+# installed
+import pytest
+from fastapi import FastAPI
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import NullPool, QueuePool
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+# local
+from app.backend.db import (
+    DB_POOL_CHECKED_OUT,
+    DB_POOL_CHECKOUT_TIMEOUTS,
+    DB_POOL_CHECKOUT_WAIT,
+    InstrumentedAsyncPool,
+    InstrumentedPoolMixin,
+    async_session_maker,
+    current_query_stats,
+    engine_options,
+    instrument_engine,
+    track_queries,
+)
+from app.backend.metrics import render_metrics
+from app.backend.notifications import NotificationListener
+from app.backend.middleware import (
+    HTTP_REQUEST_DURATION,
+    PRIMARY_PIN_COOKIE,
+    UNMATCHED_ROUTE,
+    MetricsMiddleware,
+    QueryStatsMiddleware,
+    ReadYourWritesMiddleware,
+    is_pinned_to_primary,
+)
+from app.services.dependencies import read_session_maker
+
+
+class InstrumentedTestPool(InstrumentedPoolMixin, QueuePool):
+    label = "test"
+
+
+def test_engine_options_direct_connection():
+    """ Тест настроек движка без PgBouncer: свой пул и кэш подготовленных выражений """
+    options = engine_options(pgbouncer=False)
+    assert options["poolclass"] is InstrumentedAsyncPool
+    assert options["connect_args"]["prepared_statement_cache_size"] > 0
+
+
+def test_engine_options_pgbouncer():
+    """ Тест настроек движка за PgBouncer: без пула и кэша подготовленных выражений """
+    options = engine_options(pgbouncer=True)
+    connect_args = options["connect_args"]
+    assert options["poolclass"] is NullPool
+    assert connect_args["statement_cache_size"] == 0
+    assert connect_args["prepared_statement_cache_size"] == 0
+    # имена подготовленных выражений не должны повторяться между серверными соединениями
+    name_func = connect_args["prepared_statement_name_func"]
+    assert name_func() != name_func()
+
+
+def test_instrumented_pool_metrics():
+    """ Тест метрик пула: занятые соединения, ожидание и таймауты выдачи соединения """
+    pool = InstrumentedTestPool(lambda: sqlite3.connect(":memory:"), pool_size=1, max_overflow=0, timeout=0.01)
+    DB_POOL_CHECKOUT_WAIT.series.pop(("test",), None)
+    DB_POOL_CHECKOUT_TIMEOUTS.values.pop(("test",), None)
+
+    connection = pool.connect()
+    assert DB_POOL_CHECKED_OUT.values[("test",)] == 1
+    with pytest.raises(PoolTimeoutError):
+        pool.connect()
+    assert DB_POOL_CHECKOUT_TIMEOUTS.values[("test",)] == 1
+
+    connection.close()
+    assert DB_POOL_CHECKED_OUT.values[("test",)] == 0
+    # два ожидания: удачное и завершившееся таймаутом
+    assert sum(DB_POOL_CHECKOUT_WAIT.series[("test",)][:-1]) == 2
+    assert pool.recreate().label == "test"
+
+
+def test_read_your_writes_middleware_pins_after_write():
+    """ Тест закрепления чтения за основной БД только после успешной записи """
+    async def endpoint(request):
+        return PlainTextResponse("ok", status_code=int(request.query_params.get("status", 200)))
+
+    app = Starlette(routes=[Route("/", endpoint, methods=["GET", "POST"])])
+    app.add_middleware(ReadYourWritesMiddleware, seconds=5)
+    with TestClient(app) as client:
+        assert PRIMARY_PIN_COOKIE not in client.get("/").cookies
+        assert PRIMARY_PIN_COOKIE not in client.post("/?status=409").cookies
+        response = client.post("/")
+    assert is_pinned_to_primary(response.cookies)
+
+
+def test_metrics_middleware_records_route_templates():
+    """ Тест метрик запросов: серии по шаблону маршрута, а не по конкретному адресу """
+    app = FastAPI()
+
+    @app.get("/metrics-test/{item_id}")
+    async def get_item(item_id: int):
+        return {"id": item_id}
+
+    @app.get("/metrics-test-error")
+    async def get_error():
+        raise RuntimeError()
+
+    app.add_middleware(MetricsMiddleware)
+    HTTP_REQUEST_DURATION.series.clear()
+    with TestClient(app, raise_server_exceptions=False) as client:
+        client.get("/metrics-test/1")
+        client.get("/metrics-test/2")
+        client.get("/metrics-test/not-a-number")
+        client.get("/metrics-test-error")
+        client.get("/unknown/path")
+
+    # разные id попадают в одну серию шаблона маршрута
+    assert sum(HTTP_REQUEST_DURATION.series[("GET", "/metrics-test/{item_id}", 200)][:-1]) == 2
+    assert ("GET", "/metrics-test/{item_id}", 422) in HTTP_REQUEST_DURATION.series
+    assert ("GET", "/metrics-test-error", 500) in HTTP_REQUEST_DURATION.series
+    assert ("GET", UNMATCHED_ROUTE, 404) in HTTP_REQUEST_DURATION.series
+    assert MetricsMiddleware.in_flight == 0
+    assert "http_requests_in_flight 0" in render_metrics()
+
+
+def test_query_stats_middleware_counts_queries(caplog):
+    """ Тест подсчета запросов в БД: заголовки ответа и лог запросов сверх порога """
+    engine = create_engine("sqlite://")
+    instrument_engine(engine)
+    app = FastAPI()
+
+    @app.get("/items/{count}")
+    async def get_items(count: int):
+        with engine.connect() as connection:
+            for _ in range(count):
+                connection.execute(text("SELECT 1"))
+        return {}
+
+    app.add_middleware(QueryStatsMiddleware, headers=True, log_threshold=2)
+    with TestClient(app) as client:
+        response = client.get("/items/2")
+        assert response.headers["x-db-queries"] == "2"
+        assert response.headers["server-timing"].startswith("db;dur=")
+        assert not caplog.records
+        # запросы сверх порога пишутся в лог с шаблоном маршрута
+        assert client.get("/items/3").headers["x-db-queries"] == "3"
+    assert "GET /items/{count}: 3 запросов в БД" in caplog.text
+
+    # вне запроса к приложению запросы не считаются и не пишутся в лог, даже сверх порога
+    caplog.clear()
+    with engine.connect() as connection:
+        for _ in range(3):
+            connection.execute(text("SELECT 1"))
+        assert current_query_stats.get() is None
+    assert not caplog.records
+
+
+def test_nested_track_queries_count_in_outer_block():
+    """ Тест вложенных блоков track_queries: запрос учитывается и во внешнем блоке """
+    engine = create_engine("sqlite://")
+    instrument_engine(engine)
+    with engine.connect() as connection:
+        with track_queries() as outer:
+            connection.execute(text("SELECT 1"))
+            with track_queries() as inner:
+                connection.execute(text("SELECT 1"))
+    assert inner.count == 1
+    assert outer.count == 2
+    assert outer.duration >= inner.duration
+
+
+def test_read_session_maker_routes_reads(mocker):
+    """ Тест выбора сессии чтения: реплика, пока клиент не закреплен за основной БД """
+    replica = mocker.Mock()
+    mocker.patch("app.services.dependencies.replica_session_maker", replica)
+    request = mocker.Mock(cookies={})
+    assert read_session_maker(request) is replica
+
+    request.cookies = {PRIMARY_PIN_COOKIE: str(time.time() + 5)}
+    assert read_session_maker(request) is async_session_maker
+    request.cookies = {PRIMARY_PIN_COOKIE: str(time.time() - 1)}
+    assert read_session_maker(request) is replica
+    request.cookies = {PRIMARY_PIN_COOKIE: "garbage"}
+    assert read_session_maker(request) is replica
+
+    mocker.patch("app.services.dependencies.replica_session_maker", None)
+    assert read_session_maker(mocker.Mock(cookies={})) is async_session_maker
+
+
+@pytest.mark.asyncio
+async def test_notification_listener_requires_direct_url_with_pgbouncer(mocker):
+    """ Через PgBouncer в режиме transaction LISTEN не работает, поэтому без прямого адреса слушатель не стартует """
+    listener = NotificationListener("postgresql://pgbouncer/db")
+    listener.subscribe("channel", mocker.AsyncMock())
+    mocker.patch("app.backend.notifications.DB_PGBOUNCER", True)
+    mocker.patch("app.backend.notifications.NOTIFY_DATABASE_URL", None)
+    with pytest.raises(RuntimeError):
+        await listener.start()
+    assert listener._task is None
+
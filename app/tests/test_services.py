@@ -1,70 +1,103 @@
 # base
-from datetime import date
+import csv
+import io
+from collections import namedtuple
+from datetime import date, datetime, timezone
 # installed
 import pytest
 from unittest.mock import AsyncMock
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import NoResultFound
 from sqlalchemy.ext.asyncio import AsyncSession
 # local
 from app.models.book import Book, BorrowedBook
-from app.models.reader import Reader
-from app.services.book_service import BookService
+from app.schemas.book import BatchUpdateBook, BorrowItem, UpdateBook
+from app.schemas.user import CreateReader
+from app.services.archive_service import BorrowArchiveService
+from app.services.availability import AvailabilityHub
+from app.services.book_service import BookService, BOOK_COLUMNS
+from app.services.catalog_cache import CatalogCache, LocalSharedCache, book_tags, page_tags, notification_tags
+from app.services.other import (
+    PreconditionFailed,
+    decode_cursor,
+    encode_cursor,
+    if_match_versions,
+    is_not_modified,
+    make_etag,
+    row_etag,
+)
+from app.services.import_service import read_records, parse_chunk
+from app.services.overdue_service import OverdueService
 from app.services.reader_service import ReaderService
 
 
+# строка результата запроса колонок книги, как ее возвращает execute
+BookRow = namedtuple("BookRow", [column.key for column in BOOK_COLUMNS], defaults=[None] * len(BOOK_COLUMNS))
+# строка UPDATE ... RETURNING версии
+VersionRow = namedtuple("VersionRow", ["version", "updated_at"])
+
+
 @pytest.mark.asyncio
 async def test_borrow_particular_book_reader_success(mocker):
     """ Тест успешной выдачи книги """
     mock_db = mocker.MagicMock(spec=AsyncSession)
     mock_db.commit = AsyncMock()
 
-    book = Book(copies_quantity=1)
+    borrowed_book = BorrowedBook(book_id=1, reader_id=1, is_active=True)
+    # блокировка читателя, затем списание экземпляра с созданием выдачи
+    mock_db.scalar = AsyncMock(side_effect=[1, borrowed_book])
+
+    book_service = BookService(mock_db)
+    result = await book_service.borrow_particular_book_reader(book_id=1, reader_id=1)
+
+    assert result is borrowed_book
+    assert mock_db.scalar.await_count == 2
+    mock_db.commit.assert_awaited_once()
+
 
-    reader = Reader(borrowed_books=[])
+@pytest.mark.asyncio
+async def test_borrow_book_reader_not_found(mocker):
+    """ Тест выдачи несуществующему читателю """
+    mock_db = mocker.MagicMock()
+    mock_db.scalar = AsyncMock(return_value=None)
+    mock_db.rollback = AsyncMock()
+    mock_db.execute = AsyncMock(return_value=mocker.MagicMock(one_or_none=lambda: (1, None, False)))
 
-    # Мокаем сервисы
     book_service = BookService(mock_db)
-    book_service.get_particular_book = AsyncMock(return_value=book)
 
-    mock_reader_service = mocker.MagicMock(spec=ReaderService)
-    mock_reader_service.get_particular_reader = AsyncMock(return_value=reader)
-    mocker.patch('app.services.book_service.ReaderService', return_value=mock_reader_service)
+    with pytest.raises(NoResultFound):
+        await book_service.borrow_particular_book_reader(book_id=1, reader_id=1)
 
-    result = await book_service.borrow_particular_book_reader(book_id=1, reader_id=1)
 
-    assert isinstance(result, BorrowedBook)
-    assert book.copies_quantity == 0
-    mock_db.add.assert_called_once()
-    mock_db.commit.assert_awaited_once()
+def mock_failed_borrow(mocker, state):
+    """ Мок БД, в которой списание экземпляра не прошло, state - (экземпляры, активные выдачи, уже взята) """
+    mock_db = mocker.MagicMock()
+    mock_db.scalar = AsyncMock(side_effect=[1, None])
+    mock_db.rollback = AsyncMock()
+    mock_db.commit = AsyncMock()
+    mock_db.execute = AsyncMock(return_value=mocker.MagicMock(one_or_none=lambda: state))
+    return mock_db
 
 
 @pytest.mark.asyncio
 async def test_borrow_book_no_copies_available(mocker):
     """ Тест случая, когда нет доступных экземпляров """
-    mock_db = mocker.MagicMock()
-    book = Book(copies_quantity=0)
+    mock_db = mock_failed_borrow(mocker, (0, 0, False))
 
     book_service = BookService(mock_db)
-    book_service.get_particular_book = AsyncMock(return_value=book)
 
     with pytest.raises(ValueError, match="Нет доступных экземпляров данной книги"):
         await book_service.borrow_particular_book_reader(book_id=1, reader_id=1)
+    mock_db.rollback.assert_awaited_once()
+    mock_db.commit.assert_not_awaited()
 
 
 @pytest.mark.asyncio
 async def test_borrow_book_already_borrowed(mocker):
     """ Тест случая, когда читатель уже взял эту книгу """
-    mock_db = mocker.MagicMock()
-    book = Book(id=1, copies_quantity=1)
-
-    borrowed_book = BorrowedBook(book_id=1, reader_id=1)
-    reader = Reader(id=1, borrowed_books=[borrowed_book])
+    mock_db = mock_failed_borrow(mocker, (1, 1, True))
 
     book_service = BookService(mock_db)
-    book_service.get_particular_book = AsyncMock(return_value=book)
-
-    mock_reader_service = mocker.MagicMock()
-    mock_reader_service.get_particular_reader = AsyncMock(return_value=reader)
-    mocker.patch('app.services.book_service.ReaderService', return_value=mock_reader_service)
 
     with pytest.raises(ValueError, match="Читатель уже брал эту книгу и еще не вернул"):
         await book_service.borrow_particular_book_reader(book_id=1, reader_id=1)
@@ -73,118 +106,609 @@ async def test_borrow_book_already_borrowed(mocker):
 @pytest.mark.asyncio
 async def test_borrow_book_max_limit_reached(mocker):
     """ Тест случая, когда читатель достиг лимита книг """
-    mock_db = mocker.MagicMock()
-    book = Book(id=1, copies_quantity=1)
-
-    # Создаем читателя с 3 уже взятыми книгами
-    borrowed_books = [
-        BorrowedBook(book_id=2, reader_id=1),
-        BorrowedBook(book_id=3, reader_id=1),
-        BorrowedBook(book_id=4, reader_id=1)
-    ]
-    reader = Reader(id=1, borrowed_books=borrowed_books)
+    mock_db = mock_failed_borrow(mocker, (1, 3, False))
+    # резерв в лимите читателя не удался
+    mock_db.scalar = AsyncMock(return_value=None)
 
     book_service = BookService(mock_db)
-    book_service.get_particular_book = AsyncMock(return_value=book)
-
-    mock_reader_service = mocker.MagicMock()
-    mock_reader_service.get_particular_reader = AsyncMock(return_value=reader)
-    mocker.patch('app.services.book_service.ReaderService', return_value=mock_reader_service)
 
     with pytest.raises(ValueError, match="Читатель не может взять больше 3-х книг"):
         await book_service.borrow_particular_book_reader(book_id=1, reader_id=1)
 
 
+@pytest.mark.asyncio
+async def test_borrow_book_not_found(mocker):
+    """ Тест выдачи несуществующей книги """
+    mock_db = mock_failed_borrow(mocker, None)
+
+    book_service = BookService(mock_db)
+
+    with pytest.raises(NoResultFound):
+        await book_service.borrow_particular_book_reader(book_id=1, reader_id=1)
+
+
 @pytest.mark.asyncio
 async def test_return_book_success(mocker):
     """ Тест успешного возврата книги """
-    # Arrange
     mock_db = mocker.MagicMock()
-    mock_db.scalar = AsyncMock()
     mock_db.commit = AsyncMock()
 
-    borrowed_book = BorrowedBook(book_id=1, reader_id=1, is_active=True)
-
-    book = Book(id=1, copies_quantity=0,)
-
-    # Мокаем вызовы БД
-    mock_db.scalar.return_value = borrowed_book
+    borrowed_book = BorrowedBook(book_id=1, reader_id=1, is_active=False, return_date=date.today())
+    mock_db.scalar = AsyncMock(return_value=borrowed_book)
 
     book_service = BookService(mock_db)
-    book_service.get_particular_book = AsyncMock(return_value=book)
-
     result = await book_service.return_particular_book_reader(book_id=1, reader_id=1)
 
     assert result == borrowed_book
-    assert borrowed_book.is_active is False
-    assert borrowed_book.return_date == date.today()
-    assert book.copies_quantity == 1
+    mock_db.scalar.assert_awaited_once()
     mock_db.commit.assert_awaited_once()
 
 
+@pytest.mark.asyncio
+async def test_return_book_single_statement(mocker):
+    """ Тест того, что возврат выполняется одним запросом и блокирует читателя раньше книги """
+    mock_db = mocker.MagicMock()
+    mock_db.commit = AsyncMock()
+    mock_db.scalar = AsyncMock(return_value=BorrowedBook(book_id=1, reader_id=1, is_active=False))
+
+    book_service = BookService(mock_db)
+    await book_service.return_particular_book_reader(book_id=1, reader_id=1)
+
+    stmt = mock_db.scalar.await_args.args[0]
+    sql = str(stmt.compile(dialect=postgresql.dialect()))
+    assert "WITH release AS \n(UPDATE reader SET" in sql
+    assert "closed AS \n(UPDATE borrowed_book SET" in sql
+    assert sql.index("UPDATE reader") < sql.index("UPDATE borrowed_book") < sql.index("UPDATE book SET copies_quantity")
+
+
 @pytest.mark.asyncio
 async def test_return_book_not_borrowed(mocker):
-    """ Тест попытки вернуть книгу, которую читатель не брал """
+    """ Тест попытки вернуть книгу, которую читатель не брал или уже вернул """
     mock_db = mocker.MagicMock()
     mock_db.scalar = AsyncMock(return_value=None)
+    mock_db.commit = AsyncMock()
+    mock_db.rollback = AsyncMock()
 
     book_service = BookService(mock_db)
 
     with pytest.raises(ValueError, match="Читатель не брал эту книгу или уже вернул ее"):
         await book_service.return_particular_book_reader(book_id=1, reader_id=1)
+    mock_db.commit.assert_not_awaited()
+    mock_db.rollback.assert_awaited_once()
 
 
 @pytest.mark.asyncio
-async def test_return_book_already_returned(mocker):
-    """ Тест попытки вернуть уже возвращенную книгу """
+async def test_get_all_books_next_cursor(mocker):
+    """ Тест выдачи курсора следующей страницы """
     mock_db = mocker.MagicMock()
+    rows = [BookRow(id=1), BookRow(id=2), BookRow(id=3)]
+    mock_db.execute = AsyncMock(return_value=mocker.MagicMock(all=lambda: rows))
 
-    mock_db.scalar = AsyncMock(return_value=None)
+    book_service = BookService(mock_db)
+    page, next_cursor = await book_service.get_all_books(limit=2)
+
+    assert [book["id"] for book in page] == [1, 2]
+    assert decode_cursor(next_cursor) == ["id", 2]
+
+
+@pytest.mark.asyncio
+async def test_get_all_books_last_page(mocker):
+    """ Тест последней страницы без курсора """
+    mock_db = mocker.MagicMock()
+    rows = [BookRow(id=1, author="a", name="b")]
+    mock_db.execute = AsyncMock(return_value=mocker.MagicMock(all=lambda: rows))
 
     book_service = BookService(mock_db)
+    page, next_cursor = await book_service.get_all_books(limit=2, order_by="author")
 
-    with pytest.raises(ValueError, match="Читатель не брал эту книгу или уже вернул ее"):
-        await book_service.return_particular_book_reader(book_id=1, reader_id=1)
+    assert page == [rows[0]._asdict()]
+    assert next_cursor is None
 
 
 @pytest.mark.asyncio
-async def test_return_book_increments_quantity_correctly(mocker):
-    """ Тест корректного увеличения количества книг """
-    mock_db = mocker.AsyncMock()
-    mock_db.scalar = AsyncMock(return_value=BorrowedBook(
-        book_id=1,
-        reader_id=1,
-        is_active=True
-    ))
+async def test_get_all_books_invalid_cursor(mocker):
+    """ Тест курсора от другой сортировки """
+    mock_db = mocker.MagicMock()
+    book_service = BookService(mock_db)
+
+    with pytest.raises(ValueError, match="Некорректный курсор"):
+        await book_service.get_all_books(limit=2, cursor=encode_cursor(["id", 1]), order_by="author")
 
-    book = Book(
-        id=1,
-        copies_quantity=5
-    )
+
+@pytest.mark.asyncio
+async def test_search_books_uses_indexed_operators(mocker):
+    """ Тест того, что поиск ранжирует ограниченных кандидатов, найденных операторами, покрытыми индексами """
+    mock_db = mocker.MagicMock()
+    mock_db.execute = AsyncMock(return_value=[])
 
     book_service = BookService(mock_db)
-    book_service.get_particular_book = AsyncMock(return_value=book)
+    result = await book_service.search_books("война и мир")
+
+    stmt = mock_db.execute.await_args.args[0]
+    sql = str(stmt.compile(dialect=postgresql.dialect()))
+    assert result == []
+    assert "book.search_vector @@ websearch_to_tsquery" in sql
+    assert "book.name %%" in sql
+    assert "book.author %%" in sql
+    assert "ORDER BY book.name <->" in sql
+    assert "ORDER BY book.author <->" in sql
+    # ранг вычисляется только во внешнем запросе, после ограничения кандидатов
+    assert sql.count("LIMIT") == 4
+    candidates = sql[sql.index("JOIN ("):sql.index("AS candidates")]
+    assert "ts_rank_cd" not in candidates and "similarity" not in candidates
 
-    await book_service.return_particular_book_reader(book_id=1, reader_id=1)
 
-    assert book.copies_quantity == 6
+@pytest.mark.asyncio
+async def test_borrow_books_batch_applies_rules_within_batch(mocker):
+    """ Тест пакетной выдачи: лимит, повтор и остаток экземпляров учитываются внутри пакета """
+    mock_db = mocker.MagicMock()
+    mock_db.commit = AsyncMock()
+    # у читателя 1 уже есть одна активная книга (id=9), у книги 2 один экземпляр
+    mock_db.scalars = AsyncMock(return_value=[
+        BorrowedBook(book_id=1, reader_id=1),
+        BorrowedBook(book_id=2, reader_id=1),
+    ])
+    mock_db.execute = AsyncMock(side_effect=[
+        mocker.MagicMock(all=lambda: [(1, 1), (2, 0)]),
+        mocker.MagicMock(all=lambda: [(1, 5), (2, 1), (3, 5)]),
+        mocker.MagicMock(all=lambda: [(1, 9)]),
+        mocker.MagicMock(),
+        mocker.MagicMock(),
+    ])
+    items = [
+        BorrowItem(book_id=1, reader_id=1),
+        BorrowItem(book_id=1, reader_id=1),
+        BorrowItem(book_id=2, reader_id=1),
+        BorrowItem(book_id=3, reader_id=1),
+        BorrowItem(book_id=2, reader_id=2),
+    ]
+
+    book_service = BookService(mock_db)
+    results = await book_service.borrow_books_batch(items)
+
+    assert [result["detail"] for result in results] == [
+        None,
+        "Читатель уже брал эту книгу и еще не вернул",
+        None,
+        "Читатель не может взять больше 3-х книг",
+        "Нет доступных экземпляров данной книги",
+    ]
+    assert results[0]["borrowed_book"].book_id == 1
+    assert results[1]["borrowed_book"] is None
+    mock_db.commit.assert_awaited_once()
 
 
 @pytest.mark.asyncio
-async def test_return_book_updates_return_date(mocker):
-    """ Тест установки правильной даты возврата """
-    mock_db = mocker.AsyncMock()
-    borrowed_book = BorrowedBook(
-        book_id=1,
-        reader_id=1,
-        is_active=True
+async def test_return_books_batch_reports_missing(mocker):
+    """ Тест пакетного возврата: не найденные выдачи возвращаются с ошибкой """
+    mock_db = mocker.MagicMock()
+    mock_db.commit = AsyncMock()
+    mock_db.scalars = AsyncMock(return_value=[BorrowedBook(book_id=1, reader_id=1, is_active=False)])
+    mock_db.execute = AsyncMock()
+
+    book_service = BookService(mock_db)
+    results = await book_service.return_books_batch([
+        BorrowItem(book_id=1, reader_id=1),
+        BorrowItem(book_id=1, reader_id=1),
+    ])
+
+    assert [result["success"] for result in results] == [True, False]
+    # блокировка читателей и книг, затем обновление экземпляров книг и лимитов читателей
+    assert mock_db.execute.await_count == 4
+    mock_db.commit.assert_awaited_once()
+
+
+def test_read_records_csv_and_ndjson():
+    """ Тест построчного чтения CSV и NDJSON файлов каталога """
+    csv_file = io.BytesIO("name,author,isbn\nКнига,\"Автор, А.\",123\n".encode())
+    ndjson_file = io.BytesIO(b'{"name": "a", "author": "b"}\n\nnot json\n')
+
+    assert list(read_records(csv_file, "csv")) == [(2, {"name": "Книга", "author": "Автор, А.", "isbn": "123"})]
+    assert list(read_records(ndjson_file, "ndjson")) == [(1, {"name": "a", "author": "b"}), (3, None)]
+
+
+def test_read_records_rejects_broken_rows():
+    """ Тест того, что некорректный UTF-8 и ошибки CSV отклоняют строку, а не весь импорт """
+    csv_file = io.BytesIO(
+        b"name,author,isbn\n"
+        b"\xff\xfe,A,1\n"
+        b"\"" + b"x" * (csv.field_size_limit() + 1) + b"\",A,2\n"
+        b"B,A,3\n"
     )
-    mock_db.scalar = AsyncMock(return_value=borrowed_book)
+    rows, errors, finished = parse_chunk(read_records(csv_file, "csv"), 10)
+
+    assert [row[0] for row in rows] == [4]
+    assert [error["line"] for error in errors] == [2, 3]
+    assert finished is True
+    # файл без заголовка не импортируется целиком
+    with pytest.raises(ValueError):
+        list(read_records(io.BytesIO(b"B,A,3\n"), "csv"))
+
+
+def test_read_records_reports_file_lines():
+    """ Тест номеров строк CSV: запись с переносами в кавычках и пустые строки не сдвигают номера ошибок """
+    csv_file = io.BytesIO(
+        b"name,author,isbn,description\n"
+        b"B,A,1,\"first\nsecond\r\nthird\"\n"
+        b"\n"
+        b",A,2,\n"
+        b"C,A,3\n"
+    )
+    rows, errors, finished = parse_chunk(read_records(csv_file, "csv"), 10)
+
+    assert [row[0] for row in rows] == [2, 7]
+    assert rows[0][-1] == "first\nsecond\r\nthird"
+    assert [error["line"] for error in errors] == [6]
+
+
+def test_parse_chunk_collects_errors():
+    """ Тест проверки строк импорта: корректные строки отделяются от ошибок """
+    records = iter([
+        (2, {"name": "Книга", "author": "Автор", "publication_year": "1999", "copies_quantity": "", "isbn": "1"}),
+        (3, {"name": "", "author": "Автор", "isbn": "2"}),
+        (4, {"name": "Книга", "author": "Автор", "isbn": "12345678901234"}),
+        (5, {"name": "Книга", "author": "Автор"}),
+        (6, {"name": "Книга", "author": "Автор", "isbn": "3", "copies_quantity": "99999999999"}),
+        (7, {"name": "Книга", "author": "Автор", "isbn": "4", "publication_year": 1e400}),
+    ])
 
+    rows, errors, finished = parse_chunk(records, 10)
+
+    assert rows == [(2, "Книга", "Автор", 1999, "1", None, None)]
+    assert [error["line"] for error in errors] == [3, 4, 5, 6, 7]
+    assert finished is True
+
+
+def test_is_not_modified_by_etag_and_date():
+    """ Тест условных заголовков: If-None-Match важнее If-Modified-Since """
+    updated_at = datetime(2026, 10, 18, 12, 0, 0, 500000, tzinfo=timezone.utc)
+    etag = make_etag(1, 2)
+    assert etag != make_etag(1, 3)
+
+    assert is_not_modified({"if-none-match": f'"other", W/{etag}'}, etag, updated_at)
+    assert is_not_modified({"if-none-match": "*"}, etag, updated_at)
+    assert not is_not_modified(
+        {"if-none-match": '"other"', "if-modified-since": "Sun, 18 Oct 2026 12:00:00 GMT"}, etag, updated_at
+    )
+    assert is_not_modified({"if-modified-since": "Sun, 18 Oct 2026 12:00:00 GMT"}, etag, updated_at)
+    assert not is_not_modified({"if-modified-since": "Sun, 18 Oct 2026 11:59:59 GMT"}, etag, updated_at)
+    assert not is_not_modified({"if-modified-since": "вчера"}, etag, updated_at)
+
+
+@pytest.mark.asyncio
+async def test_update_particular_book_bumps_version(mocker):
+    """ Тест того, что обновление книги одним запросом меняет только переданные поля и увеличивает версию """
+    mock_db = mocker.MagicMock(spec=AsyncSession)
+    mock_db.commit = AsyncMock()
+    mock_db.execute = AsyncMock(return_value=mocker.MagicMock(one_or_none=lambda: VersionRow(2, None)))
+
+    await BookService(mock_db).update_particular_book(1, UpdateBook(copies_quantity=2, isbn=None, name=None))
+
+    mock_db.execute.assert_awaited_once()
+    compiled = str(mock_db.execute.await_args.args[0].compile(dialect=postgresql.dialect()))
+    assert "version=(book.version + " in compiled
+    assert "updated_at=now()" in compiled
+    # null очищает только колонки, допускающие NULL, непереданные поля не попадают в запрос
+    assert "isbn=" in compiled and "copies_quantity=" in compiled
+    assert "name=" not in compiled and "author=" not in compiled
+    assert "RETURNING book.version, book.updated_at" in compiled
+
+
+@pytest.mark.asyncio
+async def test_update_particular_book_if_match(mocker):
+    """ Тест оптимистичной блокировки: версия из If-Match проверяется условием самого UPDATE """
+    mock_db = mocker.MagicMock(spec=AsyncSession)
+    mock_db.commit = AsyncMock()
+    mock_db.execute = AsyncMock(return_value=mocker.MagicMock(one_or_none=lambda: VersionRow(3, None)))
+    mock_db.scalar = AsyncMock(return_value=1)
     book_service = BookService(mock_db)
-    book_service.get_particular_book = AsyncMock(return_value=Book(id=1, copies_quantity=0))
 
-    await book_service.return_particular_book_reader(book_id=1, reader_id=1)
+    assert await book_service.update_particular_book(1, UpdateBook(name="a"), row_etag(1, 2)) == (3, None)
+    compiled = mock_db.execute.await_args.args[0].compile(dialect=postgresql.dialect())
+    assert "WHERE book.id = %(id_1)s AND book.version IN (__[POSTCOMPILE_version_2])" in str(compiled)
+    assert compiled.params["version_2"] == [2]
+    mock_db.scalar.assert_not_awaited()
+
+    # UPDATE не нашел строку с такой версией, а строка существует
+    mock_db.execute.return_value = mocker.MagicMock(one_or_none=lambda: None)
+    with pytest.raises(PreconditionFailed):
+        await book_service.update_particular_book(1, UpdateBook(name="a"), row_etag(1, 1))
+    mock_db.scalar.return_value = None
+    with pytest.raises(NoResultFound):
+        await book_service.update_particular_book(1, UpdateBook(name="a"), row_etag(1, 1))
+    assert mock_db.commit.await_count == 1
+
+
+def test_if_match_versions():
+    """ Тест разбора If-Match: сильное сравнение, только ETag этой записи """
+    assert if_match_versions(f'{row_etag(1, 2)}, W/{row_etag(1, 3)}, {row_etag(2, 4)}, "1.x"', 1) == {2}
+    assert if_match_versions('"other", *', 1) is None
+    assert if_match_versions('"1.²"', 1) == set()
+
+
+@pytest.mark.asyncio
+async def test_update_books_batch_single_statement(mocker):
+    """ Тест пакетного обновления: один UPDATE из массивов и причина для каждой не обновленной книги """
+    mock_db = mocker.MagicMock(spec=AsyncSession)
+    mock_db.commit = AsyncMock()
+    mock_db.execute = AsyncMock(side_effect=[
+        mocker.MagicMock(all=lambda: [(1, 5)]),
+        mocker.MagicMock(all=lambda: [(2, 7)]),
+    ])
+    items = [
+        BatchUpdateBook(id=1, copies_quantity=3),
+        BatchUpdateBook(id=2, version=6, name="b"),
+        BatchUpdateBook(id=3, isbn=None),
+    ]
+
+    results = await BookService(mock_db).update_books_batch(items)
+
+    assert [(result["success"], result["version"]) for result in results] == [(True, 5), (False, 7), (False, None)]
+    assert results[1]["detail"] == "Книга изменена другим запросом"
+    stmt = mock_db.execute.await_args_list[0].args[0]
+    compiled = stmt.compile(dialect=postgresql.dialect())
+    assert "FROM unnest(" in str(compiled)
+    assert compiled.params["set_copies_quantity"] == [True, False, False]
+    assert compiled.params["set_isbn"] == [False, False, True]
+    with pytest.raises(ValueError):
+        await BookService(mock_db).update_books_batch([BatchUpdateBook(id=1), BatchUpdateBook(id=1)])
+
+
+@pytest.mark.asyncio
+async def test_get_all_books_cached_until_book_changes(mocker):
+    """ Тест кэша каталога: повторная страница берется из кэша до изменения книги на ней """
+    mock_db = mocker.MagicMock(spec=AsyncSession)
+    mock_db.commit = AsyncMock()
+    rows = [BookRow(id=1), BookRow(id=2)]
+    mock_db.execute = AsyncMock(return_value=mocker.MagicMock(all=lambda: rows))
+    book_service = BookService(mock_db)
+
+    first = await book_service.get_all_books(limit=2)
+    assert await book_service.get_all_books(limit=2) == first
+    assert await book_service.get_all_books_versions(limit=2) == first
+    assert mock_db.execute.await_count == 1
+
+    mock_db.scalar = AsyncMock(return_value=BorrowedBook(book_id=2, reader_id=1, is_active=False))
+    await book_service.return_particular_book_reader(book_id=2, reader_id=1)
+    await book_service.get_all_books(limit=2)
+    assert mock_db.execute.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_replica_reads_do_not_fill_catalog_cache(mocker):
+    """ Тест того, что отстающая реплика не заполняет кэш, а чтение с основной БД заполняет """
+    replica = mocker.sentinel.replica_engine
+    mocker.patch("app.services.book_service.replica_engine", replica)
+    mock_db = mocker.MagicMock(spec=AsyncSession)
+    mock_db.bind = replica
+    mock_db.execute = AsyncMock(return_value=mocker.MagicMock(one_or_none=lambda: BookRow(id=901)))
+
+    await BookService(mock_db).get_book_data(901)
+    await BookService(mock_db).get_book_data(901)
+    assert mock_db.execute.await_count == 2
+
+    mock_db.bind = mocker.sentinel.primary_engine
+    await BookService(mock_db).get_book_data(901)
+    await BookService(mock_db).get_book_data(901)
+    assert mock_db.execute.await_count == 3
+
+
+@pytest.mark.asyncio
+async def test_catalog_cache_tiers_and_notifications():
+    """ Тест двух воркеров с общим уровнем: сброс по уведомлению затрагивает только нужные страницы """
+    shared = LocalSharedCache()
+    worker, other_worker = CatalogCache(100, 60, shared), CatalogCache(100, 60, shared)
+    first_page = [{"id": 1}, {"id": 2}]
+    await worker.set(("page", "id", None, 2), (first_page, "cursor"), page_tags(first_page, "id", "cursor"), 0)
+    await worker.set(("page", "id", "cursor", 2), ([{"id": 3}], None), page_tags([{"id": 3}], "id", None), 0)
+
+    # второй воркер получает страницу из общего уровня
+    assert await other_worker.get(("page", "id", None, 2)) == (first_page, "cursor")
+
+    # уведомление получает каждый воркер, новая книга попадает только на последнюю страницу
+    for cache in (worker, other_worker):
+        await cache.handle_notification('{"op": "insert", "ids": [4], "reordered": false}')
+    assert await other_worker.get(("page", "id", "cursor", 2)) is None
+    assert await worker.get(("page", "id", None, 2)) is not None
+
+    for cache in (worker, other_worker):
+        await cache.handle_notification('{"op": "update", "ids": [2], "reordered": false}')
+    assert await other_worker.get(("page", "id", None, 2)) is None
+    assert await worker.get(("page", "id", None, 2)) is None
+
+    # значение, прочитанное до сброса, не сохраняется
+    generation = worker.generation
+    await worker.invalidate(book_tags([1]))
+    await worker.set(("book", 1), {"id": 1}, book_tags([1]), generation)
+    assert await worker.get(("book", 1)) is None
+    assert notification_tags('{"op": "update", "ids": null, "reordered": false}') == {"books"}
+
+
+@pytest.mark.asyncio
+async def test_archive_returned_in_bounded_batches(mocker):
+    """ Тест архиватора: пачка переносится одним запросом, проход заканчивается на неполной пачке """
+    mock_db = mocker.MagicMock(spec=AsyncSession)
+    mock_db.commit = AsyncMock()
+    mock_db.execute = AsyncMock(side_effect=[mocker.MagicMock(rowcount=count) for count in (2, 2, 1)])
+
+    moved = await BorrowArchiveService(mock_db).archive_returned(batch_size=2, after_days=0, pause=0)
+
+    assert moved == 5
+    assert mock_db.commit.await_count == 3
+    compiled = str(mock_db.execute.await_args.args[0].compile(dialect=postgresql.dialect()))
+    assert "DELETE FROM borrowed_book" in compiled
+    assert "FOR UPDATE SKIP LOCKED" in compiled
+    assert "INSERT INTO borrowed_book_archive" in compiled
+
+
+@pytest.mark.asyncio
+async def test_get_overdue_loans_keyset(mocker):
+    """ Тест keyset-пагинации просроченных выдач по сроку возврата и id """
+    mock_db = mocker.MagicMock(spec=AsyncSession)
+    loan = namedtuple("Loan", ["id", "due_date"])
+    mock_db.execute = AsyncMock(return_value=[loan(5, date(2026, 1, 1)), loan(9, date(2026, 1, 2))])
+    overdue_service = OverdueService(mock_db)
+
+    loans, next_cursor = await overdue_service.get_overdue_loans(limit=1)
+
+    assert [item["id"] for item in loans] == [5]
+    assert decode_cursor(next_cursor) == ["2026-01-01", 5]
+    compiled = str(mock_db.execute.await_args.args[0].compile(dialect=postgresql.dialect()))
+    assert "ORDER BY borrowed_book.due_date, borrowed_book.id" in compiled
+
+    await overdue_service.get_overdue_loans(limit=1, cursor=next_cursor)
+    compiled = str(mock_db.execute.await_args.args[0].compile(dialect=postgresql.dialect()))
+    assert "(borrowed_book.due_date, borrowed_book.id) > (" in compiled
+    for cursor in (encode_cursor(["вчера", 5]), encode_cursor(["2026-01-01"]), encode_cursor(["2026-01-01", "5"])):
+        with pytest.raises(ValueError, match="Некорректный курсор"):
+            await overdue_service.get_overdue_loans(limit=1, cursor=cursor)
+
+
+@pytest.mark.asyncio
+async def test_get_reader_dashboard_single_query(mocker):
+    """ Тест дашборда: читатель и активные выдачи с книгами приходят одним запросом """
+    mock_db = mocker.MagicMock(spec=AsyncSession)
+    row = namedtuple("Row", [
+        "id", "name", "email", "active_borrow_count",
+        "loan_id", "loan_borrow_date", "loan_return_date", "loan_due_date", "loan_is_active", "loan_book_id",
+        "loan_reader_id", "book_name", "book_author", "book_isbn",
+    ])
+    reader = (1, "Читатель", "reader@example.com", 2)
+    mock_db.execute = AsyncMock(return_value=[
+        row(*reader, 10, date(2026, 1, 1), None, date(2026, 1, 15), True, 3, 1, "Книга 3", "Автор", None),
+        row(*reader, 11, date(2026, 1, 2), None, date(2026, 1, 16), True, 4, 1, "Книга 4", "Автор", "123"),
+    ])
+    reader_service = ReaderService(mock_db)
+
+    dashboard = await reader_service.get_reader_dashboard(1)
+
+    mock_db.execute.assert_awaited_once()
+    assert dashboard["reader"] == {"id": 1, "name": "Читатель", "email": "reader@example.com", "active_borrow_count": 2}
+    assert [loan["id"] for loan in dashboard["active_loans"]] == [10, 11]
+    assert dashboard["active_loans"][1]["book"] == {"id": 4, "name": "Книга 4", "author": "Автор", "isbn": "123"}
+    compiled = str(mock_db.execute.await_args.args[0].compile(dialect=postgresql.dialect()))
+    assert "LEFT OUTER JOIN borrowed_book" in compiled and "LEFT OUTER JOIN book" in compiled
+
+    # читатель без выдач возвращается с пустым списком, несуществующий читатель - ошибка
+    mock_db.execute = AsyncMock(return_value=[row(*reader, *([None] * 10))])
+    assert (await reader_service.get_reader_dashboard(1))["active_loans"] == []
+    mock_db.execute = AsyncMock(return_value=[])
+    with pytest.raises(NoResultFound):
+        await reader_service.get_reader_dashboard(1)
+
+
+@pytest.mark.asyncio
+async def test_get_reader_history_includes_archive(mocker):
+    """ Тест истории выдач: горячая таблица и архив объединяются, страницы идут по (borrow_date, id) """
+    mock_db = mocker.MagicMock(spec=AsyncSession)
+    row = namedtuple("Row", ["id", "borrow_date", "book_id", "book_name", "book_author", "book_isbn"])
+    mock_db.execute = AsyncMock(return_value=[
+        row(9, date(2026, 2, 1), 3, "Книга 3", "Автор", None),
+        row(5, date(2026, 1, 1), 4, "Книга 4", "Автор", None),
+    ])
+    reader_service = ReaderService(mock_db)
+
+    history, next_cursor = await reader_service.get_reader_history(1, limit=1)
+
+    assert [loan["id"] for loan in history] == [9]
+    assert history[0]["book"]["name"] == "Книга 3"
+    assert decode_cursor(next_cursor) == ["2026-02-01", 9]
+    compiled = str(mock_db.execute.await_args.args[0].compile(dialect=postgresql.dialect()))
+    assert "UNION ALL" in compiled and "FROM borrowed_book_archive" in compiled
+
+    await reader_service.get_reader_history(1, limit=1, cursor=next_cursor)
+    compiled = str(mock_db.execute.await_args.args[0].compile(dialect=postgresql.dialect()))
+    assert "(borrowed_book.borrow_date, borrowed_book.id) < (" in compiled
+    assert "(borrowed_book_archive.borrow_date, borrowed_book_archive.id) < (" in compiled
+    with pytest.raises(ValueError, match="Некорректный курсор"):
+        await reader_service.get_reader_history(1, limit=1, cursor=encode_cursor(["2026-01-01"]))
+
+
+@pytest.mark.asyncio
+async def test_create_readers_batch_reports_duplicates(mocker):
+    """ Тест пакетной регистрации: один INSERT, повторы и уже зарегистрированные адреса в duplicates """
+    # по умолчанию проверяются DNS записи домена, тест не должен обращаться к сети
+    mocker.patch("app.services.email_validation.validate_email_deliverability")
+    mock_db = mocker.MagicMock(spec=AsyncSession)
+    created = namedtuple("Reader", ["id", "name", "email", "active_borrow_count"])
+    mock_db.execute = AsyncMock(return_value=[created(1, "Первый", "first@example.com", 0)])
+    mock_db.commit = AsyncMock()
+    reader_service = ReaderService(mock_db)
+
+    summary = await reader_service.create_readers_batch([
+        CreateReader(name="Первый", email="first@example.com"),
+        CreateReader(name="Зарегистрирован", email="exists@example.com"),
+        CreateReader(name="Повтор", email="first@example.com"),
+        CreateReader(name="Некорректный", email="not-an-email"),
+    ])
+
+    mock_db.execute.assert_awaited_once()
+    assert [reader["id"] for reader in summary["created"]] == [1]
+    assert summary["duplicates"] == ["first@example.com", "exists@example.com"]
+    assert [(item["index"], item["email"]) for item in summary["rejected"]] == [(3, "not-an-email")]
+    compiled = str(mock_db.execute.await_args.args[0].compile(dialect=postgresql.dialect()))
+    assert "unnest" in compiled and "ON CONFLICT (email) DO NOTHING" in compiled
+
+
+@pytest.mark.asyncio
+async def test_availability_hub_coalesces_updates(mocker):
+    """ Подписчик получает только свои книги, медленному клиенту приходит последнее значение """
+    hub = AvailabilityHub(session_maker=mocker.MagicMock())
+    hub.fetch_quantities = AsyncMock(side_effect=[{1: 3}, {1: 2}, {}])
+
+    with hub.subscribe([1]) as subscription, hub.subscribe([2]) as other:
+        await hub.handle_notification('{"op": "update", "ids": [1, 5], "reordered": false}')
+        await hub.handle_notification('{"op": "update", "ids": [1], "reordered": false}')
+        assert await subscription.wait(0) == (False, {1: 2})
+        # книга удалена
+        await hub.handle_notification('{"op": "delete", "ids": [1], "reordered": false}')
+        assert await subscription.wait(0) == (False, {1: None})
+        assert await other.wait(0) == (False, {})
+        # уведомления о книгах без подписчиков не читают БД
+        await hub.handle_notification('{"op": "update", "ids": [7], "reordered": false}')
+
+    assert hub.fetch_quantities.await_args_list[0].args == ({1},)
+    assert hub.fetch_quantities.await_count == 3
+    assert hub.subscribers == 0
+
+
+@pytest.mark.asyncio
+async def test_availability_hub_resyncs_when_fetch_fails(mocker):
+    """ Ошибка чтения количества не теряет изменения: подписчики получают resync, книги перечитываются позже """
+    hub = AvailabilityHub(session_maker=mocker.MagicMock())
+    hub.fetch_quantities = AsyncMock(side_effect=[ConnectionError("БД недоступна"), {1: 3, 2: 1}])
+
+    with hub.subscribe([1]) as subscription, hub.subscribe([3]) as other:
+        with pytest.raises(ConnectionError):
+            await hub.publish([1])
+        assert await subscription.wait(0) == (True, {})
+        assert await other.wait(0) == (False, {})
+        # следующая рассылка идет, несмотря на ошибку, и перечитывает книгу 1 вместе с новыми изменениями
+        await hub.publish([2])
+        assert await subscription.wait(0) == (False, {1: 3})
+
+    assert hub.fetch_quantities.await_args_list[1].args == ({1, 2},)
+
+
+@pytest.mark.asyncio
+async def test_availability_stream_snapshot_and_resync(mocker):
+    """ Поток начинается с текущего количества, переполнение буфера клиента заменяется событием resync """
+    hub = AvailabilityHub(session_maker=mocker.MagicMock())
+    hub.fetch_quantities = AsyncMock(return_value={1: 4})
+    stream = hub.stream([1, 2], heartbeat=0)
+
+    assert await stream.__anext__() == (
+        b'event: availability\ndata: [{"id":1,"copies_quantity":4},{"id":2,"copies_quantity":null}]\n\n'
+    )
+    assert await stream.__anext__() == b": ping\n\n"
+
+    with hub.subscribe() as catalog:
+        catalog.max_pending = 1
+        hub.fetch_quantities.return_value = {3: 1, 4: 1}
+        await hub.handle_notification('{"op": "update", "ids": [3, 4], "reordered": false}')
+        assert await catalog.wait(0) == (True, {})
+        await hub.handle_notification('{"op": "update", "ids": null, "reordered": true}')
+        assert (await catalog.wait(0))[0] is True
+    await stream.aclose()
+    assert hub.subscribers == 0
 
-    assert borrowed_book.return_date == date.today()
-    assert borrowed_book.is_active is False
\ No newline at end of file